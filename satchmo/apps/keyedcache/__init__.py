@@ -1,20 +1,27 @@
 """A full cache system written on top of Django's rudimentary one."""
 
 from django.conf import settings
-from django.core.cache import cache
+from django.core.cache import cache as backend_cache
 from django.utils.encoding import smart_str
 import cPickle as pickle
 import md5
+import threading
+import time
 import types
 import logging
+from keyedcache.lru import LRUCache
+from keyedcache.stats import CacheStats, TimedBackend
 from satchmo_utils import is_string_like, is_list_or_tuple
 
 log = logging.getLogger('keyedcache')
 
-CACHED_KEYS = {}
 CACHE_CALLS = 0
 CACHE_HITS = 0
 KEY_DELIM = "::"
+GENERATION_DELIM = "@"
+# Generation counters should outlive any value stored under them.  This is
+# the longest relative expiry memcached accepts.
+GENERATION_TIMEOUT = 60*60*24*30
 try:
     CACHE_PREFIX = settings.CACHE_PREFIX
 except AttributeError:
@@ -23,10 +30,54 @@ except AttributeError:
 
 _CACHE_ENABLED = settings.CACHE_TIMEOUT > 0
 
+# Optional in-process LRU tier, consulted before the shared backend.
+# CACHE_LOCAL_SIZE is the maximum number of entries (0 disables the tier),
+# CACHE_LOCAL_TIMEOUT the number of seconds a value may be served locally
+# before going back to the shared backend.  Values are held pickled, so that
+# like the shared backend every get returns a copy which its caller may
+# change without touching what other requests and threads see.
+LOCAL_CACHE = LRUCache(size=getattr(settings, 'CACHE_LOCAL_SIZE', 0),
+    timeout=getattr(settings, 'CACHE_LOCAL_TIMEOUT', 5))
+
+# The namespace generations this process has looked up.  Always on, so that
+# building a key doesn't cost a round trip to the backend every time, and
+# kept only briefly: a namespace invalidated by another process is seen here
+# after at most CACHE_GENERATIONS_TIMEOUT seconds.  Invalidations made by
+# this process are seen at once.
+GENERATIONS = LRUCache(size=getattr(settings, 'CACHE_GENERATIONS_SIZE', 1000),
+    timeout=getattr(settings, 'CACHE_GENERATIONS_TIMEOUT', 2))
+
+# How many key levels below CACHE_PREFIX carry a generation.  With the
+# default of 1, "prefix::Product::5::price" is built with the generations of
+# "prefix" and "prefix::Product" only, so the few namespaces stay in
+# GENERATIONS.  Deleting the children of a deeper key invalidates the whole
+# namespace at that depth.
+GENERATION_DEPTH = max(getattr(settings, 'CACHE_GENERATION_DEPTH', 1), 0)
+
+# The VersionedSnapshots loaded by this process, by their version key.
+SNAPSHOTS = {}
+
+# Per group counters and backend latencies, see keyedcache.stats.
+STATS = CacheStats(CACHE_PREFIX + KEY_DELIM, KEY_DELIM,
+    size=getattr(settings, 'CACHE_STATS_KEYS', 100))
+cache = TimedBackend(backend_cache, STATS)
+
+# The keys most recently set or found by this process, for the admin views.
+# Bounded, since deletes no longer need to know every key ever set.
+CACHED_KEYS = LRUCache(size=getattr(settings, 'CACHE_KEYS_TRACKED', 1000),
+    timeout=max(settings.CACHE_TIMEOUT, 1))
+
 class CacheWrapper(object):
-    def __init__(self, val, inprocess=False):
+    def __init__(self, val, inprocess=False, expires=None):
         self.val = val
         self.inprocess = inprocess
+        # when set, the time after which the value is stale and should be
+        # recomputed, though it may still be served while that happens.
+        self.expires = expires
+
+    def is_stale(self):
+        expires = getattr(self, 'expires', None)
+        return expires is not None and expires < time.time()
 
     def __str__(self):
         return str(self.val)
@@ -55,44 +106,42 @@ class CacheNotRespondingError(Exception):
     pass
     
 def cache_delete(*keys, **kwargs):
+    """Delete a key from the cache.
+
+    With `children=True`, every key below it is invalidated too, in every
+    process, by bumping the generation of its namespace.  Called with no
+    keys, the whole cache is invalidated.
+    """
     removed = []
     if cache_enabled():
-        global CACHED_KEYS
         log.debug('cache_delete')
         children = kwargs.pop('children',False)
 
         if (keys or kwargs):
             key = cache_key(*keys, **kwargs)
-    
-            if CACHED_KEYS.has_key(key):
-                del CACHED_KEYS[key]
-                removed.append(key)
+            physical = _physical_keys([key])[key]
 
-            cache.delete(key)
+            cache.delete(physical)
+            LOCAL_CACHE.delete(physical)
+            CACHED_KEYS.delete(key)
+            STATS.delete(key)
+            removed.append(key)
 
             if children:
-                key = key + KEY_DELIM
-                children = [x for x in CACHED_KEYS.keys() if x.startswith(key)]
-                for k in children:
-                    del CACHED_KEYS[k]
-                    cache.delete(k)
-                    removed.append(k)
+                _bump_generation(key)
+                prefix = key + KEY_DELIM
+                LOCAL_CACHE.delete_prefix(prefix)
+                CACHED_KEYS.delete_prefix(prefix)
+                removed.append(prefix + '*')
         else:
             key = "All Keys"
-            deleteneeded = _cache_flush_all()
-        
-            removed = CACHED_KEYS.keys()
-
-            if deleteneeded:
-                for k in CACHED_KEYS:
-                    cache.delete(k)
-            
-            CACHED_KEYS = {}
+            _bump_generation(CACHE_PREFIX)
+            LOCAL_CACHE.clear()
+            SNAPSHOTS.clear()
+            CACHED_KEYS.clear()
+            removed.append(key)
 
-        if removed:
-            log.debug("Cache delete: %s", removed)
-        else:
-            log.debug("No cached objects to delete for %s", key)
+        log.debug("Cache delete: %s", removed)
 
     return removed
 
@@ -108,13 +157,93 @@ def cache_enable(state=True):
     global _CACHE_ENABLED
     _CACHE_ENABLED=state
 
-def _cache_flush_all():
-    if is_memcached_backend():
-        cache._cache.flush_all()
-        return False
-    return True
+def _generation_key(namespace):
+    return GENERATION_DELIM + namespace
 
-def cache_function(length=settings.CACHE_TIMEOUT):
+def _namespaces(key):
+    """Return the namespaces with a generation a built key lives in,
+    outermost first.
+
+    "prefix::a::b" lives in "prefix" and "prefix::a", and with a
+    GENERATION_DEPTH of 1 so does "prefix::a::b::c".
+    """
+    parts = key.split(KEY_DELIM)
+    depth = min(len(parts), GENERATION_DEPTH + 2)
+    return [KEY_DELIM.join(parts[:i]) for i in range(1, depth)]
+
+def _generation_namespace(key):
+    """The namespace whose generation invalidates everything below `key`."""
+    return KEY_DELIM.join(key.split(KEY_DELIM)[:GENERATION_DEPTH + 1])
+
+def _new_generation(current=0):
+    # Seed from the clock, so that a counter which was evicted from the cache
+    # never restarts at a value that an old key was built with.
+    return max(int(time.time()*1000), current+1)
+
+def _local_get(physical):
+    """The CacheWrapper held locally for a physical key, or None."""
+    data = LOCAL_CACHE.get(physical)
+    if data is None:
+        return None
+    return pickle.loads(data)
+
+def _local_set(physical, obj, length=None):
+    if LOCAL_CACHE.size <= 0:
+        return
+    try:
+        data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError), e:
+        log.debug('not keeping %s locally: %s', physical, e)
+        LOCAL_CACHE.delete(physical)
+        return
+    LOCAL_CACHE.set(physical, data, length)
+
+def _physical_keys(keys):
+    """Map each built key to the key actually stored in the backend.
+
+    The stored key carries the current generation of every namespace the key
+    lives in, so bumping a namespace orphans every key below it.  The
+    generations not held in `GENERATIONS` are fetched with one call to the
+    backend.
+    """
+    generations = {}
+    wanted = []
+    for key in keys:
+        for ns in _namespaces(key):
+            gk = _generation_key(ns)
+            if gk not in generations:
+                generations[gk] = GENERATIONS.get(gk)
+                if generations[gk] is None:
+                    wanted.append(gk)
+
+    if wanted:
+        found = cache.get_many(wanted)
+        for gk in wanted:
+            gen = found.get(gk, None)
+            if gen is None:
+                gen = _new_generation()
+                if not cache.add(gk, gen, GENERATION_TIMEOUT):
+                    # lost the race to another process, use its value
+                    gen = cache.get(gk, gen)
+            generations[gk] = gen
+            GENERATIONS.set(gk, gen)
+
+    physical = {}
+    for key in keys:
+        gens = [str(generations[_generation_key(ns)]) for ns in _namespaces(key)]
+        physical[key] = key + GENERATION_DELIM + ".".join(gens)
+    return physical
+
+def _bump_generation(namespace):
+    """Invalidate everything in a namespace, in every process, in O(1)."""
+    namespace = _generation_namespace(namespace)
+    gk = _generation_key(namespace)
+    gen = _new_generation(cache.get(gk, 0))
+    cache.set(gk, gen, GENERATION_TIMEOUT)
+    GENERATIONS.set(gk, gen)
+    log.debug('namespace %s now at generation %s', namespace, gen)
+
+def cache_function(length=settings.CACHE_TIMEOUT, stale=0, wait=2, lease=60, background=False):
     """
     A variant of the snippet posted by Jeff Wheeler at
     http://www.djangosnippets.org/snippets/109/
@@ -131,11 +260,24 @@ def cache_function(length=settings.CACHE_TIMEOUT):
     threads, you won't be able to get the previous value, and will need to
     wait until the function finishes. If this is not desired behavior, you can
     remove the first two lines after the ``else``.
+
+    Expensive functions should pass ``stale``, the number of seconds past
+    ``length`` that the old value may still be served.  Only the caller which
+    takes a short lease (``lease`` seconds) recomputes the value; everyone
+    else keeps getting the old value, or on a cold miss waits up to ``wait``
+    seconds for the lease holder before giving up and computing it too.
+    With ``background=True`` the lease holder also returns the old value and
+    recomputes in a separate thread.
     """
     def decorator(func):
         def inner_func(*args, **kwargs):
             if not cache_enabled():
                 value = func(*args, **kwargs)
+
+            elif stale:
+                key = cache_key('func', func.__name__, func.__module__, args, kwargs)
+                value = _cache_call_locked(key, func, args, kwargs,
+                    length, stale, wait, lease, background)
                 
             else:        
                 try:
@@ -155,9 +297,67 @@ def cache_function(length=settings.CACHE_TIMEOUT):
                     value = func(*args, **kwargs)
 
             return value
+        # keep the wrapped name, so that cache_delete_function finds its keys
+        inner_func.__name__ = func.__name__
+        inner_func.__doc__ = func.__doc__
         return inner_func
     return decorator
 
+def _lease_key(key):
+    return _physical_keys([key])[key] + GENERATION_DELIM + 'lease'
+
+def _cache_call_locked(key, func, args, kwargs, length, stale, wait, lease, background):
+    """Serve `key` from the cache, letting only one caller at a time
+    recompute it.  See `cache_function`."""
+    obj = _cache_get_wrapper(key)
+    if obj is not None and not obj.inprocess and obj.is_stale():
+        # the local tier may be behind a refresh done by another process
+        obj = _cache_get_wrapper(key, local=False) or obj
+
+    if obj is not None and not obj.inprocess:
+        if not obj.is_stale():
+            return obj.val
+
+        if cache.add(_lease_key(key), True, lease):
+            if background:
+                log.debug('refreshing %s in the background', key)
+                t = threading.Thread(target=_cache_refresh,
+                    args=(key, func, args, kwargs, length, stale, True))
+                t.setDaemon(True)
+                t.start()
+            else:
+                return _cache_refresh(key, func, args, kwargs, length, stale)
+        else:
+            log.debug('serving stale value for %s while it is refreshed', key)
+        return obj.val
+
+    if cache.add(_lease_key(key), True, lease):
+        return _cache_refresh(key, func, args, kwargs, length, stale)
+
+    # another caller holds the lease, give it a chance to finish
+    deadline = time.time() + wait
+    while time.time() < deadline:
+        time.sleep(0.05)
+        obj = _cache_get_wrapper(key)
+        if obj is not None and not obj.inprocess:
+            return obj.val
+
+    log.debug('gave up waiting for %s', key)
+    return func(*args, **kwargs)
+
+def _cache_refresh(key, func, args, kwargs, length, stale, threaded=False):
+    try:
+        value = func(*args, **kwargs)
+        wrapper = CacheWrapper(value, expires=time.time() + length)
+        cache_set(key, value=wrapper, length=length + stale)
+        return value
+    finally:
+        cache.delete(_lease_key(key))
+        if threaded:
+            # threads get their own database connection, don't leak it
+            from django.db import connection
+            connection.close()
+
 
 def cache_get(*keys, **kwargs):
     if kwargs.has_key('default'):
@@ -171,75 +371,178 @@ def cache_get(*keys, **kwargs):
     if not cache_enabled():
         raise NotCachedError(key)
     else:
-        global CACHE_CALLS, CACHE_HITS
-        CACHE_CALLS += 1
-        if CACHE_CALLS == 1:
-            cache_require()
-        
-        obj = cache.get(key)
-        if obj and isinstance(obj, CacheWrapper):
-            CACHE_HITS += 1
-            CACHED_KEYS[key] = True
-            log.debug('got cached [%i/%i]: %s', CACHE_CALLS, CACHE_HITS, key)
+        obj = _cache_get_wrapper(key)
+        if obj is not None:
             if obj.inprocess:
                 raise MethodNotFinishedError(obj.val)
             
             return obj.val
         else:
-            try:
-                del CACHED_KEYS[key]
-            except KeyError:
-                pass
-
             if use_default:
                 return default_value
     
             raise NotCachedError(key)
 
+def _cache_get_wrapper(key, local=True):
+    """Return the CacheWrapper stored for a built key, or None."""
+    global CACHE_CALLS, CACHE_HITS
+    CACHE_CALLS += 1
+    if CACHE_CALLS == 1:
+        cache_require()
+
+    physical = _physical_keys([key])[key]
+    obj = None
+    if local:
+        obj = _local_get(physical)
+    was_local = obj is not None
+    if obj is None:
+        obj = cache.get(physical)
+        if obj and isinstance(obj, CacheWrapper) and not obj.inprocess:
+            _local_set(physical, obj)
+    if obj and isinstance(obj, CacheWrapper):
+        CACHE_HITS += 1
+        CACHED_KEYS.set(key, True)
+        STATS.hit(key, local=was_local)
+        log.debug('got cached [%i/%i]: %s', CACHE_CALLS, CACHE_HITS, key)
+        return obj
+
+    CACHED_KEYS.delete(key)
+    STATS.miss(key)
+    return None
+
+
+def cache_get_many(keys):
+    """Look up several keys with a single call to the backend.
+
+    Each entry in `keys` is anything accepted by `cache_key`, such as a string
+    or a list of key parts.  Returns a tuple of (found, missing), where
+    `found` is a dictionary of built key to value and `missing` is a list of
+    the built keys which were not in the cache, suitable for passing to
+    `cache_set_many` once the values have been computed.  Functions still
+    being processed by `cache_function` are reported as missing.
+    """
+    built = [cache_key(k) for k in keys]
+    found = {}
+
+    if not cache_enabled():
+        return found, built
+
+    global CACHE_CALLS, CACHE_HITS
+    CACHE_CALLS += len(built)
+    if CACHE_CALLS == len(built):
+        cache_require()
+
+    physical = _physical_keys(built)
+    remote = {}
+    local = {}
+    for key in built:
+        obj = _local_get(physical[key])
+        if obj is None:
+            remote[physical[key]] = key
+        else:
+            found[key] = local[key] = obj
+
+    if remote:
+        for pkey, obj in cache.get_many(remote.keys()).items():
+            if isinstance(obj, CacheWrapper) and not obj.inprocess:
+                _local_set(pkey, obj)
+                found[remote[pkey]] = obj
+
+    missing = []
+    for key in built:
+        if key in found:
+            CACHE_HITS += 1
+            CACHED_KEYS.set(key, True)
+            STATS.hit(key, local=key in local)
+            found[key] = found[key].val
+        else:
+            CACHED_KEYS.delete(key)
+            STATS.miss(key)
+            missing.append(key)
+
+    log.debug('got cached many [%i/%i]: %i found, %i missing', CACHE_CALLS, CACHE_HITS, len(found), len(missing))
+    return found, missing
+
 
 def cache_set(*keys, **kwargs):
     """Set an object into the cache."""
     if cache_enabled():
-        global CACHED_KEYS
         obj = kwargs.pop('value')
         length = kwargs.pop('length', settings.CACHE_TIMEOUT)
         skiplog = kwargs.pop('skiplog', False)
 
         key = cache_key(keys, **kwargs)
+        physical = _physical_keys([key])[key]
         val = CacheWrapper.wrap(obj)
         if not skiplog:
             log.debug('setting cache: %s', key)
-        cache.set(key, val, length)
-        CACHED_KEYS[key] = True
+        cache.set(physical, val, length)
+        if val.inprocess:
+            LOCAL_CACHE.delete(physical)
+        else:
+            _local_set(physical, val, length)
+        CACHED_KEYS.set(key, True)
+        STATS.set(key)
 
 
+def cache_set_many(mapping, length=settings.CACHE_TIMEOUT):
+    """Set several objects into the cache at once.
+
+    `mapping` is a dictionary of key to value, where each key is a string
+    or a tuple of key parts as accepted by `cache_key`.  Uses the backend's
+    `set_many` when it has one.
+    """
+    if cache_enabled():
+        built = dict([(cache_key(k), obj) for k, obj in mapping.items()])
+        physical = _physical_keys(built.keys())
+        data = {}
+        for key, obj in built.items():
+            val = CacheWrapper.wrap(obj)
+            data[physical[key]] = val
+            _local_set(physical[key], val, length)
+            CACHED_KEYS.set(key, True)
+            STATS.set(key)
+
+        log.debug('setting cache many: %s', data.keys())
+        set_many = getattr(cache, 'set_many', None)
+        if set_many is not None:
+            set_many(data, length)
+        else:
+            for key, val in data.items():
+                cache.set(key, val, length)
+
+
+_SCALAR_TYPES = frozenset([types.StringType, types.UnicodeType, types.IntType, types.LongType, types.FloatType])
+_STRUCTURE_TYPES = frozenset([types.TupleType, types.ListType, types.DictType])
 
 def _hash_or_string(key):
-    if is_string_like(key) or isinstance(key, (types.IntType, types.LongType, types.FloatType)):
+    t = type(key)
+    if t in _SCALAR_TYPES:
+        return smart_str(key)
+    elif t in _STRUCTURE_TYPES:
+        return structural_hash(key)
+    elif is_string_like(key):
         return smart_str(key)
     else:
         try:
             #if it has a PK, use it.
             return str(key._get_pk_val())
         except AttributeError:
-            return md5_hash(key)
+            return structural_hash(key)
 
 def cache_contains(*keys, **kwargs):
     key = cache_key(keys, **kwargs)
-    return CACHED_KEYS.has_key(key)
+    return key in CACHED_KEYS
+
+is_cached = cache_contains
 
 def cache_key(*keys, **pairs):
     """Smart key maker, returns the object itself if a key, else a list 
     delimited by ':', automatically hashing any non-scalar objects."""
 
-    if is_string_like(keys):
-        keys = [keys]
-        
-    if is_list_or_tuple(keys):
-        if len(keys) == 1 and is_list_or_tuple(keys[0]):
-            keys = keys[0]
-    else:
-        keys = [md5_hash(keys)]
+    # keys is always a tuple here, unwrap a single list or tuple of keys
+    if len(keys) == 1 and is_list_or_tuple(keys[0]):
+        keys = keys[0]
 
     if pairs:
         keys = list(keys)
@@ -259,6 +562,64 @@ def md5_hash(obj):
     pickled = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
     return md5.new(pickled).hexdigest()
 
+def structural_hash(obj):
+    """Hash an object by a stable encoding of its structure.
+
+    Cheaper than pickling for the argument tuples and dictionaries of
+    `cache_function`, and stable across processes since dictionaries are
+    encoded in sorted order.  Model instances are encoded by class and
+    primary key, anything unrecognized falls back to `md5_hash`.
+    """
+    return md5.new(_encode(obj)).hexdigest()
+
+# Types whose repr is stable, and which can be encoded by repr in C.
+_REPR_TYPES = frozenset([types.StringType, types.UnicodeType, types.IntType,
+    types.LongType, types.FloatType, types.BooleanType, types.NoneType])
+
+# Labels for model classes, so each class is only introspected once.
+_CLASS_LABELS = {}
+
+def _encode(obj):
+    t = type(obj)
+    if t in _REPR_TYPES:
+        return repr(obj)
+
+    elif t is types.TupleType or t is types.ListType:
+        for item in obj:
+            if type(item) not in _REPR_TYPES:
+                if t is types.TupleType:
+                    return "(" + ",".join([_encode(x) for x in obj]) + ")"
+                return "[" + ",".join([_encode(x) for x in obj]) + "]"
+        return repr(obj)
+
+    elif t is types.DictType:
+        items = obj.items()
+        items.sort()
+        for k, v in items:
+            if type(k) not in _REPR_TYPES or type(v) not in _REPR_TYPES:
+                return "{" + ",".join(["%s:%s" % (_encode(k), _encode(v)) for k, v in items]) + "}"
+        return "{" + repr(items) + "}"
+
+    elif isinstance(obj, types.StringType):
+        # subclasses, such as SafeString
+        return repr(str(obj))
+
+    elif isinstance(obj, types.UnicodeType):
+        return repr(unicode(obj))
+
+    try:
+        label = _CLASS_LABELS[t]
+    except KeyError:
+        if hasattr(obj, '_get_pk_val'):
+            label = "<%s.%s:" % (t.__module__, t.__name__)
+        else:
+            label = None
+        _CLASS_LABELS[t] = label
+
+    if label is not None:
+        return label + repr(obj._get_pk_val())
+    return md5_hash(obj)
+
 
 def is_memcached_backend():
     try:
@@ -0,0 +1,134 @@
+"""A small, thread-safe, size-bounded LRU with per-entry expiry.
+
+Used by keyedcache as an optional in-process tier in front of the shared
+Django cache backend.  Keys are the fully built keyedcache keys, so
+invalidation by key or by key prefix mirrors the shared backend.
+"""
+
+import threading
+import time
+
+_MISSING = object()
+
+class LRUCache(object):
+    """Least-recently-used cache holding at most `size` entries, each of
+    which expires `timeout` seconds after it was set.
+
+    Entries are kept in a doubly-linked list, most recently used at the head,
+    so get, set and eviction are all O(1).
+    """
+
+    def __init__(self, size=500, timeout=5):
+        self.size = size
+        self.timeout = timeout
+        self._map = {}
+        # sentinel node: [prev, next, key, value, expires]
+        self._root = root = []
+        root[:] = [root, root, None, None, None]
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._map)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def _unlink(self, node):
+        prev, nxt = node[0], node[1]
+        prev[1] = nxt
+        nxt[0] = prev
+
+    def _push_front(self, node):
+        root = self._root
+        first = root[1]
+        node[0] = root
+        node[1] = first
+        first[0] = node
+        root[1] = node
+
+    def get(self, key, default=None):
+        """Return the value for `key`, or `default` if missing or expired."""
+        self._lock.acquire()
+        try:
+            node = self._map.get(key, None)
+            if node is None:
+                return default
+
+            if node[4] < time.time():
+                self._unlink(node)
+                del self._map[key]
+                return default
+
+            self._unlink(node)
+            self._push_front(node)
+            return node[3]
+        finally:
+            self._lock.release()
+
+    def set(self, key, value, timeout=None):
+        """Store `value` under `key`, evicting the least recently used entry
+        if the cache is full.  `timeout` is capped at the cache timeout."""
+        if self.size <= 0:
+            return
+
+        if timeout is None or timeout > self.timeout:
+            timeout = self.timeout
+        expires = time.time() + timeout
+
+        self._lock.acquire()
+        try:
+            node = self._map.get(key, None)
+            if node is not None:
+                self._unlink(node)
+                node[3] = value
+                node[4] = expires
+            else:
+                node = [None, None, key, value, expires]
+                self._map[key] = node
+                if len(self._map) > self.size:
+                    oldest = self._root[0]
+                    self._unlink(oldest)
+                    del self._map[oldest[2]]
+            self._push_front(node)
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        """Remove `key`, returning True if it was present."""
+        self._lock.acquire()
+        try:
+            node = self._map.pop(key, None)
+            if node is None:
+                return False
+            self._unlink(node)
+            return True
+        finally:
+            self._lock.release()
+
+    def delete_prefix(self, prefix):
+        """Remove every key starting with `prefix`, returning the removed keys."""
+        self._lock.acquire()
+        try:
+            removed = [k for k in self._map.keys() if k.startswith(prefix)]
+            for k in removed:
+                self._unlink(self._map.pop(k))
+            return removed
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._map.clear()
+            root = self._root
+            root[0] = root
+            root[1] = root
+        finally:
+            self._lock.release()
+
+    def keys(self):
+        self._lock.acquire()
+        try:
+            return self._map.keys()
+        finally:
+            self._lock.release()
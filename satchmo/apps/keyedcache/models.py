@@ -1,5 +1,7 @@
+from django.conf import settings
 import keyedcache
 import logging
+import time
 
 log = logging.getLogger('keyedcache')
 
@@ -16,6 +18,16 @@ class CachedObjectMixin(object):
         return keyedcache.cache_get(key)
 
     def cache_key(self, *args, **kwargs):
+        if not (args or kwargs):
+            # the bare key is built on every cache call, remember it per pk
+            pk = self._get_pk_val()
+            memo = self.__dict__.get('_cache_key_memo', None)
+            if memo is not None and memo[0] == pk:
+                return memo[1]
+            key = keyedcache.cache_key([self.__class__.__name__, self])
+            self._cache_key_memo = (pk, key)
+            return key
+
         keys = [self.__class__.__name__, self]
         keys.extend(args)
         return keyedcache.cache_key(keys, **kwargs)
@@ -32,6 +44,65 @@ class CachedObjectMixin(object):
     def is_cached(self, *args, **kwargs):
         return keyedcache.is_cached(self.cache_key(*args, **kwargs))
         
+class VersionedSnapshot(object):
+    """Data loaded once into each process and shared by every request, such
+    as the settings or the category tree of a site.
+
+    Subclasses set `cache_name` and load their data in `__init__`, which
+    takes the same arguments as `get` and `invalidate`, so that a class can
+    hold a snapshot per site.  `invalidate` stamps a new version in the
+    shared cache, and each process loads a fresh snapshot when it sees the
+    stamp change, or when `is_current` returns False.
+
+    The stamp is looked at no more than once every `check_interval` seconds,
+    so most reads are served from memory alone.  Changes made in this process
+    are seen at once, those made in others within `check_interval` seconds.
+    """
+
+    cache_name = None
+    check_interval = getattr(settings, 'CACHE_SNAPSHOT_INTERVAL', 1)
+
+    def is_current(self):
+        """Whether the snapshot is still good, other than by its version."""
+        return True
+
+    def _stamp_key(cls, args):
+        return keyedcache.cache_key((cls.cache_name,) + args)
+
+    _stamp_key = classmethod(_stamp_key)
+
+    def get(cls, *args):
+        """Get the current snapshot, loading it if needed."""
+        key = cls._stamp_key(args)
+        snapshot = keyedcache.SNAPSHOTS.get(key, None)
+        now = time.time()
+        if snapshot is not None and now < snapshot.checked + cls.check_interval \
+            and snapshot.is_current():
+            return snapshot
+
+        try:
+            version = keyedcache.cache_get(key)
+        except keyedcache.NotCachedError:
+            version = time.time()
+            keyedcache.cache_set(key, value=version)
+
+        if snapshot is None or snapshot.version != version or not snapshot.is_current():
+            snapshot = cls(*args)
+            snapshot.version = version
+            keyedcache.SNAPSHOTS[key] = snapshot
+        snapshot.checked = now
+        return snapshot
+
+    get = classmethod(get)
+
+    def invalidate(cls, *args):
+        """Make every process reload the snapshot."""
+        key = cls._stamp_key(args)
+        keyedcache.SNAPSHOTS.pop(key, None)
+        keyedcache.cache_set(key, value=time.time())
+
+    invalidate = classmethod(invalidate)
+
 def find_by_id(cls, groupkey, objectid, raises=False):
     """A helper function to look up an object by id"""
     ob = None
@@ -0,0 +1,162 @@
+"""Per key group statistics for keyedcache.
+
+Counts hits, misses, sets and deletes per key group, keeps latency
+histograms for the calls made to the cache backend, and tracks the most
+requested and most often missing keys.  A key's group is its first part
+after the cache prefix, such as "Setting" or "BESTSELLERS", and for cached
+functions also the function name, as in "func::bestsellers".
+"""
+
+import time
+
+# Upper bounds of the latency histogram buckets, in milliseconds.
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+class KeyCounter(object):
+    """Approximate top-N counter which never holds more than 2 * `size` keys.
+
+    When full, only the `size` most frequent keys are kept, so keys which are
+    hot now will quickly reach the top again.
+    """
+
+    def __init__(self, size=100):
+        self.size = size
+        self.counts = {}
+
+    def add(self, key):
+        counts = self.counts
+        counts[key] = counts.get(key, 0) + 1
+        if len(counts) > self.size * 2:
+            self.counts = dict(self.top(self.size))
+
+    def top(self, n):
+        work = [(ct, key) for key, ct in self.counts.items()]
+        work.sort()
+        work.reverse()
+        return [(key, ct) for ct, key in work[:n]]
+
+class CacheStats(object):
+
+    def __init__(self, prefix, delim, size=100):
+        self.prefix = prefix
+        self.delim = delim
+        self.size = size
+        self.reset()
+
+    def reset(self):
+        self.groups = {}
+        self.latency = {}
+        self.hot = KeyCounter(self.size)
+        self.missing = KeyCounter(self.size)
+        self.started = time.time()
+
+    def group(self, key):
+        if key.startswith(self.prefix):
+            key = key[len(self.prefix):]
+        parts = key.split(self.delim, 2)
+        if parts[0] == 'func' and len(parts) > 1:
+            return self.delim.join(parts[:2])
+        return parts[0]
+
+    def _count(self, key, field):
+        group = self.group(key)
+        try:
+            counts = self.groups[group]
+        except KeyError:
+            counts = self.groups[group] = {'hits' : 0, 'local_hits' : 0,
+                'misses' : 0, 'sets' : 0, 'deletes' : 0}
+        counts[field] += 1
+
+    def hit(self, key, local=False):
+        self._count(key, 'hits')
+        if local:
+            self._count(key, 'local_hits')
+        self.hot.add(key)
+
+    def miss(self, key):
+        self._count(key, 'misses')
+        self.hot.add(key)
+        self.missing.add(key)
+
+    def set(self, key):
+        self._count(key, 'sets')
+
+    def delete(self, key):
+        self._count(key, 'deletes')
+
+    def timed(self, op, seconds):
+        """Record the duration of one call to the backend."""
+        try:
+            buckets = self.latency[op]
+        except KeyError:
+            buckets = self.latency[op] = [0] * (len(LATENCY_BUCKETS) + 1)
+
+        ms = seconds * 1000
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if ms <= bound:
+                buckets[i] += 1
+                break
+        else:
+            buckets[-1] += 1
+
+    def as_dict(self, top=20):
+        """Return all statistics as plain lists and dictionaries, suitable
+        for templates and for serializing to JSON."""
+        groups = []
+        for name, counts in self.groups.items():
+            counts = counts.copy()
+            counts['group'] = name
+            reads = counts['hits'] + counts['misses']
+            if reads:
+                counts['hit_rate'] = round(float(counts['hits'])/reads*100, 1)
+            else:
+                counts['hit_rate'] = 0
+            groups.append((reads, name, counts))
+        groups.sort()
+        groups.reverse()
+
+        labels = ["<=%ims" % b for b in LATENCY_BUCKETS] + [">%ims" % LATENCY_BUCKETS[-1]]
+        latency = []
+        ops = self.latency.keys()
+        ops.sort()
+        for op in ops:
+            buckets = self.latency[op]
+            latency.append({
+                'op' : op,
+                'calls' : sum(buckets),
+                'buckets' : zip(labels, buckets),
+                })
+
+        return {
+            'since' : self.started,
+            'groups' : [g[2] for g in groups],
+            'latency' : latency,
+            'latency_labels' : labels,
+            'hot' : self.hot.top(top),
+            'missing' : self.missing.top(top),
+            }
+
+class TimedBackend(object):
+    """Wraps a Django cache backend, timing the calls made to it."""
+
+    TIMED = ('get', 'get_many', 'set', 'set_many', 'add', 'delete')
+
+    def __init__(self, backend, stats):
+        self._backend = backend
+        self._stats = stats
+
+    def __getattr__(self, name):
+        attr = getattr(self._backend, name)
+        if name not in self.TIMED:
+            return attr
+
+        stats = self._stats
+        def timed(*args, **kwargs):
+            start = time.time()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                stats.timed(name, time.time() - start)
+        # found by normal lookup from now on
+        setattr(self, name, timed)
+        return timed
@@ -1,11 +1,17 @@
 # -*- coding: UTF-8 -*-
+from django.core.cache import cache
 from django.http import Http404
+from keyedcache.lru import LRUCache
+from keyedcache.models import VersionedSnapshot
 import keyedcache
+import logging
 import random
 from django.test import TestCase
 import re
 import time
 
+log = logging.getLogger('keyedcache.tests')
+
 CACHE_HIT=0
 
 def cachetest(a,b,c):
@@ -43,6 +49,44 @@ class DecoratorTest(TestCase):
         after = cachetest(10,20,30)
         self.assertNotEqual(orig,keyedcache)
 
+SLOW_HIT=0
+
+def slowtest(a):
+    global SLOW_HIT
+    SLOW_HIT += 1
+    return [a, SLOW_HIT]
+
+slowtest = keyedcache.cache_function(1, stale=30, wait=1)(slowtest)
+
+class LockedDecoratorTest(TestCase):
+
+    def _lease(self, a):
+        key = keyedcache.cache_key('func', slowtest.__name__, slowtest.__module__, (a,), {})
+        return keyedcache._lease_key(key)
+
+    def testServeStale(self):
+        d = slowtest(1)
+        self.assertEqual(slowtest(1), d)
+        time.sleep(2)
+        # someone else is recomputing, so the stale value is served
+        cache.add(self._lease(1), True, 10)
+        self.assertEqual(slowtest(1), d)
+        cache.delete(self._lease(1))
+        # now this caller gets the lease and recomputes
+        d2 = slowtest(1)
+        self.assertNotEqual(d, d2)
+        self.assertEqual(slowtest(1), d2)
+
+    def testColdMissWaits(self):
+        cache.add(self._lease(2), True, 10)
+        start = time.time()
+        hits = SLOW_HIT
+        d = slowtest(2)
+        # waited for the lease holder, then gave up and computed it
+        self.assert_(time.time() - start >= 1)
+        self.assertEqual(SLOW_HIT, hits + 1)
+        cache.delete(self._lease(2))
+
 class CachingTest(TestCase):
     
     def testCacheGetFail(self):
@@ -110,6 +154,104 @@ class CachingTest(TestCase):
                 self.assertFalse(keyedcache.cache_get('del', 'x', x, 'y', y, default=False))
 
 
+class TestCacheMany(TestCase):
+
+    def testGetMany(self):
+        keyedcache.cache_set('many', 1, value='one')
+        keyedcache.cache_set('many', 2, value='two')
+        found, missing = keyedcache.cache_get_many([('many', 1), ('many', 2), ('many', 3)])
+        self.assertEqual(found, {
+            keyedcache.cache_key('many', 1) : 'one',
+            keyedcache.cache_key('many', 2) : 'two'})
+        self.assertEqual(missing, [keyedcache.cache_key('many', 3)])
+
+    def testSetMany(self):
+        keyedcache.cache_set_many({('setmany', 1) : 'one', 'setmany2' : [2]})
+        self.assertEqual(keyedcache.cache_get('setmany', 1), 'one')
+        self.assertEqual(keyedcache.cache_get('setmany2'), [2])
+
+    def testRoundTrip(self):
+        found, missing = keyedcache.cache_get_many([('trip', x) for x in range(0,5)])
+        self.assertEqual(found, {})
+        keyedcache.cache_set_many(dict([(k, k) for k in missing]))
+        found, missing = keyedcache.cache_get_many([('trip', x) for x in range(0,5)])
+        self.assertEqual(len(found), 5)
+        self.assertEqual(missing, [])
+
+    def testCounters(self):
+        keyedcache.cache_set('count', 1, value=True)
+        calls = keyedcache.CACHE_CALLS
+        hits = keyedcache.CACHE_HITS
+        keyedcache.cache_get_many([('count', 1), ('count', 2)])
+        self.assertEqual(keyedcache.CACHE_CALLS, calls + 2)
+        self.assertEqual(keyedcache.CACHE_HITS, hits + 1)
+
+class TestNamespaces(TestCase):
+
+    def testChildrenSetElsewhere(self):
+        keyedcache.cache_set('ns', 'x', 1, value=True)
+        keyedcache.cache_set('ns', 'y', 1, value=True)
+        # forget everything this process knows about the keys, as if they
+        # had been set by another process
+        keyedcache.CACHED_KEYS.clear()
+        keyedcache.LOCAL_CACHE.clear()
+
+        keyedcache.cache_delete('ns', 'x', children=True)
+        self.assertFalse(keyedcache.cache_get('ns', 'x', 1, default=False))
+        self.assert_(keyedcache.cache_get('ns', 'y', 1, default=False))
+
+    def testDeleteAll(self):
+        keyedcache.cache_set('all', 1, value=True)
+        keyedcache.CACHED_KEYS.clear()
+        keyedcache.cache_delete()
+        self.assertFalse(keyedcache.cache_get('all', 1, default=False))
+
+    def testGenerationEvicted(self):
+        keyedcache.cache_set('evict', 1, value=True)
+        key = keyedcache.cache_key('evict')
+        keyedcache.cache_delete('evict', children=True)
+        # losing the counter must not bring back keys from old generations
+        cache.delete(keyedcache._generation_key(key))
+        keyedcache.LOCAL_CACHE.clear()
+        keyedcache.GENERATIONS.clear()
+        self.assertFalse(keyedcache.cache_get('evict', 1, default=False))
+
+    def testGenerationsHeldInProcess(self):
+        keyedcache.cache_set('held', 1, value=True)
+        self.assert_(keyedcache.cache_get('held', 1))
+        keyedcache.STATS.reset()
+        for x in range(3):
+            self.assert_(keyedcache.cache_get('held', 1))
+        # no generations were fetched from the backend
+        self.assertFalse('get_many' in keyedcache.STATS.latency)
+
+    def testGenerationBumpedElsewhere(self):
+        keyedcache.cache_set('elsewhere', 1, value=True)
+        key = keyedcache.cache_key('elsewhere')
+        # another process invalidates the namespace
+        gk = keyedcache._generation_key(key)
+        cache.set(gk, keyedcache._new_generation(cache.get(gk)), keyedcache.GENERATION_TIMEOUT)
+        keyedcache.LOCAL_CACHE.clear()
+        keyedcache.GENERATIONS.clear()
+        self.assertFalse(keyedcache.cache_get('elsewhere', 1, default=False))
+
+    def testGenerationDepth(self):
+        keyedcache.cache_set('deep', 1, 2, 3, value=True)
+        keyedcache.cache_set('deep', 2, value=True)
+        self.assert_(keyedcache.cache_get('deep', 1, 2, 3))
+        keyedcache.LOCAL_CACHE.clear()
+        keyedcache.GENERATIONS.clear()
+        keyedcache.STATS.reset()
+        self.assert_(keyedcache.cache_get('deep', 1, 2, 3))
+        # one call for the generations, one for the value
+        calls = dict([(op, sum(buckets)) for op, buckets in keyedcache.STATS.latency.items()])
+        self.assertEqual(calls, {'get_many' : 1, 'get' : 1})
+        self.assertEqual(len(keyedcache.GENERATIONS), keyedcache.GENERATION_DEPTH + 1)
+
+        # deleting below the generation depth still reaches the children
+        keyedcache.cache_delete('deep', 1, 2, children=True)
+        self.assertFalse(keyedcache.cache_get('deep', 1, 2, 3, default=False))
+
 class TestCacheDisable(TestCase):
     
     def testDisable(self):
@@ -149,5 +291,219 @@ class TestKeyMaker(TestCase):
         v = keyedcache.cache_key('test', 3, more='yes')
         self.assertEqual(v, keyedcache.CACHE_PREFIX + '::test::3::more::yes')
 
+class TestLRUCache(TestCase):
 
-        
+    def testEviction(self):
+        lru = LRUCache(size=2, timeout=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        # touch 'a' so that 'b' is the least recently used
+        self.assertEqual(lru.get('a'), 1)
+        lru.set('c', 3)
+        self.assertEqual(len(lru), 2)
+        self.assertEqual(lru.get('b'), None)
+        self.assertEqual(lru.get('a'), 1)
+        self.assertEqual(lru.get('c'), 3)
+
+    def testExpiry(self):
+        lru = LRUCache(size=10, timeout=1)
+        lru.set('a', 1)
+        self.assert_('a' in lru)
+        time.sleep(2)
+        self.assertFalse('a' in lru)
+
+    def testDeletePrefix(self):
+        lru = LRUCache(size=10, timeout=60)
+        lru.set('x::1', 1)
+        lru.set('x::2', 2)
+        lru.set('y::1', 3)
+        removed = lru.delete_prefix('x::')
+        removed.sort()
+        self.assertEqual(removed, ['x::1', 'x::2'])
+        self.assertEqual(lru.keys(), ['y::1'])
+
+class TestLocalCache(TestCase):
+
+    def setUp(self):
+        self._local = keyedcache.LOCAL_CACHE
+        keyedcache.LOCAL_CACHE = LRUCache(size=10, timeout=60)
+
+    def tearDown(self):
+        keyedcache.LOCAL_CACHE = self._local
+
+    def testLocalHit(self):
+        keyedcache.cache_set('local', value='one')
+        key = keyedcache.cache_key('local')
+        # remove it from the shared backend only
+        cache.delete(keyedcache._physical_keys([key])[key])
+        self.assertEqual(keyedcache.cache_get('local'), 'one')
+
+    def testLocalCopies(self):
+        keyedcache.cache_set('local', value={'items' : [1]})
+        key = keyedcache.cache_key('local')
+        cache.delete(keyedcache._physical_keys([key])[key])
+        # changing what one caller got leaves the cached value alone
+        keyedcache.cache_get('local')['items'].append(2)
+        self.assertEqual(keyedcache.cache_get('local'), {'items' : [1]})
+        found, missing = keyedcache.cache_get_many(['local'])
+        found[key]['items'].append(3)
+        self.assertEqual(keyedcache.cache_get('local'), {'items' : [1]})
+
+    def testLocalDelete(self):
+        keyedcache.cache_set('local', 'x', value='one')
+        keyedcache.cache_set('local', 'x', 'y', value='two')
+        keyedcache.cache_delete('local', 'x', children=True)
+        prefix = keyedcache.cache_key('local', 'x')
+        self.assertEqual([k for k in keyedcache.LOCAL_CACHE.keys() if k.startswith(prefix)], [])
+        self.assertFalse(keyedcache.cache_get('local', 'x', 'y', default=False))
+
+    def testDeleteFunction(self):
+        cachetest(4,5,6)
+        prefix = keyedcache.cache_key('func', cachetest.__name__)
+        cached = lambda: [k for k in keyedcache.LOCAL_CACHE.keys() if k.startswith(prefix)]
+        self.assert_(cached())
+        keyedcache.cache_delete_function(cachetest)
+        self.assertFalse(cached())
+
+class Keyed(object):
+    """Stands in for a model instance."""
+
+    def __init__(self, pk):
+        self.pk = pk
+
+    def _get_pk_val(self):
+        return self.pk
+
+def time_key_makers(count=5000):
+    """Time building a cache_function key by pickling the arguments, as
+    keyedcache used to, and with the structural encoding.  Returns the cost
+    of each in microseconds per call."""
+    args = (10, 'product-slug', [1, 2, 3], u'unicode')
+    kwargs = {'include_tax' : True, 'quantity' : 5}
+
+    start = time.time()
+    for x in xrange(count):
+        keyedcache.KEY_DELIM.join(['func', 'cachetest', __name__,
+            keyedcache.md5_hash(args), keyedcache.md5_hash(kwargs)])
+    pickled = time.time() - start
+
+    start = time.time()
+    for x in xrange(count):
+        keyedcache.cache_key('func', 'cachetest', __name__, args, kwargs)
+    structural = time.time() - start
+
+    return pickled/count*1000000, structural/count*1000000
+
+class TestStructuralHash(TestCase):
+
+    def testStructuralHash(self):
+        a = keyedcache.structural_hash((1, 'a', {'x' : [1,2], 'y' : None}))
+        b = keyedcache.structural_hash((1, 'a', {'y' : None, 'x' : [1,2]}))
+        self.assertEqual(a, b)
+        self.assertNotEqual(keyedcache.structural_hash((1,)), keyedcache.structural_hash(('1',)))
+        self.assertNotEqual(keyedcache.structural_hash(['ab', 'c']), keyedcache.structural_hash(['a', 'bc']))
+
+    def testNestingCollisions(self):
+        p = Keyed(1)
+        different = [
+            (([p], 1), ([p, 1],)),
+            (([p], [p]), ([p, [p]],)),
+            (({'a' : p}, 1), ({'a' : (p, 1)},)),
+            ({'a' : 1}, [('a', 1)]),
+            ([p, (p,)], [(p, p)]),
+            ]
+        for a, b in different:
+            self.assertNotEqual(keyedcache._encode(a), keyedcache._encode(b))
+            self.assertNotEqual(keyedcache.cache_key('func', a), keyedcache.cache_key('func', b))
+
+    def testBenchmark(self):
+        pickled, structural = time_key_makers()
+        log.info("cache_key: %.1f usec/call pickled, %.1f usec/call structural", pickled, structural)
+        self.assert_(pickled > 0 and structural > 0)
+
+class Loaded(VersionedSnapshot):
+    cache_name = 'TestLoaded'
+    loads = 0
+
+    def __init__(self, siteid):
+        Loaded.loads += 1
+        self.siteid = siteid
+        self.current = True
+
+    def is_current(self):
+        return self.current
+
+class TestVersionedSnapshot(TestCase):
+
+    def setUp(self):
+        keyedcache.cache_delete()
+
+    def testLoadedOnce(self):
+        loads = Loaded.loads
+        snapshot = Loaded.get(1)
+        self.assert_(Loaded.get(1) is snapshot)
+        self.assert_(Loaded.get(2) is not snapshot)
+        self.assertEqual(Loaded.loads, loads + 2)
+
+    def testInvalidate(self):
+        snapshot = Loaded.get(1)
+        other = Loaded.get(2)
+        Loaded.invalidate(1)
+        self.assert_(Loaded.get(1) is not snapshot)
+        self.assert_(Loaded.get(2) is other)
+
+    def testStampedElsewhere(self):
+        snapshot = Loaded.get(1)
+        # another process invalidates it
+        keyedcache.cache_set('TestLoaded', 1, value=snapshot.version + 1)
+        # seen once the stamp is looked at again
+        self.assert_(Loaded.get(1) is snapshot)
+        snapshot.checked -= Loaded.check_interval
+        self.assert_(Loaded.get(1) is not snapshot)
+
+    def testStampCheckedOnce(self):
+        Loaded.get(1)
+        keyedcache.STATS.reset()
+        for x in range(10):
+            Loaded.get(1)
+        self.assertEqual(keyedcache.STATS.latency, {})
+
+    def testNotCurrent(self):
+        snapshot = Loaded.get(1)
+        snapshot.current = False
+        self.assert_(Loaded.get(1) is not snapshot)
+
+class TestStats(TestCase):
+
+    def setUp(self):
+        keyedcache.STATS.reset()
+
+    def testGroups(self):
+        keyedcache.cache_set('statgroup', 1, value=True)
+        keyedcache.cache_get('statgroup', 1)
+        keyedcache.cache_get('statgroup', 2, default=None)
+        keyedcache.cache_delete('statgroup', 1)
+
+        groups = dict([(g['group'], g) for g in keyedcache.STATS.as_dict()['groups']])
+        counts = groups['statgroup']
+        self.assertEqual(counts['sets'], 1)
+        self.assertEqual(counts['hits'], 1)
+        self.assertEqual(counts['misses'], 1)
+        self.assertEqual(counts['deletes'], 1)
+        self.assertEqual(counts['hit_rate'], 50.0)
+
+    def testFunctionGroup(self):
+        cachetest(7,8,9)
+        groups = [g['group'] for g in keyedcache.STATS.as_dict()['groups']]
+        self.assert_('func::cachetest' in groups)
+
+    def testHotAndMissing(self):
+        for x in range(0,3):
+            keyedcache.cache_get('hotkey', default=None)
+        stats = keyedcache.STATS.as_dict()
+        self.assertEqual(stats['missing'][0], (keyedcache.cache_key('hotkey'), 3))
+
+    def testLatency(self):
+        keyedcache.cache_get('latency', default=None)
+        ops = [op['op'] for op in keyedcache.STATS.as_dict()['latency']]
+        self.assert_('get' in ops)
@@ -6,6 +6,7 @@ from django.conf.urls.defaults import *
 
 urlpatterns = patterns('keyedcache.views',
     (r'^$', 'stats_page', {}, 'keyedcache_stats'),
+    (r'^json/$', 'stats_json', {}, 'keyedcache_stats_json'),
     (r'^view/$', 'view_page', {}, 'keyedcache_view'),
     (r'^delete/$', 'delete_page', {}, 'keyedcache_delete'),
 )
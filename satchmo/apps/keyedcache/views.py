@@ -6,6 +6,7 @@ from django.core import urlresolvers
 from django.http import HttpResponse, HttpResponseRedirect
 from django.shortcuts import render_to_response
 from django.template import RequestContext
+from django.utils import simplejson
 from django.utils.translation import ugettext_lazy as _
 from keyedcache.models import *
 import logging
@@ -62,12 +63,32 @@ def stats_page(request):
         'cache_backend' : settings.CACHE_BACKEND,
         'cache_calls' : keyedcache.CACHE_CALLS,
         'cache_hits' : keyedcache.CACHE_HITS,
-        'hit_rate' : "%02.1f" % rate
+        'hit_rate' : "%02.1f" % rate,
+        'stats' : keyedcache.STATS.as_dict(),
     })
     
     return render_to_response('keyedcache/stats.html', ctx)
 
 stats_page = user_passes_test(lambda u: u.is_authenticated() and u.is_staff, login_url='/accounts/login/')(stats_page)
+
+def stats_json(request):
+    """The statistics of the stats page, as JSON for monitoring tools."""
+    try:
+        top = int(request.GET.get('top', 20))
+    except ValueError:
+        top = 20
+
+    data = keyedcache.STATS.as_dict(top=top)
+    data.update({
+        'backend' : settings.CACHE_BACKEND,
+        'timeout' : settings.CACHE_TIMEOUT,
+        'calls' : keyedcache.CACHE_CALLS,
+        'hits' : keyedcache.CACHE_HITS,
+        'local_size' : len(keyedcache.LOCAL_CACHE),
+    })
+    return HttpResponse(simplejson.dumps(data), mimetype='application/json')
+
+stats_json = user_passes_test(lambda u: u.is_authenticated() and u.is_staff, login_url='/accounts/login/')(stats_json)
     
 def view_page(request):
     keys = keyedcache.CACHED_KEYS.keys()
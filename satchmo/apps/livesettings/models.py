@@ -3,8 +3,8 @@ from django.contrib.sites.models import Site
 from django.db import models
 from django.db.models import loading
 from django.utils.translation import ugettext_lazy as _
-from keyedcache import cache_key, cache_get, cache_set, NotCachedError
-from keyedcache.models import CachedObjectMixin
+from keyedcache import cache_key, cache_get, cache_set, cache_enabled, NotCachedError
+from keyedcache.models import CachedObjectMixin, VersionedSnapshot
 from django.contrib.sites.models import Site
 import logging
 from django.db import transaction
@@ -30,10 +30,63 @@ def _safe_get_siteid(site):
 
 _safe_get_siteid=transaction.commit_manually(_safe_get_siteid)
 
+def _get_siteid(site):
+    """Return the id of `site` or of the current site, only falling back to
+    the transaction handling of `_safe_get_siteid` when the current site
+    doesn't exist."""
+    if site:
+        return site.id
+    try:
+        return Site.objects.get_current().id
+    except (Site.DoesNotExist, AttributeError):
+        return _safe_get_siteid(None)
+
+class SettingSnapshot(VersionedSnapshot):
+    """All the Setting and LongSetting rows of a site, loaded at once.
+
+    Snapshots are never changed after loading.  Saving or deleting a setting
+    stamps a new version for its site, and every process loads a fresh
+    snapshot when it sees that the version has changed.
+    """
+
+    cache_name = 'SettingVersion'
+
+    def __init__(self, siteid):
+        self.siteid = siteid
+
+        settings = {}
+        # a Setting overrides a LongSetting, as in find_setting
+        for setting in LongSetting.objects.filter(site__id__exact=siteid):
+            settings[(setting.group, setting.key)] = setting
+        for setting in Setting.objects.filter(site__id__exact=siteid):
+            settings[(setting.group, setting.key)] = setting
+        self._settings = settings
+        log.debug('loaded %i settings for site %s', len(settings), siteid)
+
+    def __len__(self):
+        return len(self._settings)
+
+    def get_setting(self, group, key):
+        return self._settings.get((group, key), None)
+
+def get_snapshot(siteid):
+    """Get the current SettingSnapshot for a site, loading it if needed."""
+    return SettingSnapshot.get(siteid)
+
+def invalidate_snapshot(siteid):
+    """Make every process reload the settings of a site."""
+    SettingSnapshot.invalidate(siteid)
+
 def find_setting(group, key, site=None):
     """Get a setting or longsetting by group and key, cache and return it."""
        
-    siteid = _safe_get_siteid(site)
+    siteid = _get_siteid(site)
+
+    if cache_enabled() and loading.app_cache_ready():
+        setting = get_snapshot(siteid).get_setting(group, key)
+        if not setting:
+            raise SettingNotSet(key, cachekey=cache_key('Setting', siteid, group, key))
+        return setting
        
     ck = cache_key('Setting', siteid, group, key)
     setting = None
@@ -87,7 +140,9 @@ class Setting(models.Model, CachedObjectMixin):
 
     def delete(self):
         self.cache_delete()
+        siteid = self.site_id
         super(Setting, self).delete()
+        invalidate_snapshot(siteid)
 
     def save(self, force_insert=False, force_update=False):
         try:
@@ -98,6 +153,7 @@ class Setting(models.Model, CachedObjectMixin):
         super(Setting, self).save(force_insert=force_insert, force_update=force_update)
         
         self.cache_set()
+        invalidate_snapshot(self.site_id)
         
     class Meta:
         unique_together = ('site', 'group', 'key')
@@ -129,7 +185,9 @@ class LongSetting(models.Model, CachedObjectMixin):
 
     def delete(self):
         self.cache_delete()
+        siteid = self.site_id
         super(LongSetting, self).delete()
+        invalidate_snapshot(siteid)
 
     def save(self, force_insert=False, force_update=False):
         try:
@@ -138,6 +196,7 @@ class LongSetting(models.Model, CachedObjectMixin):
             self.site = Site.objects.get_current()
         super(LongSetting, self).save(force_insert=force_insert, force_update=force_update)
         self.cache_set()
+        invalidate_snapshot(self.site_id)
         
     class Meta:
         unique_together = ('site', 'group', 'key')
@@ -3,6 +3,7 @@ from django.http import Http404
 from django.test import TestCase
 import keyedcache
 from livesettings import *
+from livesettings.models import get_snapshot, invalidate_snapshot
 import re
 import time
 import logging
@@ -95,6 +96,51 @@ class ConfigurationTestSettings(TestCase):
             pass
         
 
+class ConfigTestSnapshot(TestCase):
+
+    def setUp(self):
+        # clear out cache from previous runs
+        keyedcache.cache_delete()
+        g = ConfigurationGroup('testsnap','testsnap')
+        config_register(IntegerValue(g, 's1', default=10))
+        config_register(LongStringValue(g, 's2', default=''))
+
+    def testLoadedOnce(self):
+        config_get('testsnap', 's1').update(20)
+        config_get('testsnap', 's2').update('long')
+        siteid = Site.objects.get_current().id
+        snapshot = get_snapshot(siteid)
+        self.assert_(snapshot.get_setting('testsnap', 's1'))
+        self.assert_(snapshot.get_setting('testsnap', 's2'))
+        self.assert_(get_snapshot(siteid) is snapshot)
+
+    def testServedFromSnapshot(self):
+        c = config_get('testsnap', 's1')
+        c.update(20)
+        # removing the row behind its back doesn't change the snapshot
+        Setting.objects.filter(group='testsnap', key='s1').delete()
+        self.assertEqual(c.value, 20)
+
+        invalidate_snapshot(Site.objects.get_current().id)
+        self.assertEqual(c.value, 10)
+
+    def testSaveInvalidates(self):
+        c = config_get('testsnap', 's1')
+        c.update(20)
+        siteid = Site.objects.get_current().id
+        before = get_snapshot(siteid)
+        c.update(30)
+        self.assert_(get_snapshot(siteid) is not before)
+        self.assertEqual(c.value, 30)
+
+    def testReadsStayInProcess(self):
+        config_get('testsnap', 's1').update(20)
+        self.assertEqual(config_value('testsnap', 's1'), 20)
+        keyedcache.STATS.reset()
+        for x in range(10):
+            self.assertEqual(config_value('testsnap', 's1'), 20)
+        self.assertEqual(keyedcache.STATS.latency, {})
+
 class ConfigTestDotAccess(TestCase):
     def setUp(self):
         # clear out cache from previous runs
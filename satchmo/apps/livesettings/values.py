@@ -12,6 +12,7 @@ from keyedcache import cache_set
 from livesettings.models import find_setting, LongSetting, Setting, SettingNotSet
 from satchmo_utils import load_module, is_string_like, is_list_or_tuple
 from django.contrib.sites.models import Site
+import copy
 import datetime
 import logging
 import signals
@@ -294,7 +295,8 @@ class Value(object):
         if current_value != new_value:        
             db_value = self.get_db_prep_save(value)
             try:
-                s = self.setting
+                # don't change the shared snapshot copy until it is saved
+                s = copy.copy(self.setting)
                 s.value = db_value
                 
             except SettingNotSet:
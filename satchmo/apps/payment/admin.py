@@ -1,4 +1,4 @@
-from payment.models import PaymentOption, CreditCardDetail
+from payment.models import PaymentOption, CreditCardDetail, RebillAttempt
 from django.contrib import admin
 from django.utils.translation import get_language, ugettext_lazy as _
 
@@ -13,3 +13,9 @@ class PaymentOptionOptions(admin.ModelAdmin):
 
 admin.site.register(PaymentOption, PaymentOptionOptions)
 
+class RebillAttemptOptions(admin.ModelAdmin):
+    list_display = ['key', 'orderitem', 'status', 'attempts', 'next_attempt', 'claimed_at', 'time_stamp']
+    list_filter = ['status']
+    raw_id_fields = ['orderitem', 'renewal']
+
+admin.site.register(RebillAttempt, RebillAttemptOptions)
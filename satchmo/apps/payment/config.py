@@ -28,6 +28,30 @@ ALLOW_URL_CRON = config_register(
         default = False)
 )
 
+REBILL_THREADS = config_register(
+    PositiveIntegerValue(PAYMENT_GROUP,
+        'REBILL_THREADS',
+        description=_("Rebilling threads"),
+        help_text=_("How many subscription renewals may be charged at the same time."),
+        default=1)
+)
+
+REBILL_RETRIES = config_register(
+    PositiveIntegerValue(PAYMENT_GROUP,
+        'REBILL_RETRIES',
+        description=_("Rebilling attempts"),
+        help_text=_("How many times to try charging a subscription renewal before giving up."),
+        default=3)
+)
+
+REBILL_RETRY_HOURS = config_register(
+    PositiveIntegerValue(PAYMENT_GROUP,
+        'REBILL_RETRY_HOURS',
+        description=_("Rebilling retry delay"),
+        help_text=_("Hours to wait before retrying a failed renewal charge, doubled after every further failure."),
+        default=24)
+)
+
 PAYMENT_LIVE = config_register(
     BooleanValue(PAYMENT_GROUP, 
         'LIVE', 
@@ -14,6 +14,7 @@ from payment.utils import get_or_create_order, pay_ship_save
 from product.models import Discount
 from product.utils import find_best_auto_discount
 from shipping.config import shipping_methods, shipping_method_by_key
+from shipping.utils import calculate_quotes
 from satchmo_store.shop.models import Cart
 from satchmo_utils.views import CreditCard
 from product.models import TaxClass
@@ -39,8 +40,7 @@ def _get_shipping_choices(request, paymentmodule, cart, contact, default_view_ta
     else:
         methods = shipping_methods()
     
-    for method in methods:
-        method.calculate(cart, contact)
+    for method in calculate_quotes(methods, cart, contact, request=request):
         if method.valid():
             template = lookup_template(paymentmodule, 'shipping/options.html')
             t = loader.get_template(template)
@@ -0,0 +1,21 @@
+from django.core.management.base import NoArgsCommand
+from optparse import make_option
+from payment.rebill import rebill
+
+class Command(NoArgsCommand):
+    help = "Rebills the subscription products which are due for renewal."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--threads', dest='threads', type='int', default=None,
+            help='Number of orders to charge at the same time, defaults to the PAYMENT.REBILL_THREADS setting.'),
+        )
+
+    requires_model_validation = True
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        stats = rebill(threads=options.get('threads', None))
+
+        if verbosity > 0:
+            print "Rebilled %(items)i items in %(orders)i orders in %(seconds).1f seconds (%(rate).1f orders/sec)" % stats
+            print "%(success)i succeeded, %(retry)i to be retried, %(failed)i failed, %(external)i billed externally" % stats
@@ -12,7 +12,7 @@ import keyedcache
 from livesettings import config_value, config_choice_values, SettingNotSet
 from satchmo_store.contact.models import Contact
 from payment.fields import PaymentChoiceCharField, CreditChoiceCharField
-from satchmo_store.shop.models import OrderPayment
+from satchmo_store.shop.models import OrderItem, OrderPayment
 import config
 import base64
 import logging
@@ -110,6 +110,49 @@ class CreditCardDetail(models.Model):
         verbose_name = _("Credit Card")
         verbose_name_plural = _("Credit Cards")
 
+REBILL_STATUS = (
+    ('pending', _('Pending')),
+    ('processing', _('Processing')),
+    ('success', _('Success')),
+    ('retry', _('Retry')),
+    ('failed', _('Failed')),
+    ('external', _('Billed externally')),
+)
+
+class RebillAttempt(models.Model):
+    """
+    Tracks the renewal of one billing period of a subscription.  The key is
+    unique per expiring order item, so a period is never billed twice.
+    """
+    key = models.CharField(_("Key"), max_length=64, unique=True)
+    orderitem = models.ForeignKey(OrderItem, verbose_name=_("Expiring Item"),
+        related_name="rebill_attempts")
+    renewal = models.ForeignKey(OrderItem, verbose_name=_("Renewal Item"),
+        related_name="rebill_renewals", blank=True, null=True)
+    status = models.CharField(_("Status"), max_length=10, choices=REBILL_STATUS,
+        default='pending')
+    attempts = models.IntegerField(_("Attempts"), default=0)
+    next_attempt = models.DateTimeField(_("Next Attempt"), blank=True, null=True)
+    claimed_at = models.DateTimeField(_("Claimed At"), blank=True, null=True)
+    message = models.CharField(_("Message"), max_length=255, blank=True)
+    time_stamp = models.DateTimeField(_("Timestamp"), blank=True, null=True)
+
+    def make_key(cls, orderitem):
+        return "%i-%s" % (orderitem.id, orderitem.expire_date)
+
+    make_key = classmethod(make_key)
+
+    def __unicode__(self):
+        return u"%s: %s" % (self.key, self.status)
+
+    def save(self, force_insert=False, force_update=False):
+        self.time_stamp = datetime.now()
+        super(RebillAttempt, self).save(force_insert=force_insert, force_update=force_update)
+
+    class Meta:
+        verbose_name = _("Rebill Attempt")
+        verbose_name_plural = _("Rebill Attempts")
+
 def _decrypt_code(code):
     """Decrypt code encrypted by _encrypt_code"""
     secret_key = settings.SECRET_KEY
@@ -8,6 +8,7 @@ from django.utils.translation import ugettext_lazy as _
 from payment.modules.base import BasePaymentProcessor, ProcessorResult, NOTSET
 from satchmo_store.shop.models import Config
 from tax.utils import get_tax_processor
+from satchmo_utils.httpclient import urlopen
 from satchmo_utils.numbers import trunc_decimal
 from urllib import urlencode
 from xml.dom import minidom
@@ -355,7 +356,7 @@ class PaymentProcessor(BasePaymentProcessor):
         headers = {'Content-type':'text/xml'}
         conn = urllib2.Request(data['connection'], request, headers)
         try:
-            f = urllib2.urlopen(conn)
+            f = urlopen(conn)
             all_results = f.read()
         except urllib2.URLError, ue:
             self.log.error("error opening %s\n%s", data['connection'], ue)
@@ -397,7 +398,7 @@ class PaymentProcessor(BasePaymentProcessor):
 
         conn = urllib2.Request(url=data['connection'], data=data['postString'])
         try:
-            f = urllib2.urlopen(conn)
+            f = urlopen(conn)
             all_results = f.read()
             self.log_extra('Authorize response: %s', all_results)
         except urllib2.URLError, ue:
@@ -1,5 +1,6 @@
 from django.template import Context, loader
 from payment.modules.base import BasePaymentProcessor, ProcessorResult, NOTSET
+from satchmo_utils.httpclient import urlopen
 from satchmo_utils.numbers import trunc_decimal
 
 import urllib2
@@ -119,13 +120,12 @@ class PaymentProcessor(BasePaymentProcessor):
         request = t.render(c)
         conn = urllib2.Request(url=self.connection, data=request)
         try:
-            f = urllib2.urlopen(conn)
+            f = urlopen(conn)
         except urllib2.HTTPError, e:
             # we probably didn't authenticate properly
             # make sure the 'v' in your account number is lowercase
             return ProcessorResult(self.key, False, 'Problem parsing results')
 
-        f = urllib2.urlopen(conn)
         all_results = f.read()
         tree = fromstring(all_results)
         parsed_results = tree.getiterator('{urn:schemas-cybersource-com:transaction-data-1.26}reasonCode')
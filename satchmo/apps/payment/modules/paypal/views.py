@@ -18,6 +18,7 @@ from payment.views import payship
 from payment.config import payment_live
 from satchmo_store.shop.models import Cart
 from satchmo_utils.dynamic import lookup_url, lookup_template
+from satchmo_utils.httpclient import urlopen
 
 log = logging.getLogger()
 
@@ -176,7 +177,7 @@ def confirm_ipn_data(data, PP_URL):
 
     req = urllib2.Request(PP_URL)
     req.add_header("Content-type", "application/x-www-form-urlencoded")
-    fo = urllib2.urlopen(req, params)
+    fo = urlopen(req, params)
 
     ret = fo.read()
     if ret == "VERIFIED":
@@ -11,6 +11,7 @@ from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
 from livesettings import config_value
 from payment.modules.base import BasePaymentProcessor, ProcessorResult, NOTSET
+from satchmo_utils.httpclient import urlopen
 from satchmo_utils.numbers import trunc_decimal
 from urllib import urlencode
 import forms
@@ -144,7 +145,7 @@ class PaymentProcessor(BasePaymentProcessor):
                 self.log_extra("About to post to server: %s?%s", self.url, self.postString)
                 conn = urllib2.Request(self.url, data=self.postString)
                 try:
-                    f = urllib2.urlopen(conn)
+                    f = urlopen(conn)
                     result = f.read()
                     self.log_extra('Process: url=%s\nPacket=%s\nResult=%s', self.url, self.packet, result)
 
@@ -0,0 +1,362 @@
+"""Renewal billing for subscription products.
+
+The subscription items due for renewal are selected with a handful of
+queries, grouped by order, and each order is charged once, on a bounded pool
+of threads.  Every billing period is tracked by a `RebillAttempt`, so that a
+period is never charged twice, and failed charges are retried on a schedule.
+"""
+
+from datetime import date, datetime, timedelta
+from django.db import connection, transaction, IntegrityError
+from django.utils.translation import ugettext
+from livesettings import config_get_group, config_value
+from payment.models import RebillAttempt
+from product.models import SubscriptionProduct, Trial
+from satchmo_store.shop.models import OrderItem, OrderPayment
+import logging
+import Queue
+import threading
+import time
+
+log = logging.getLogger('payment.rebill')
+
+# Payment modules which bill renewals themselves, and report them by IPN.
+IPN_BASED = ('PAYPAL',)
+
+# Statuses of attempts which are finished with.
+FINISHED = ('success', 'failed', 'external')
+
+# How long a run may take to charge an order it claimed before another run
+# assumes it died, and takes the renewal over.
+CLAIM_TIMEOUT = timedelta(hours=1)
+
+def _in_batches(ids, size=500):
+    for i in range(0, len(ids), size):
+        yield ids[i:i+size]
+
+def _is_claimed(attempt, now):
+    """Whether another run is charging the attempt right now."""
+    return attempt.status == 'processing' and attempt.claimed_at is not None \
+        and attempt.claimed_at > now - CLAIM_TIMEOUT
+
+def retry_delay(attempts):
+    """How long to wait after the given number of failed attempts."""
+    hours = config_value('PAYMENT', 'REBILL_RETRY_HOURS')
+    return timedelta(hours=hours * 2 ** max(attempts - 1, 0))
+
+def _retry_days():
+    """How many days after it expired an item may still be retried."""
+    total = timedelta(0)
+    for attempt in range(1, config_value('PAYMENT', 'REBILL_RETRIES')):
+        total += retry_delay(attempt)
+    return total.days + 1
+
+def due_renewals(today=None):
+    """Return the subscription items due for renewal, grouped by order, as a
+    list of (order, items) pairs.
+
+    Each item has its `subscription`, `trials`, `order_count` and
+    `rebill_attempt` set, so that renewing it takes no further lookups.
+    """
+    if today is None:
+        today = date.today()
+    now = datetime.now()
+    start = today - timedelta(days=_retry_days())
+
+    candidates = list(OrderItem.objects.filter(completed=True,
+        expire_date__range=(start, today),
+        product__subscriptionproduct__isnull=False).select_related('order', 'product'))
+    if not candidates:
+        return []
+
+    orderids = dict.fromkeys([item.order_id for item in candidates]).keys()
+    productids = dict.fromkeys([item.product_id for item in candidates]).keys()
+    itemids = [item.id for item in candidates]
+
+    # the completed items of these orders, to find the latest of each
+    # subscription and how many periods have been billed
+    latest = {}
+    counts = {}
+    ordercounts = {}
+    for batch in _in_batches(orderids):
+        for row in OrderItem.objects.filter(order__in=batch, completed=True).values('id', 'order', 'product'):
+            key = (row['order'], row['product'])
+            counts[key] = counts.get(key, 0) + 1
+            latest[key] = max(latest.get(key, 0), row['id'])
+            ordercounts[row['order']] = ordercounts.get(row['order'], 0) + 1
+
+    subscriptions = {}
+    trials = {}
+    for batch in _in_batches(productids):
+        for sub in SubscriptionProduct.objects.filter(product__in=batch):
+            subscriptions[sub.product_id] = sub
+        for trial in Trial.objects.filter(subscription__in=batch).order_by('id'):
+            trials.setdefault(trial.subscription_id, []).append(trial)
+
+    attempts = {}
+    for batch in _in_batches(itemids):
+        for attempt in RebillAttempt.objects.filter(orderitem__in=batch):
+            attempts[attempt.key] = attempt
+
+    orders = {}
+    due = []
+    for item in candidates:
+        key = (item.order_id, item.product_id)
+        if latest.get(key, None) != item.id:
+            # already renewed
+            continue
+
+        sub = subscriptions.get(item.product_id, None)
+        if sub is None:
+            continue
+        item_trials = trials.get(item.product_id, [])
+        if sub.recurring_times and sub.recurring_times + len(item_trials) == counts[key]:
+            # all payments made
+            continue
+
+        attempt = attempts.get(RebillAttempt.make_key(item), None)
+        if attempt is not None:
+            if attempt.status in FINISHED or _is_claimed(attempt, now):
+                continue
+            if attempt.next_attempt and attempt.next_attempt > now:
+                continue
+
+        item.subscription = sub
+        item.trials = item_trials
+        item.order_count = ordercounts.get(item.order_id, 0)
+        item.rebill_attempt = attempt
+
+        if item.order_id not in orders:
+            orders[item.order_id] = []
+            due.append((item.order, orders[item.order_id]))
+        orders[item.order_id].append(item)
+
+    return due
+
+def _claim(item):
+    """Mark the renewal of the item as being processed, returning its
+    attempt, or None if another run has claimed it.
+
+    The attempt is only claimed if nobody changed it since it was loaded, so
+    of two runs loading it at the same time only one gets it.  An attempt
+    left processing by a run which died is taken over after CLAIM_TIMEOUT.
+    """
+    now = datetime.now()
+    attempt = item.rebill_attempt
+    if attempt is None:
+        sid = transaction.savepoint()
+        try:
+            attempt = RebillAttempt.objects.create(key=RebillAttempt.make_key(item),
+                orderitem=item, status='processing', claimed_at=now)
+            transaction.savepoint_commit(sid)
+            return attempt
+        except IntegrityError:
+            transaction.savepoint_rollback(sid)
+            return None
+
+    if _is_claimed(attempt, now):
+        return None
+
+    qn = connection.ops.quote_name
+    sql = "UPDATE %s SET %s = 'processing', %s = %%s WHERE %s = %%s AND %s = %%s" % (
+        qn(RebillAttempt._meta.db_table), qn('status'), qn('claimed_at'), qn('id'), qn('status'))
+    params = [connection.ops.value_to_db_datetime(now), attempt.id, attempt.status]
+    if attempt.claimed_at is None:
+        sql += " AND %s IS NULL" % qn('claimed_at')
+    else:
+        sql += " AND %s = %%s" % qn('claimed_at')
+        params.append(connection.ops.value_to_db_datetime(attempt.claimed_at))
+
+    cursor = connection.cursor()
+    cursor.execute(sql, params)
+    claimed = cursor.rowcount == 1
+    transaction.commit_unless_managed()
+    if not claimed:
+        return None
+    attempt.status = 'processing'
+    attempt.claimed_at = now
+    return attempt
+
+def _renewal_item(item):
+    """Build the order item for the next billing period of `item`."""
+    sub = item.subscription
+    renewal = OrderItem(order=item.order, product=item.product, quantity=item.quantity,
+        unit_price=item.unit_price, line_item_price=item.line_item_price)
+    #if product is recurring, set subscription end
+    if sub.recurring:
+        renewal.expire_date = sub.calc_expire_date()
+    #check if product has 2 or more trial periods and if the last one paid was a trial or a regular payment.
+    trials = item.trials
+    ordercount = item.order_count
+    if len(trials) > 1 and 0 < ordercount < len(trials) and item.unit_price == trials[ordercount - 1].price:
+        renewal.unit_price = trials[ordercount].price
+        renewal.line_item_price = renewal.quantity * renewal.unit_price
+        renewal.expire_date = trials[ordercount].calc_expire_date()
+    return renewal
+
+def _finish(attempts, status, message=''):
+    for attempt in attempts:
+        if status == 'success':
+            attempt.renewal.completed = True
+            attempt.renewal.save()
+        attempt.status = status
+        attempt.message = message[:255]
+        attempt.next_attempt = None
+        attempt.save()
+
+def _failed(attempts, message):
+    retries = config_value('PAYMENT', 'REBILL_RETRIES')
+    for attempt in attempts:
+        attempt.attempts += 1
+        attempt.message = message[:255]
+        if attempt.attempts >= retries:
+            attempt.status = 'failed'
+            attempt.next_attempt = None
+        else:
+            attempt.status = 'retry'
+            attempt.next_attempt = datetime.now() + retry_delay(attempt.attempts)
+        attempt.save()
+
+def rebill_order(order, items):
+    """Add a renewal item to the order for each of the due `items`, as
+    returned by `due_renewals`, and charge the order once for all of them.
+
+    Returns the attempts made.
+    """
+    attempts = []
+    for item in items:
+        attempt = _claim(item)
+        if attempt is None:
+            log.debug('Renewal of order item #%i is being processed elsewhere', item.id)
+            continue
+        if attempt.renewal_id is None:
+            renewal = _renewal_item(item)
+            renewal.save()
+            attempt.renewal = renewal
+            attempt.save()
+        attempts.append(attempt)
+
+    if not attempts:
+        return attempts
+
+    try:
+        order.recalculate_total()
+        payments = list(order.payments.all()[:1])
+        if not payments:
+            _failed(attempts, 'No payment found for order')
+            return attempts
+
+        #list of ipn based payment modules.  Include processors that use 3rd party recurring billing.
+        if payments[0].payment in IPN_BASED:
+            _finish(attempts, 'external')
+            return attempts
+
+        if order.balance <= 0:
+            _finish(attempts, 'success')
+            return attempts
+
+        #run card
+        payment_module = config_get_group('PAYMENT_%s' % payments[0].payment)
+        credit_processor = payment_module.MODULE.load_module('processor')
+        processor = credit_processor.PaymentProcessor(payment_module)
+        processor.prepare_data(order)
+        result = processor.process()
+
+        if result.payment:
+            reason_code = result.payment.reason_code
+        else:
+            reason_code = "unknown"
+        log.info("""Processing %s recurring transaction with %s
+            Order #%i
+            Results=%s
+            Response=%s
+            Reason=%s""",
+            payment_module.LABEL.value,
+            payment_module.KEY.value,
+            order.id,
+            result.success,
+            reason_code,
+            result.message)
+
+        if result.success:
+            #success handler
+            order.add_status(status='New', notes = ugettext("Subscription Renewal Order successfully submitted"))
+            _finish(attempts, 'success', unicode(result.message))
+            orderpayment = OrderPayment(order=order, amount=order.balance, payment=unicode(payment_module.KEY.value))
+            orderpayment.save()
+        else:
+            _failed(attempts, unicode(result.message))
+
+    except Exception, e:
+        log.exception('Error rebilling order #%i', order.id)
+        _failed(attempts, unicode(e))
+
+    return attempts
+
+def _worker(work, results):
+    try:
+        while True:
+            try:
+                order, items = work.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results.put(rebill_order(order, items))
+            except Exception:
+                log.exception('Error rebilling order #%i', order.id)
+    finally:
+        # each thread has its own connection, don't leave it open
+        connection.close()
+
+def rebill(today=None, threads=None):
+    """Renew every subscription due today, or due earlier and still to be
+    retried, charging up to `threads` orders at the same time.
+
+    Returns statistics: the number of orders and renewed items, the number
+    of attempts by status, and the time taken.
+    """
+    start = time.time()
+    if threads is None:
+        threads = config_value('PAYMENT', 'REBILL_THREADS')
+
+    due = due_renewals(today)
+    stats = {'orders' : len(due), 'items' : 0}
+    for status, label in RebillAttempt._meta.get_field('status').choices:
+        stats[status] = 0
+
+    results = Queue.Queue()
+    if threads <= 1 or len(due) <= 1:
+        for order, items in due:
+            results.put(rebill_order(order, items))
+    else:
+        work = Queue.Queue()
+        for renewal in due:
+            work.put(renewal)
+        workers = []
+        for i in range(min(threads, len(due))):
+            t = threading.Thread(target=_worker, args=(work, results))
+            t.setDaemon(True)
+            t.start()
+            workers.append(t)
+        for t in workers:
+            t.join()
+
+    while True:
+        try:
+            attempts = results.get_nowait()
+        except Queue.Empty:
+            break
+        for attempt in attempts:
+            stats['items'] += 1
+            stats[attempt.status] = stats.get(attempt.status, 0) + 1
+
+    stats['seconds'] = time.time() - start
+    if stats['seconds'] > 0:
+        stats['rate'] = stats['orders'] / stats['seconds']
+    else:
+        stats['rate'] = 0.0
+
+    log.info('Rebilled %(items)i items in %(orders)i orders in %(seconds).1f seconds, '
+        '%(rate).1f orders per second: %(success)i succeeded, %(retry)i to retry, %(failed)i failed',
+        stats)
+    return stats
@@ -124,6 +124,65 @@ class TestRecurringBilling(TestCase):
             self.assertEqual(order.expire_date, datetime.date.today() + datetime.timedelta(days=expire_length))
             self.assertEqual(order.order.balance, Decimal('0.00'))
         
+    def testRebillOnce(self):
+        """Each billing period is renewed once, however often the rebilling runs"""
+        from payment.models import RebillAttempt
+        from payment.rebill import due_renewals, rebill
+
+        for item in OrderItem.objects.all():
+            item.expire_date = datetime.date.today()
+            item.save()
+
+        due = due_renewals()
+        item_count = OrderItem.objects.count()
+        self.assert_(len(due) > 0)
+
+        stats = rebill(threads=1)
+        self.assertEqual(stats['orders'], len(due))
+        self.assertEqual(stats['success'], stats['items'])
+        self.assertEqual(OrderItem.objects.count(), item_count + stats['items'])
+        self.assertEqual(RebillAttempt.objects.filter(status='success').count(), stats['items'])
+
+        # a second run finds nothing due, and bills nothing again
+        self.assertEqual(due_renewals(), [])
+        stats = rebill(threads=1)
+        self.assertEqual(stats['items'], 0)
+        self.assertEqual(OrderItem.objects.count(), item_count + RebillAttempt.objects.count())
+
+    def testClaimOnce(self):
+        """Overlapping runs never both claim the same renewal"""
+        from payment.models import RebillAttempt
+        from payment.rebill import CLAIM_TIMEOUT, _claim, due_renewals
+
+        for item in OrderItem.objects.all():
+            item.expire_date = datetime.date.today()
+            item.save()
+        item = due_renewals()[0][1][0]
+        RebillAttempt.objects.create(key=RebillAttempt.make_key(item), orderitem=item, status='retry')
+
+        def due_item():
+            return [i for order, items in due_renewals() for i in items if i.id == item.id]
+
+        # two runs load the attempt at the same time
+        first = due_item()[0]
+        second = due_item()[0]
+        self.assertEqual(first.rebill_attempt.status, 'retry')
+        self.assert_(_claim(first) is not None)
+        self.assertEqual(_claim(second), None)
+        self.assertEqual(_claim(first), None)
+
+        # while it is being charged it is not due
+        self.assertEqual(due_item(), [])
+
+        # a run which died is taken over, by one run only
+        attempt = RebillAttempt.objects.get(orderitem=item)
+        attempt.claimed_at = datetime.datetime.now() - CLAIM_TIMEOUT - datetime.timedelta(minutes=1)
+        attempt.save()
+        first = due_item()[0]
+        second = due_item()[0]
+        self.assert_(_claim(first) is not None)
+        self.assertEqual(_claim(second), None)
+
     def getTerms(self, object, ignore_trial=False):
         if object.subscriptionproduct.get_trial_terms().count() and ignore_trial is False:
             price = object.subscriptionproduct.get_trial_terms(0).price
@@ -7,7 +7,8 @@ from product.models import Category, CategoryTranslation, CategoryImage, Categor
                                    CustomProduct, CustomTextField, CustomTextFieldTranslation, ConfigurableProduct, \
                                    DownloadableProduct, SubscriptionProduct, Trial, ProductVariation, ProductAttribute, \
                                    Price, ProductImage, ProductImageTranslation, default_weight_unit, \
-                                   default_dimension_unit, ProductTranslation, Discount, TaxClass
+                                   default_dimension_unit, ProductTranslation, Discount, TaxClass, \
+                                   CategoryCounts
 from satchmo_utils.thumbnail.field import ImageWithThumbnailField
 from satchmo_utils.thumbnail.widgets import AdminImageWithThumbnailWidget
 
@@ -145,6 +146,11 @@ class ProductOptions(admin.ModelAdmin):
             field.initial = default_weight_unit()
         return field
 
+    def save_formset(self, request, form, formset, change):
+        super(ProductOptions, self).save_formset(request, form, formset, change)
+        # the categories are saved after the product, recount them now
+        CategoryCounts.invalidate(form.instance.site_id)
+
 class CustomProductOptions(admin.ModelAdmin):
     inlines = [CustomTextField_Inline]
 
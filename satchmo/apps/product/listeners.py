@@ -4,6 +4,7 @@ except:
     from django.utils._decimal import Decimal, InvalidOperation
 
 from django.contrib.sites.models import Site
+from django.db import connection
 from django.db.models import Q
 from product.models import Product, Category
 import logging
@@ -53,6 +54,49 @@ def default_product_search_listener(sender, request=None, category=None, keyword
         'products': products
         })
 
+def indexed_product_search_listener(sender, request=None, category=None, keywords=[], results={}, **kwargs):
+    """Performs the satchmo search using the product search index, ranking the best matches first.
+    Falls back to the default product search until the index has been built with satchmo_rebuild_search_index.
+    """
+    from product import search
+
+    default_product_search_listener(sender, request=request, category=category, keywords=keywords,
+        results=results, **kwargs)
+    if not keywords:
+        return
+
+    log.debug('indexed product search listener')
+    site = Site.objects.get_current()
+    if not category:
+        results['categories'] = search.search_categories(keywords, site.id)
+
+    if not search.index_ready():
+        return
+
+    productkwargs = {
+        'productvariation__parent__isnull' : True,
+        'active' : True,
+        'site' : site
+    }
+    if category:
+        productkwargs['category__in'] = results['categories']
+
+    ids = [productid for productid, rank in search.search_products(keywords, **productkwargs)]
+    terms = search.search_terms(keywords)
+    if not ids or not terms:
+        results['products'] = Product.objects.none()
+        return
+
+    opts = search.ProductSearchTerm._meta
+    qn = connection.ops.quote_name
+    rank = "SELECT SUM(%s) FROM %s WHERE %s = %s.%s AND %s IN (%s)" % (
+        qn(opts.get_field('weight').column), qn(opts.db_table),
+        qn(opts.get_field('product').column), qn(Product._meta.db_table), qn('id'),
+        qn(opts.get_field('term').column), ", ".join(["%s"] * len(terms)))
+
+    results['products'] = Product.objects.filter(id__in=ids, **productkwargs).extra(
+        select={'search_rank' : rank}, select_params=terms, order_by=['-search_rank'])
+
 def priceband_search_listener(sender, request=None, category=None, keywords=[], results={}, **kwargs):
     """Filter search results by price bands.
     
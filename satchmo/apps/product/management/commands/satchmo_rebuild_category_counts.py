@@ -0,0 +1,39 @@
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand
+from product.models import CategoryCounts
+
+class Command(BaseCommand):
+    help = "Recounts the active products of every Satchmo category."
+    args = ['sitename...']
+
+    requires_model_validation = True
+
+    def handle(self, *sitenames, **options):
+        verbosity = int(options.get('verbosity', 1))
+        if len(sitenames) == 0:
+            if verbosity > 0:
+                print "Rebuilding category counts for all sites"
+            sites = Site.objects.all()
+        else:
+            sites = []
+            for sitename in sitenames:
+                try:
+                    sites.append(Site.objects.get(domain__iexact=sitename))
+                except Site.DoesNotExist:
+                    print "Warning: Could not find site '%s'" % sitename
+
+        for site in sites:
+            if verbosity > 0:
+                print "Counting active products for %s" % site.domain
+
+            CategoryCounts.invalidate(site.id)
+            counts = CategoryCounts.get(site.id)
+
+            if verbosity > 0:
+                print "%i categories have active products" % len(counts.below)
+            if verbosity > 1:
+                catids = counts.below.keys()
+                catids.sort()
+                for catid in catids:
+                    print "Category %i: %i products, %i with subcategories" % (
+                        catid, counts.count(catid), counts.count(catid, include_children=True))
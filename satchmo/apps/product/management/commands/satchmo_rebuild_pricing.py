@@ -1,22 +1,27 @@
 from django.contrib.sites.models import Site
 from django.core.management.base import BaseCommand
 from optparse import make_option
-from product.models import Product, ProductPriceLookup
+from product.models import ProductPriceLookup, LOOKUP_BATCH_SIZE
+import time
 
 class Command(BaseCommand):
     help = "Builds Satcho Product pricing lookup tables."
     args = ['sitename...']
 
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=LOOKUP_BATCH_SIZE,
+            help='Number of products to price, and of prices to insert, at a time.'),
+        )
+
     requires_model_validation = True
 
     def handle(self, *sitenames, **options):
-        from django.conf import settings
-
         verbosity = int(options.get('verbosity', 1))
+        batch_size = int(options.get('batch_size', LOOKUP_BATCH_SIZE))
         if len(sitenames) == 0:
             if verbosity>0:
                 print "Rebuilding pricing for all products for all sites"
-                sites = Site.objects.all()
+            sites = Site.objects.all()
         else:
             sites = []
             for sitename in sitenames:
@@ -27,35 +32,26 @@ class Command(BaseCommand):
 
         total = 0
         for site in sites:
-            ct = 0
             if verbosity > 0:
                 print "Starting product pricing for %s" % site.domain
 
-            if verbosity > 1:
-                print "Deleting old pricing"
-                
-            for lookup in ProductPriceLookup.objects.filter(siteid=site.id):
-                lookup.delete()
-            
-            products = Product.objects.active_by_site(site=site, variations=False)
-            if verbosity > 0:
-                print "Adding %i products" % products.count()
-                
-            for product in products:
-                if verbosity > 1:
-                    print "Processing product: %s" % product.slug
-                
-                prices = ProductPriceLookup.objects.smart_create_for_product(product)
+            start = time.time()
+
+            def progress(done, count, prices):
                 if verbosity > 1:
-                    print "Created %i prices" % len(prices)
-                
-                ct += len(prices)
-            
+                    elapsed = max(time.time() - start, 0.001)
+                    print "Priced %i of %i products, %i prices (%.1f products/sec)" % (
+                        done, count, prices, done / elapsed)
+
+            productct, ct = ProductPriceLookup.objects.rebuild_all(site=site,
+                batch_size=batch_size, progress=progress)
+
             if verbosity > 0:
-                print "Added %i total prices for site" % ct
+                elapsed = max(time.time() - start, 0.001)
+                print "Added %i total prices for %i products in %.1f seconds (%.1f products/sec)" % (
+                    ct, productct, elapsed, productct / elapsed)
             
             total += ct
 
         if verbosity > 0:
             print "Added %i total prices" % total
-            
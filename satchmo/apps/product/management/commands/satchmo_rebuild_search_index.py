@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+from product import search
+import time
+
+class Command(BaseCommand):
+    help = "Builds the Satchmo product search index."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=search.INDEX_BATCH_SIZE,
+            help='Number of products to index at a time.'),
+        )
+
+    requires_model_validation = True
+
+    def handle(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        batch_size = int(options.get('batch_size', search.INDEX_BATCH_SIZE))
+        if verbosity > 0:
+            print "Rebuilding the product search index"
+
+        start = time.time()
+
+        def progress(done, count, terms):
+            if verbosity > 1:
+                elapsed = max(time.time() - start, 0.001)
+                print "Indexed %i of %i products, %i terms (%.1f products/sec)" % (
+                    done, count, terms, done / elapsed)
+
+        productct, ct = search.rebuild_index(batch_size=batch_size, progress=progress)
+
+        if verbosity > 0:
+            elapsed = max(time.time() - start, 0.001)
+            print "Added %i terms for %i products in %.1f seconds (%.1f products/sec)" % (
+                ct, productct, elapsed, productct / elapsed)
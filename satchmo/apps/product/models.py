@@ -12,17 +12,20 @@ import sha
 import signals
 import operator
 import os.path
+import time
 
 from django import forms
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django.core import urlresolvers
-from django.db import models
+from django.db import connection, models, transaction
 from django.db.models import Q
 from django.db.models.fields.files import FileField
-from django.utils.encoding import smart_str
+from django.utils.encoding import force_unicode, smart_str
 from django.utils.safestring import mark_safe
 from django.utils.translation import get_language, ugettext, ugettext_lazy as _
+from keyedcache import cache_delete, cache_get, cache_get_many, cache_key, cache_set, cache_set_many, NotCachedError
+from keyedcache.models import VersionedSnapshot
 from l10n.utils import moneyfmt
 from livesettings import config_value, SettingNotSet, config_value_safe
 from satchmo_utils import cross_list, normalize_dir, url_join, get_flat_list, add_month
@@ -83,18 +86,26 @@ class CategoryManager(models.Manager):
         """Search for categories by keyword. 
         Note, this does not return a queryset."""
         
+        from product.search import search_categories
+
         if not site:
             site = Site.objects.get_current()
         
-        cats = self.filter(
-            Q(name__icontains=keyword) |
-            Q(meta__icontains=keyword) |
-            Q(description__icontains=keyword),
-            site=site)
+        cats = search_categories([keyword], site.id)
         
         if include_children:
-            # get all the children of the categories found
-            cats = [cat.get_active_children(include_self=True) for cat in cats]
+            # get all the children of the categories found, loading them
+            # together
+            tree = CategoryTree.get(site.id)
+            active = CategoryCounts.get(site.id).active()
+            found = list(cats)
+            ids = []
+            for cat in found:
+                if cat.id in tree:
+                    ids.extend(tree.descendants(cat.id, only=active))
+            kids = _ordered_categories(ids)
+            cats = [found, kids]
+            cats.extend([cat.get_active_children() for cat in found if not cat.id in tree])
             
         # sort properly
         if cats:
@@ -104,6 +115,169 @@ class CategoryManager(models.Manager):
             cats = zip(*fastsort)[2]            
         return cats
 
+class CategoryTree(VersionedSnapshot):
+    """An index of the category tree of one site, loaded with a single query.
+
+    Holds the parent, slug, name and ordering of every category, with the
+    path of ancestors precomputed for each, so that ancestors and
+    descendants can be found without walking the tree one query at a time.
+    Trees are kept in process, and reloaded when their version stamp is
+    changed by a category being saved or deleted.
+    """
+
+    cache_name = 'CategoryTree'
+
+    def __init__(self, siteid):
+        self.siteid = siteid
+        self.nodes = {}
+        self.children = {}
+
+        for cat in Category.objects.filter(site__id__exact=siteid):
+            self.nodes[cat.id] = (cat.parent_id, cat.slug, cat.name, cat.ordering)
+            self.children.setdefault(cat.parent_id, []).append(((cat.ordering, cat.name), cat.id))
+
+        for key, kids in self.children.items():
+            kids.sort()
+            self.children[key] = [kid[1] for kid in kids]
+
+        self.paths = {}
+        for catid in self.nodes:
+            self.paths[catid] = self._path(catid)
+
+    def _path(self, catid):
+        path = []
+        seen = {catid : True}
+        parentid = self.nodes[catid][0]
+        while parentid is not None and parentid in self.nodes and not parentid in seen:
+            path.append(parentid)
+            seen[parentid] = True
+            parentid = self.nodes[parentid][0]
+        path.reverse()
+        return tuple(path)
+
+    def __contains__(self, catid):
+        return catid in self.nodes
+
+    def ancestors(self, catid):
+        """Ids of the ancestors of a category, starting from the root."""
+        return list(self.paths.get(catid, ()))
+
+    def descendants(self, catid, only=None):
+        """Ids of all categories below a category, each followed by its
+        own descendants, in display order.
+
+        If `only` is given, categories not in it are skipped along with
+        everything below them.
+        """
+        work = []
+        seen = {catid : True}
+        stack = list(self.children.get(catid, []))
+        stack.reverse()
+        while stack:
+            kid = stack.pop()
+            if kid in seen or (only is not None and not kid in only):
+                continue
+            seen[kid] = True
+            work.append(kid)
+            kids = list(self.children.get(kid, []))
+            kids.reverse()
+            stack.extend(kids)
+        return work
+
+    def slug(self, catid):
+        return self.nodes[catid][1]
+
+    def name(self, catid):
+        return self.nodes[catid][2]
+
+class CategoryCounts(VersionedSnapshot):
+    """Counts of the active products of every category of one site, both
+    directly in each category and in each category together with all the
+    categories below it, loaded with three queries.  Also knows which
+    categories hold any products at all, active or not.
+
+    Counts are kept in process like the category tree, and recounted when
+    their version stamp is changed by a product being saved or deleted, or
+    when the category tree itself changes.  Django sends no signal when only
+    the categories of a product change, so code doing that must save the
+    product or call `invalidate` afterwards.  The product admin does so.
+    """
+
+    cache_name = 'CategoryCounts'
+
+    def __init__(self, siteid):
+        self.siteid = siteid
+        tree = CategoryTree.get(siteid)
+        self.tree_version = tree.version
+
+        field = Product._meta.get_field('category')
+        qn = connection.ops.quote_name
+        member = "%s.%s" % (qn(field.m2m_db_table()), qn(field.m2m_column_name()))
+        rows = Category.objects.filter(site__id__exact=siteid,
+            product__site__id__exact=siteid,
+            product__active=True).extra(select={'product_id' : member}).values('id', 'product_id')
+
+        variations = {}
+        for row in ProductVariation.objects.filter(product__site__id__exact=siteid).values('product'):
+            variations[row['product']] = True
+
+        direct = {}
+        for row in rows:
+            direct.setdefault(row['id'], {})[row['product_id']] = True
+
+        # a product in several categories below a category counts once there
+        below = {}
+        for catid, products in direct.items():
+            for target in tree.ancestors(catid) + [catid]:
+                below.setdefault(target, {}).update(products)
+
+        self.direct = self._count(direct, variations)
+        self.below = self._count(below, variations)
+
+        # categories with products of any kind, as Category.product_set sees them
+        cursor = connection.cursor()
+        cursor.execute("SELECT DISTINCT %s FROM %s" % (qn(field.m2m_reverse_name()),
+            qn(field.m2m_db_table())))
+        self.filled = dict([(row[0], True) for row in cursor.fetchall() if row[0] in tree])
+
+    def _count(self, members, variations):
+        counts = {}
+        for catid, products in members.items():
+            plain = len([p for p in products if not p in variations])
+            counts[catid] = (len(products), plain)
+        return counts
+
+    def count(self, catid, include_children=False, variations=True):
+        """Number of active products in a category, optionally including
+        those in the categories below it, and optionally leaving out
+        product variations."""
+        if include_children:
+            counts = self.below
+        else:
+            counts = self.direct
+        both = counts.get(catid, (0, 0))
+        if variations:
+            return both[0]
+        return both[1]
+
+    def active(self):
+        """Ids of the categories with active products of their own."""
+        return dict([(catid, True) for catid in self.direct])
+
+    def has_products(self, catid):
+        """Whether a category holds any products of its own, active or not."""
+        return catid in self.filled
+
+    def is_current(self):
+        return self.tree_version == CategoryTree.get(self.siteid).version
+
+def _ordered_categories(ids):
+    """Load categories by id with one query, keeping the order of `ids`."""
+    if not ids:
+        return []
+    cats = Category.objects.in_bulk(ids)
+    return [cats[catid] for catid in ids if catid in cats]
+
 class Category(models.Model):
     """
     Basic hierarchical category model for storing products
@@ -172,13 +346,40 @@ class Category(models.Model):
         if cat_obj == self and p_list:
             p_list.reverse()
         return p_list
-        
+
+    def _tree(self):
+        return CategoryTree.get(self.site_id)
+
+    def _parent_ids(self):
+        """Ids of the ancestors of this category, starting from the root.
+
+        Uses the current, possibly unsaved, parent of this category and the
+        site's category tree above it.  Returns None if the parent isn't in
+        the tree.
+        """
+        if not self.parent_id:
+            return []
+        tree = self._tree()
+        if not self.parent_id in tree:
+            return None
+        return tree.ancestors(self.parent_id) + [self.parent_id]
+
     def parents(self):
-        return self._recurse_for_parents(self)
+        ids = self._parent_ids()
+        if ids is None:
+            return self._recurse_for_parents(self)
+        return _ordered_categories(ids)
+
+    def _parent_attrs(self, attr):
+        """An attribute of each parent, from the tree when possible."""
+        ids = self._parent_ids()
+        if ids is None:
+            return [getattr(cat, attr) for cat in self._recurse_for_parents(self)]
+        tree = self._tree()
+        return [getattr(tree, attr)(catid) for catid in ids]
 
     def get_absolute_url(self):
-        parents = self._recurse_for_parents(self)
-        slug_list = [cat.slug for cat in parents]
+        slug_list = self._parent_attrs('slug')
         if slug_list:
             slug_list = "/".join(slug_list) + "/"
         else:
@@ -190,7 +391,7 @@ class Category(models.Model):
         return ' :: '
 
     def _parents_repr(self):
-        name_list = [cat.name for cat in self._recurse_for_parents(self)]
+        name_list = self._parent_attrs('name')
         return self.get_separator().join(name_list)
     _parents_repr.short_description = "Category parents"
 
@@ -198,7 +399,7 @@ class Category(models.Model):
         # Get all the absolute URLs and names for use in the site navigation.
         name_list = []
         url_list = []
-        for cat in self._recurse_for_parents(self):
+        for cat in prefetch_translations(self.parents()):
             name_list.append(cat.translated_name())
             url_list.append(cat.get_absolute_url())
         name_list.append(self.translated_name())
@@ -206,7 +407,7 @@ class Category(models.Model):
         return zip(name_list, url_list)
 
     def __unicode__(self):
-        name_list = [cat.name for cat in self._recurse_for_parents(self)]
+        name_list = self._parent_attrs('name')
         name_list.append(self.name)
         return self.get_separator().join(name_list)
 
@@ -215,7 +416,7 @@ class Category(models.Model):
             if self.parent and self.parent_id == self.id:
                 raise validators.ValidationError(_("You must not save a category in itself!"))
 
-            for p in self._recurse_for_parents(self):
+            for p in self.parents():
                 if self.id == p.id:
                     raise validators.ValidationError(_("You must not save a category in itself!"))
 
@@ -252,12 +453,24 @@ class Category(models.Model):
         """
         Gets a list of all of the children categories.
         """
-        children_list = self._recurse_for_children(self, only_active=only_active)
-        if include_self:
-            ix = 0
+        tree = self._tree()
+        if not self.id in tree:
+            children_list = self._recurse_for_children(self, only_active=only_active)
+            if include_self:
+                ix = 0
+            else:
+                ix = 1
+            return self._flatten(children_list[ix:])
+
+        if only_active:
+            # a category without active products hides its own children too
+            ids = tree.descendants(self.id, only=CategoryCounts.get(self.site_id).active())
         else:
-            ix = 1
-        flat_list = self._flatten(children_list[ix:])
+            ids = tree.descendants(self.id)
+
+        flat_list = _ordered_categories(ids)
+        if include_self:
+            flat_list.insert(0, self)
         return flat_list
         
     class Meta:
@@ -362,7 +575,7 @@ class NullDiscount(object):
         self.discounted_prices = []
         self.automatic = False
 
-    def calc(self, *args):
+    def calc(self, order, items=None):
         return Decimal("0.00")
         
     def is_valid(self):
@@ -461,24 +674,34 @@ class Discount(models.Model):
             return (False, ugettext('This discount cannot be applied to the products in your cart.'))
 
     def _valid_products(self, item_query):
-        validslugs = self.validProducts.values_list('slug', flat=True)
         itemslugs = item_query.values_list('product__slug', flat=True)
+        return self._valid_slugs(itemslugs)
+
+    def _valid_slugs(self, itemslugs):
+        validslugs = self.validProducts.values_list('slug', flat=True)
         return ProductPriceLookup.objects.filter(
             Q(discountable=True)
             &Q(productslug__in=validslugs)
             &Q(productslug__in=itemslugs)
             ).values_list('productslug', flat=True)
 
-    def calc(self, order):
+    def calc(self, order, items=None):
         # Use the order details and the discount specifics to calculate the actual discount
+        # `items` may be the order's items, already loaded.
         discounted = {}
+        if items is None:
+            items = order.orderitem_set.all()
+            itemslugs = order.orderitem_set.values_list('product__slug', flat=True)
+        else:
+            itemslugs = [lineitem.product.slug for lineitem in items]
+
         if self.validProducts.count() == 0:
             allvalid = True
         else:
             allvalid = False
-            validproducts = self._valid_products(order.orderitem_set)
+            validproducts = dict([(slug, True) for slug in self._valid_slugs(itemslugs)])
 
-        for lineitem in order.orderitem_set.all():
+        for lineitem in items:
             lid = lineitem.id
             price = lineitem.line_item_price
             if lineitem.product.is_discountable and (allvalid or lineitem.product.slug in validproducts):
@@ -532,12 +755,24 @@ class Discount(models.Model):
 
     percentage_text = property(_percentage_text)
 
+    def _valid_product_ids(self):
+        """Ids of the products this discount is valid for, from the
+        automatic discount index when it is in it, else loaded once."""
+        ids = getattr(self, '_valid_ids_cache', None)
+        if ids is None:
+            index = AutoDiscountIndex.get()
+            if self.id in index.products:
+                ids = index.products[self.id]
+            else:
+                ids = dict([(pid, True) for pid in self.validProducts.values_list('id', flat=True)])
+            self._valid_ids_cache = ids
+        return ids
+
     def valid_for_product(self, product):
         """Tests if discount is valid for a single product"""
         if not product.is_discountable:
             return False
-        p = self.validProducts.filter(id__exact = product.id)
-        return p.count() > 0
+        return product.id in self._valid_product_ids()
 
     class Meta:
         verbose_name = _("Discount")
@@ -594,6 +829,66 @@ class Discount(models.Model):
     apply_percentage = classmethod(apply_percentage)
 
 
+class AutoDiscountIndex(VersionedSnapshot):
+    """The automatic discounts active today, and the products each is valid
+    for, loaded with two queries.
+
+    Kept in process and reloaded on a new day, or when its version stamp is
+    changed by a discount being saved or deleted.
+    """
+
+    cache_name = 'AutoDiscountIndex'
+
+    def __init__(self):
+        self.day = day = datetime.date.today()
+        self.discounts = list(Discount.objects.filter(automatic=True, active=True,
+            startDate__lte=day, endDate__gt=day).order_by('-percentage'))
+
+        self.products = {}
+        self.by_product = {}
+        if not self.discounts:
+            return
+
+        byid = {}
+        for discount in self.discounts:
+            byid[discount.id] = discount
+            self.products[discount.id] = {}
+
+        field = Discount._meta.get_field('validProducts')
+        qn = connection.ops.quote_name
+        member = "%s.%s" % (qn(field.m2m_db_table()), qn(field.m2m_column_name()))
+        rows = Product.objects.filter(discount__id__in=byid.keys()).extra(
+            select={'discount_id' : member}).values('id', 'discount_id')
+        for row in rows:
+            self.products[row['discount_id']][row['id']] = True
+
+        # best first, as the discounts are
+        for discount in self.discounts:
+            discount._valid_ids_cache = self.products[discount.id]
+            for productid in self.products[discount.id]:
+                self.by_product.setdefault(productid, []).append(discount)
+
+    def for_products(self, products):
+        """The discounts valid for any of `products`, best first."""
+        found = {}
+        for product in products:
+            for discount in self.by_product.get(product.id, []):
+                found[discount.id] = True
+        return [discount for discount in self.discounts if discount.id in found]
+
+    def best_for_products(self, products):
+        """The best discount for each of `products`, by product id.  Products
+        without one are left out."""
+        best = {}
+        for product in products:
+            discounts = self.by_product.get(product.id, None)
+            if discounts:
+                best[product.id] = discounts[0]
+        return best
+
+    def is_current(self):
+        return self.day == datetime.date.today()
+
 class OptionGroup(models.Model):
     """
     A set of options that can be applied to an item.
@@ -744,7 +1039,70 @@ class ProductManager(models.Manager):
             
         query = query.order_by('-date_added')
         return query
-    
+
+    def load_subtypes(self, products):
+        """Find the subtypes of a list of products at once, with one cache
+        call and one query per subtype model for those not cached, and
+        remember them on each product along with the subtype objects found.
+        Returns the products."""
+        todo = {}
+        for product in products:
+            if product.id and getattr(product, '_subtypes_cache', None) is None:
+                todo[cache_key('ProductSubtypes', product.id)] = product
+        if not todo:
+            return products
+
+        found, missing = cache_get_many(todo.keys())
+        for key, types in found.items():
+            todo[key]._subtypes_cache = types
+
+        subtype_models = _subtype_models()
+        if missing and subtype_models is not None:
+            byid = dict([(todo[key].id, todo[key]) for key in missing])
+            types = dict([(productid, []) for productid in byid])
+            for accessor, model in subtype_models:
+                for subtype in model.objects.filter(product__id__in=byid.keys()):
+                    product = byid[subtype.product_id]
+                    # saves the query when the subtype is looked up later
+                    setattr(product, '_%s_cache' % accessor, subtype)
+                    subtype._product_cache = product
+                    name = subtype._get_subtype()
+                    if not name in types[subtype.product_id]:
+                        types[subtype.product_id].append(name)
+
+            work = {}
+            for key in missing:
+                product = todo[key]
+                product._subtypes_cache = work[key] = tuple(types[product.id])
+            cache_set_many(work)
+
+        return products
+
+# Subtype models for each value of the PRODUCT_TYPES setting.
+_SUBTYPE_MODELS = {}
+
+def _subtype_models():
+    """The accessor name and model of each product subtype in use, or None
+    if the setting can't be read yet."""
+    try:
+        keys = tuple(config_value('PRODUCT', 'PRODUCT_TYPES'))
+    except SettingNotSet:
+        log.warn("Error getting subtypes, OK if in SyncDB")
+        return None
+
+    try:
+        return _SUBTYPE_MODELS[keys]
+    except KeyError:
+        pass
+
+    work = []
+    for key in keys:
+        app, subtype = key.split("::")
+        model = models.get_model(app, subtype)
+        if model is not None:
+            work.append((subtype.lower(), model))
+    _SUBTYPE_MODELS[keys] = work
+    return work
 
 class Product(models.Model):
     """
@@ -948,6 +1306,31 @@ class Product(models.Model):
         ProductPriceLookup.objects.smart_create_for_product(self)
 
     def get_subtypes(self):
+        """Names of the subtypes of this product, found once and then kept
+        on the product and in the cache until a subtype is saved or deleted."""
+        types = getattr(self, '_subtypes_cache', None)
+        if types is not None:
+            return types
+
+        if not self.id:
+            return self._find_subtypes()
+
+        try:
+            types = cache_get('ProductSubtypes', self.id)
+        except NotCachedError, nce:
+            types = self._find_subtypes()
+            if types is None:
+                return ()
+            cache_set(nce.key, value=types)
+
+        self._subtypes_cache = types
+        return types
+
+    get_subtypes.short_description = _("Product Subtypes")
+
+    def _find_subtypes(self):
+        """Look for each subtype in turn, returning None if the setting
+        can't be read yet."""
         types = []
         try:
             for key in config_value('PRODUCT', 'PRODUCT_TYPES'):
@@ -962,11 +1345,10 @@ class Product(models.Model):
                     pass
         except SettingNotSet:
             log.warn("Error getting subtypes, OK if in SyncDB")
+            return None
 
         return tuple(types)
 
-    get_subtypes.short_description = _("Product Subtypes")
-
     def get_subtype_with_attr(self, *args):
         """Get a subtype with the specified attributes.  Note that this can be chained
         so that you can ensure that the attribute then must have the specified attributes itself.
@@ -1120,6 +1502,21 @@ class ProductTranslation(models.Model):
     def __unicode__(self):
         return u"ProductTranslation: [%s] (ver #%i) %s Name: %s" % (self.languagecode, self.version, self.product, self.name)
 
+class ProductSearchTerm(models.Model):
+    """A stemmed word from the text of a `Product` or its translations, with
+    its weight in search ranking.  Maintained by `product.search`.
+    """
+    product = models.ForeignKey(Product, related_name="searchterms")
+    term = models.CharField(_("Term"), max_length=64, db_index=True)
+    weight = models.IntegerField(_("Weight"), default=1)
+
+    class Meta:
+        verbose_name = _('Product Search Term')
+        verbose_name_plural = _('Product Search Terms')
+
+    def __unicode__(self):
+        return u"%s: %s (%i)" % (self.product_id, self.term, self.weight)
+
 def get_all_options(obj, ids_only=False):
     """
     Returns all possible combinations of options for this products OptionGroups as a List of Lists.
@@ -1307,24 +1704,142 @@ class ConfigurableProduct(models.Model):
             sublist = []
         return cross_list(masterlist)
 
+    def get_option_matrix(self):
+        """The `OptionMatrix` of the variations of this product."""
+        return OptionMatrix.get(self.product_id)
+
     def get_valid_options(self):
         """
-        Returns unique_ids from get_all_options(), but filters out Options that this
-        ConfigurableProduct doesn't have a ProductVariation for.
+        Returns the unique_ids of the options of each active ProductVariation
+        of this ConfigurableProduct.
         """
-        variations = self.productvariation_set.filter(product__active='1')
-        active_options = [v.unique_option_ids for v in variations]
-        all_options = get_all_options(self, ids_only=True)
-        return [opt for opt in all_options if self._unique_ids_from_options(opt) in active_options]
+        return self.get_option_matrix().valid_options()
+
+    def _missing_combinations(self, batch_size):
+        """The combinations of options, one from each option group, which no
+        variation of this product has yet, as lists of Options."""
+        groups = list(self.option_group.all())
+        if not groups:
+            return []
+        bygroup = {}
+        for option in Option.objects.filter(option_group__in=[g.id for g in groups]):
+            bygroup.setdefault(option.option_group_id, []).append(option)
+        masterlist = [bygroup.get(g.id, []) for g in groups]
+
+        # the options of every variation, restricted to the current groups,
+        # with one query per batch of variations
+        groupids = dict([(g.id, i) for i, g in enumerate(groups)])
+        optiongroup = {}
+        for option in get_flat_list(masterlist):
+            optiongroup[option.id] = option.option_group_id
+
+        field = ProductVariation._meta.get_field('options')
+        qn = connection.ops.quote_name
+        sql = "SELECT %s, %s FROM %s WHERE %s IN (%%s)" % (qn(field.m2m_column_name()),
+            qn(field.m2m_reverse_name()), qn(field.m2m_db_table()), qn(field.m2m_column_name()))
+        pvids = list(ProductVariation.objects.filter(parent=self).values_list('product', flat=True))
+        existing = {}
+        cursor = connection.cursor()
+        for batch in _chunks(pvids, batch_size):
+            cursor.execute(sql % ", ".join(["%s"] * len(batch)), batch)
+            for pvid, optionid in cursor.fetchall():
+                if optionid in optiongroup:
+                    existing.setdefault(pvid, {})[optiongroup[optionid]] = optionid
+
+        have = {}
+        for chosen in existing.values():
+            if len(chosen) == len(groups):
+                have[tuple([chosen[g.id] for g in groups])] = True
+
+        return [options for options in cross_list(masterlist)
+            if tuple([option.id for option in options]) not in have]
+
+    def _unique_slugs(self, slugs, batch_size):
+        """Make each of `slugs` unique, among themselves and the existing
+        products, the way `create_variation` does, by appending the id of
+        this product until it is."""
+        suffix = unicode(self.product.id)
+        slugs = list(slugs)
+        taken = {}
+        pending = range(len(slugs))
+        while pending:
+            existing = {}
+            for batch in _chunks([slugs[i] for i in pending], batch_size):
+                for slug in Product.objects.filter(slug__in=batch).values_list('slug', flat=True):
+                    existing[slug] = True
+            clashes = []
+            for i in pending:
+                slug = slugs[i]
+                if slug in existing or slug in taken:
+                    slugs[i] = u'_'.join((slug, suffix))
+                    clashes.append(i)
+                else:
+                    taken[slug] = True
+            pending = clashes
+        return slugs
 
-    def create_all_variations(self):
+    def create_all_variations(self, batch_size=None):
         """
         Get a list of all the optiongroups applied to this object
         Create all combinations of the options and create variations
+
+        The missing combinations are found in memory, and their products,
+        variations and options are inserted `batch_size` rows at a time, so
+        the number of queries doesn't grow with the number of combinations.
+        Price lookups are rebuilt once at the end.  Returns the new variation
+        products.
         """
-        # Create a new ProductVariation for each combination.
-        for options in self.get_all_options():
-            self.create_variation(options)
+        if batch_size is None:
+            batch_size = LOOKUP_BATCH_SIZE
+        combinations = self._missing_combinations(batch_size)
+        if not combinations:
+            return []
+
+        parent = self.product
+        today = datetime.date.today()
+        slugs = self._unique_slugs([slugify(u'%s_%s' % (parent.slug,
+            u'_'.join([opt.value for opt in options]))) for options in combinations], batch_size)
+
+        variants = []
+        for options, slug in zip(combinations, slugs):
+            # named and with a sku as ProductVariation would default them
+            name = u'%s (%s)' % (parent.name, u'/'.join([opt.name for opt in options]))
+            log.debug("Creating variation for [%s] %s", parent.slug, slug)
+            variants.append(Product(site_id=parent.site_id, items_in_stock=0, name=name,
+                slug=slug, sku=slug, date_added=today))
+        log.info("Creating %i variations for [%s]", len(variants), parent.slug)
+
+        _insert_rows(Product, variants, batch_size)
+        ids = {}
+        for batch in _chunks(slugs, batch_size):
+            for pid, slug in Product.objects.filter(slug__in=batch, site=parent.site_id).values_list('id', 'slug'):
+                ids[slug] = pid
+        for variant in variants:
+            variant.id = ids[variant.slug]
+
+        _insert_rows(ProductVariation, [ProductVariation(product=variant, parent=self)
+            for variant in variants], batch_size)
+
+        field = ProductVariation._meta.get_field('options')
+        qn = connection.ops.quote_name
+        cursor = connection.cursor()
+        links = []
+        for variant, options in zip(variants, combinations):
+            for option in options:
+                links.append((variant.id, option.id))
+        sql = "INSERT INTO %s (%s, %s) VALUES (%%s, %%s)" % (qn(field.m2m_db_table()),
+            qn(field.m2m_column_name()), qn(field.m2m_reverse_name()))
+        for batch in _chunks(links, batch_size):
+            cursor.executemany(sql, batch)
+        transaction.commit_unless_managed()
+
+        # what the save signals of each product would have done
+        CategoryCounts.invalidate(parent.site_id)
+        OptionMatrix.invalidate(parent.id)
+        from product import search
+        search.reindex_products([variant.id for variant in variants], batch_size=batch_size)
+        ProductPriceLookup.objects.create_for_configurableproduct(parent)
+        return variants
 
     def create_variation(self, options, name=u"", sku=u"", slug=u""):
         """Create a productvariation with the specified options.
@@ -1409,16 +1924,39 @@ class ConfigurableProduct(models.Model):
         Returns the product that matches or None
         """    
         options = self._unique_ids_from_options(options)
-        pv = None
         if hasattr(self, '_variation_cache'):
             pv =  self._variation_cache.get(options, None)
-        else:
-            for member in self.productvariation_set.all():
-                if member.unique_option_ids == options:
-                    pv = member
-                    break
-        if pv:
-            return pv.product        
+            if pv:
+                return pv.product
+            return None
+
+        variation = self.get_option_matrix().find(options)
+        if variation:
+            try:
+                return Product.objects.get(id=variation['id'])
+            except Product.DoesNotExist:
+                pass
+        return None
+
+    def get_variation_price(self, options, qty=Decimal('1')):
+        """
+        Accepts an iterable of either Option object or a sorted tuple of
+        options ids.
+        Returns the slug and the price for `qty` of the matching variation,
+        read from the option matrix and its price lookups, or None
+        """
+        variation = self.get_option_matrix().find(self._unique_ids_from_options(options))
+        if not variation:
+            return None
+
+        lookup = ProductPriceLookup.objects.for_variation(self.product_id, variation['key'], qty)
+        if lookup:
+            return (variation['slug'], lookup.dynamic_price)
+
+        # not in the lookup table until satchmo_rebuild_pricing has run
+        product = self.get_product_from_options(options)
+        if product:
+            return (product.slug, product.get_qty_price(qty))
         return None
 
     def get_variations_for_options(self, options):
@@ -1452,12 +1990,15 @@ class ConfigurableProduct(models.Model):
 
         # Doesn't work with admin - the manipulator doesn't add the option_group
         # until after save() is called.
+        created = []
         if self.create_subs and self.option_group.count():
-            self.create_all_variations()
+            created = self.create_all_variations()
             self.create_subs = False
             super(ConfigurableProduct, self).save(force_insert=force_insert, force_update=force_update)
-            
-        ProductPriceLookup.objects.smart_create_for_product(self.product)
+
+        if not created:
+            # otherwise create_all_variations has rebuilt them
+            ProductPriceLookup.objects.smart_create_for_product(self.product)
 
     def get_absolute_url(self):
         return self.product.get_absolute_url()
@@ -1719,8 +2260,7 @@ class ProductVariation(models.Model):
 
     def _optionkey(self):
         #todo: verify ordering
-        optkeys = [str(x) for x in self.options.values_list('value', flat=True).order_by('option_group__id')]
-        return "::".join(optkeys)
+        return make_option_key(self.options.values_list('value', flat=True).order_by('option_group__id'))
     optionkey = property(fget=_optionkey)
 
     def _get_option_ids(self):
@@ -1861,41 +2401,242 @@ class ProductVariation(models.Model):
         return self.product.slug
         
 
+class OptionMatrix(object):
+    """The variations of one configurable product by their options, loaded
+    with two queries.
+
+    Maps the sorted unique ids of the options of each variation to the id,
+    slug, price lookup key, stock and active flag of its product, and keeps
+    the options themselves for serializing.  Matrices are shared through the
+    cache, and forgotten when the product, its variations or any option
+    changes.
+    """
+
+    def __init__(self, productid):
+        self.productid = productid
+
+        products = {}
+        for row in Product.objects.filter(productvariation__parent=productid).values(
+            'id', 'slug', 'active', 'items_in_stock'):
+            products[row['id']] = row
+
+        field = ProductVariation._meta.get_field('options')
+        qn = connection.ops.quote_name
+        member = "%s.%s" % (qn(field.m2m_db_table()), qn(field.m2m_column_name()))
+        chosen = {}
+        self.options = {}
+        for option in Option.objects.filter(productvariation__parent=productid).select_related(
+            'option_group').extra(select={'variation_id' : member}):
+            uid = option.unique_id
+            chosen.setdefault(option.variation_id, []).append((option.option_group_id, uid, option.value))
+            if uid not in self.options:
+                self.options[uid] = option
+
+        self.variations = {}
+        for pid, row in products.items():
+            opts = chosen.get(pid, [])
+            opts.sort()
+            self.variations[sorted_tuple([uid for groupid, uid, value in opts])] = {
+                'id' : pid,
+                'slug' : row['slug'],
+                # as ProductVariation.optionkey, the key of its price lookups
+                'key' : make_option_key([value for groupid, uid, value in opts]),
+                'active' : row['active'],
+                'stock' : row['items_in_stock'],
+            }
+
+    def find(self, options):
+        """The variation with the given sorted option unique ids, or None."""
+        return self.variations.get(tuple(options), None)
+
+    def valid_options(self):
+        """The option unique ids of every active variation."""
+        valid = [list(key) for key, variation in self.variations.items() if variation['active']]
+        valid.sort()
+        return valid
+
+    def get(cls, productid):
+        try:
+            matrix = cache_get('OptionMatrix', productid)
+        except NotCachedError, nce:
+            matrix = cls(productid)
+            cache_set(nce.key, value=matrix)
+        return matrix
+
+    get = classmethod(get)
+
+    def invalidate(cls, productid=None):
+        """Forget the matrix of a product, or of every product."""
+        if productid is None:
+            cache_delete('OptionMatrix', children=True)
+        else:
+            cache_delete('OptionMatrix', productid)
+
+    invalidate = classmethod(invalidate)
+
+# Rows inserted, and products priced, per batch when building price lookups.
+LOOKUP_BATCH_SIZE = 500
+
+def _chunks(seq, size):
+    for start in range(0, len(seq), size):
+        yield seq[start:start+size]
+
+def _insert_rows(model, objs, batch_size=LOOKUP_BATCH_SIZE):
+    """Insert unsaved objects, `batch_size` rows per executemany, without
+    calling their save methods or sending signals."""
+    if not objs:
+        return
+    opts = model._meta
+    fields = [f for f in opts.local_fields if not isinstance(f, models.AutoField)]
+    qn = connection.ops.quote_name
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (qn(opts.db_table),
+        ", ".join([qn(f.column) for f in fields]),
+        ", ".join(["%s"] * len(fields)))
+
+    cursor = connection.cursor()
+    for batch in _chunks(objs, batch_size):
+        rows = [[f.get_db_prep_save(f.pre_save(obj, True)) for f in fields] for obj in batch]
+        cursor.executemany(sql, rows)
+    transaction.commit_unless_managed()
+
+def get_current_prices(products, batch_size=LOOKUP_BATCH_SIZE):
+    """Unexpired prices of the given products, as lists by product id, with
+    one query per `batch_size` products."""
+    byid = dict([(product.id, product) for product in products])
+    prices = {}
+    today = datetime.date.today()
+    for ids in _chunks(byid.keys(), batch_size):
+        for price in Price.objects.filter(product__id__in=ids).exclude(
+            expires__isnull=False, expires__lt=today):
+            # saves a query for each price when it sends satchmo_price_query
+            price._product_cache = byid[price.product_id]
+            prices.setdefault(price.product_id, []).append(price)
+    return prices
+
+def _variation_options(variations, batch_size=LOOKUP_BATCH_SIZE):
+    """The option key and price delta of each variation, by product id,
+    with one query per `batch_size` variations."""
+    field = ProductVariation._meta.get_field('options')
+    qn = connection.ops.quote_name
+    member = "%s.%s" % (qn(field.m2m_db_table()), qn(field.m2m_column_name()))
+
+    values = {}
+    deltas = {}
+    for ids in _chunks([variation.product_id for variation in variations], batch_size):
+        rows = Option.objects.filter(productvariation__product__id__in=ids).extra(
+            select={'variation_id' : member}).values(
+            'variation_id', 'value', 'price_change').order_by('option_group__id')
+        for row in rows:
+            varid = row['variation_id']
+            values.setdefault(varid, []).append(row['value'])
+            delta = deltas.get(varid, Decimal("0.00"))
+            if row['price_change']:
+                delta += Decimal(row['price_change'])
+            deltas[varid] = delta
+
+    options = {}
+    for variation in variations:
+        varid = variation.product_id
+        options[varid] = (make_option_key(values.get(varid, [])), deltas.get(varid, Decimal("0.00")))
+    return options
+
+def _price_list(prices):
+    return [(price.quantity, price.dynamic_price) for price in prices]
+
 class ProductPriceLookupManager(models.Manager):
     
     def by_product(self, product):
         return self.get(productslug=product.slug)
     
+    def for_variation(self, parentid, key, qty=Decimal('1')):
+        """The lookup pricing `qty` of the variation of product `parentid`
+        with the option `key`, or None."""
+        lookups = self.filter(parentid=parentid, key=key, quantity__lte=qty).order_by('-quantity')[:1]
+        if lookups:
+            return lookups[0]
+        return None
+
     def delete_expired(self):
         for p in self.filter(expires__lt=datetime.date.today()):
             p.delete()
-    
-    def create_for_product(self, product):
-        """Create a set of lookup objects for all priced quantities of the Product"""
 
-        self.delete_for_product(product)
-        pricelist = product.get_qty_price_list()
-            
-        objs = []
-        for qty, price in pricelist:
-            obj = ProductPriceLookup(productslug=product.slug, 
+    def _lookups_for(self, product, pricelist, parentid=None, key=None):
+        """Unsaved lookup objects for each priced quantity of a product."""
+        if not pricelist:
+            return []
+        discountable = product.is_discountable
+        return [ProductPriceLookup(productslug=product.slug,
+                parentid=parentid,
                 siteid=product.site_id,
                 active=product.active,
-                price=price, 
-                quantity=qty, 
-                discountable=product.is_discountable,
+                price=price,
+                quantity=qty,
+                key=key,
+                discountable=discountable,
                 items_in_stock=product.items_in_stock)
-            obj.save()
-            objs.append(obj)
+            for qty, price in pricelist]
+
+    def _lookups_for_products(self, products, batch_size=LOOKUP_BATCH_SIZE):
+        """Unsaved lookup objects for products which are not variations, and
+        for the active variations of those which are configurable, fetching
+        the prices and options of all of them together."""
+        if not products:
+            return []
+
+        configurable = {}
+        for ids in _chunks([product.id for product in products], batch_size):
+            for row in ConfigurableProduct.objects.filter(product__id__in=ids).values('product'):
+                configurable[row['product']] = True
+
+        variations = []
+        for ids in _chunks(configurable.keys(), batch_size):
+            variations.extend(ProductVariation.objects.filter(parent__product__id__in=ids,
+                product__active=True).select_related('product'))
+
+        Product.objects.load_subtypes(list(products) + [variation.product for variation in variations])
+        prices = get_current_prices(products, batch_size=batch_size)
+        variation_prices = get_current_prices([variation.product for variation in variations],
+            batch_size=batch_size)
+        options = _variation_options(variations, batch_size=batch_size)
+
+        pricelists = {}
+        objs = []
+        for product in products:
+            pricelist = _price_list(prices.get(product.id, []))
+            pricelists[product.id] = pricelist
+            objs.extend(self._lookups_for(product, pricelist))
+
+        for variation in variations:
+            product = variation.product
+            key, delta = options[product.id]
+            if product.id in variation_prices:
+                # prices directly set, use them
+                pricelist = _price_list(variation_prices[product.id])
+            else:
+                pricelist = [(qty, price+delta) for qty, price in pricelists[variation.parent_id]]
+            objs.extend(self._lookups_for(product, pricelist,
+                parentid=variation.parent_id, key=key))
+
+        return objs
+
+    def _insert(self, objs, batch_size=LOOKUP_BATCH_SIZE):
+        """Insert unsaved lookup objects, `batch_size` rows per executemany."""
+        _insert_rows(self.model, objs, batch_size)
+
+    def create_for_product(self, product):
+        """Create a set of lookup objects for all priced quantities of the Product"""
+
+        self.delete_for_product(product)
+        objs = self._lookups_for(product, product.get_qty_price_list())
+        self._insert(objs)
         return objs
         
     def create_for_configurableproduct(self, configproduct):
         """Create a set of lookup objects for all variations of this product"""
 
-        objs = self.create_for_product(configproduct)
-        for pv in configproduct.configurableproduct.productvariation_set.filter(product__active='1'):
-            objs.extend(self.create_for_variation(pv, configproduct))
-        
+        objs = self._lookups_for_products([configproduct])
+        self.filter(Q(productslug=configproduct.slug) | Q(parentid=configproduct.pk)).delete()
+        self._insert(objs)
         return objs
         
     def create_for_variation(self, variation, parent):
@@ -1903,40 +2644,56 @@ class ProductPriceLookupManager(models.Manager):
         product = variation.product
         
         self.delete_for_product(product)
-        pricelist = variation.get_qty_price_list()
-            
-        objs = []
-        for qty, price in pricelist:
-            obj = ProductPriceLookup(productslug=product.slug, 
-                parentid=parent.pk,
-                siteid=product.site_id,
-                active=product.active,
-                price=price, 
-                quantity=qty, 
-                key=variation.optionkey, 
-                discountable=product.is_discountable,
-                items_in_stock=product.items_in_stock)
-            obj.save()
-            objs.append(obj)
+        objs = self._lookups_for(product, variation.get_qty_price_list(),
+            parentid=parent.pk, key=variation.optionkey)
+        self._insert(objs)
         return objs
         
     def delete_for_product(self, product):
-        for obj in self.filter(productslug=product.slug):
-            obj.delete()
+        self.filter(productslug=product.slug).delete()
         
-    def rebuild_all(self, site=None):
+    def rebuild_all(self, site=None, batch_size=LOOKUP_BATCH_SIZE, progress=None):
+        """Rebuild the lookup table for a site in one transaction.
+
+        Products are priced `batch_size` at a time.  After each batch,
+        `progress`, if given, is called with the number of products done,
+        the number of products in all and the number of prices added so far.
+
+        Returns the number of products and of prices.
+        """
         if not site:
             site = Site.objects.get_current()
 
-        for lookup in self.filter(siteid=site.id):
-            lookup.delete()
-
-        ct = 0
         log.debug('ProductPriceLookup rebuilding all pricing')
-        for p in Product.objects.active_by_site(site=site, variations=False):
-            prices = self.smart_create_for_product(p)
-            ct += len(prices)
-        log.info('ProductPriceLookup built %i prices', ct)
+        start = time.time()
+        rebuild = transaction.commit_on_success(self._rebuild_site)
+        productct, ct = rebuild(site, batch_size, progress)
+        log.info('ProductPriceLookup built %i prices for %i products in %.1f seconds',
+            ct, productct, time.time() - start)
+        return productct, ct
+
+    def _rebuild_site(self, site, batch_size, progress):
+        # nothing refers to lookups, so there is nothing to collect first
+        opts = self.model._meta
+        qn = connection.ops.quote_name
+        cursor = connection.cursor()
+        cursor.execute("DELETE FROM %s WHERE %s = %%s" % (qn(opts.db_table),
+            qn(opts.get_field('siteid').column)), [site.id])
+
+        ids = list(Product.objects.active_by_site(site=site, variations=False).values_list('id', flat=True))
+        total = len(ids)
+        done = 0
+        ct = 0
+        for batch in _chunks(ids, batch_size):
+            products = Product.objects.in_bulk(batch)
+            objs = self._lookups_for_products([products[pid] for pid in batch if pid in products],
+                batch_size=batch_size)
+            self._insert(objs, batch_size=batch_size)
+            done += len(batch)
+            ct += len(objs)
+            if progress:
+                progress(done, total, ct)
+        return total, ct
             
     def smart_create_for_product(self, product):
         subtypes = product.get_subtypes()
@@ -2130,17 +2887,12 @@ UNSET = object()
 
 # --------------- helpers ------------------
 
-def lookup_translation(obj, attr, language_code=None, version=-1):
-    """Get a translated attribute by language.
-
-    If specific language isn't found, returns the attribute from the base object.
-    """
+def _language_codes(language_code=None):
+    """The language code to translate to, by default the current language,
+    and its short form, such as "de" for "de-at"."""
     if not language_code:
         language_code = get_language()
 
-    if not hasattr(obj, '_translationcache'):
-        obj._translationcache = {}
-
     short_code = language_code
     pos = language_code.find('_')
     if pos > -1:
@@ -2151,6 +2903,71 @@ def lookup_translation(obj, attr, language_code=None, version=-1):
         if pos > -1:
             short_code = language_code[:pos]
 
+    return language_code, short_code
+
+def _translation_relation(model):
+    """The translation model of a model, and the name of its foreign key to
+    it, found through the `translations` related name."""
+    for rel in model._meta.get_all_related_objects():
+        if rel.get_accessor_name() == 'translations':
+            return rel.model, rel.field
+    return None, None
+
+def prefetch_translations(objs, language_code=None, batch_size=LOOKUP_BATCH_SIZE):
+    """Load the translations of a list of translatable objects, such as
+    Products, Categories, Options and OptionGroups, with one query per
+    model, and keep them on the objects as `lookup_translation` would, so
+    that their translated names and descriptions need no more queries.
+
+    Returns the objects as a list.
+    """
+    objs = list(objs)
+    language_code, short_code = _language_codes(language_code)
+    lower_code = language_code.lower()
+    lower_short = short_code.lower()
+
+    bymodel = {}
+    for obj in objs:
+        if not hasattr(obj, '_translationcache'):
+            obj._translationcache = {}
+        if language_code in obj._translationcache and short_code in obj._translationcache:
+            continue
+        bymodel.setdefault(obj.__class__, []).append(obj)
+
+    for model, members in bymodel.items():
+        transmodel, field = _translation_relation(model)
+        if transmodel is None:
+            continue
+
+        found = {}
+        for batch in _chunks([obj.pk for obj in members], batch_size):
+            # every row lookup_translation might choose, newest first
+            for trans in transmodel.objects.filter(**{
+                '%s__in' % field.name : batch,
+                'languagecode__istartswith' : short_code}).order_by('-version'):
+                found.setdefault(getattr(trans, field.attname), []).append(trans)
+
+        for obj in members:
+            rows = found.get(obj.pk, [])
+            if short_code != language_code:
+                exact = [t for t in rows if t.languagecode.lower() == lower_code]
+                obj._translationcache[language_code] = (exact or [None])[0]
+            # the short code itself, else any of its variants
+            short = [t for t in rows if t.languagecode.lower() == lower_short]
+            obj._translationcache[short_code] = (short or rows or [None])[0]
+
+    return objs
+
+def lookup_translation(obj, attr, language_code=None, version=-1):
+    """Get a translated attribute by language.
+
+    If specific language isn't found, returns the attribute from the base object.
+    """
+    language_code, short_code = _language_codes(language_code)
+
+    if not hasattr(obj, '_translationcache'):
+        obj._translationcache = {}
+
     trans = None
     has_key = obj._translationcache.has_key(language_code)
     if has_key:
@@ -2202,20 +3019,33 @@ def lookup_translation(obj, attr, language_code=None, version=-1):
 
     return mark_safe(val)
 
-def get_product_quantity_adjustments(product, qty=1, parent=None):
-    """Gets a list of adjustments for the price found for a product/qty"""
+def get_product_quantity_adjustments(product, qty=1, parent=None, prices=None):
+    """Gets a list of adjustments for the price found for a product/qty
 
-    qty_discounts = product.price_set.exclude(
-        expires__isnull=False,
-        expires__lt=datetime.date.today()).filter(quantity__lte=qty)
+    `prices` may be the current prices of the product, as returned by
+    `get_current_prices`, to choose from instead of querying them.
+    """
 
     adjustments = None
 
-    if qty_discounts.count() > 0:
-        # Get the price with the quantity closest to the one specified without going over
-        adjustments = qty_discounts.order_by('-quantity')[0].adjustments()
+    if prices is not None:
+        best = None
+        for price in prices:
+            if price.quantity <= qty and (best is None or price.quantity > best.quantity):
+                best = price
+        if best is not None:
+            adjustments = best.adjustments()
+
+    else:
+        qty_discounts = product.price_set.exclude(
+            expires__isnull=False,
+            expires__lt=datetime.date.today()).filter(quantity__lte=qty)
+
+        if qty_discounts.count() > 0:
+            # Get the price with the quantity closest to the one specified without going over
+            adjustments = qty_discounts.order_by('-quantity')[0].adjustments()
 
-    elif parent:
+    if adjustments is None and parent:
         adjustments = get_product_quantity_adjustments(parent, qty=qty)
 
     if not adjustments:
@@ -2234,7 +3064,12 @@ def get_product_quantity_price(product, qty=Decimal('1'), delta=Decimal("0.00"),
     return adjustments.final_price()+delta
 
 def make_option_unique_id(groupid, value):
-    return '%s-%s' % (str(groupid), str(value),)
+    return u'%s-%s' % (groupid, force_unicode(value),)
+
+def make_option_key(values):
+    """The price lookup key of a variation, from the values of its options
+    in option group order."""
+    return u"::".join([force_unicode(value) for value in values])
 
 def round_cents(work):
     cents = Decimal("0.01")
@@ -2306,4 +3141,95 @@ class PriceAdjustment(object):
 
     def __unicode__(self):
         return u"%s: %s=%s" % (_('Price Adjustment'), self.label, moneyfmt(self.amount))
-        
\ No newline at end of file
+        
+
+def _category_changed(sender, instance=None, **kwargs):
+    CategoryTree.invalidate(instance.site_id)
+
+models.signals.post_save.connect(_category_changed, sender=Category)
+models.signals.post_delete.connect(_category_changed, sender=Category)
+
+def _product_changed(sender, instance=None, **kwargs):
+    CategoryCounts.invalidate(instance.site_id)
+
+models.signals.post_save.connect(_product_changed, sender=Product)
+models.signals.post_delete.connect(_product_changed, sender=Product)
+
+def _discount_changed(sender, instance=None, **kwargs):
+    AutoDiscountIndex.invalidate()
+
+models.signals.post_save.connect(_discount_changed, sender=Discount)
+models.signals.post_delete.connect(_discount_changed, sender=Discount)
+
+def _product_deleted(sender, instance=None, **kwargs):
+    cache_delete('ProductSubtypes', instance.id)
+
+models.signals.post_delete.connect(_product_deleted, sender=Product)
+
+def _subtype_changed(sender, instance=None, **kwargs):
+    """Forget the subtypes of a product when one of its subtypes is saved
+    or deleted."""
+    productid = getattr(instance, 'product_id', None)
+    if productid is None:
+        return
+    cache_delete('ProductSubtypes', productid)
+    product = getattr(instance, '_product_cache', None)
+    if product is not None:
+        product._subtypes_cache = None
+
+def _watch_subtype(sender, **kwargs):
+    """Connect `_subtype_changed` to a product subtype model.  Subtypes are
+    recognized by their `_get_subtype` method, so that subtypes defined by
+    other apps are watched as they are loaded."""
+    if hasattr(sender, '_get_subtype'):
+        models.signals.post_save.connect(_subtype_changed, sender=sender)
+        models.signals.post_delete.connect(_subtype_changed, sender=sender)
+
+_watch_subtype(CustomProduct)
+_watch_subtype(ConfigurableProduct)
+_watch_subtype(DownloadableProduct)
+_watch_subtype(SubscriptionProduct)
+_watch_subtype(ProductVariation)
+models.signals.class_prepared.connect(_watch_subtype)
+
+def _variation_changed(sender, instance=None, **kwargs):
+    CategoryCounts.invalidate(instance.product.site_id)
+
+models.signals.post_save.connect(_variation_changed, sender=ProductVariation)
+models.signals.post_delete.connect(_variation_changed, sender=ProductVariation)
+
+def _product_text_changed(sender, instance=None, **kwargs):
+    from product import search
+    if sender is Product:
+        search.index_product(instance)
+    else:
+        search.reindex_products([instance.product_id])
+
+models.signals.post_save.connect(_product_text_changed, sender=Product)
+models.signals.post_save.connect(_product_text_changed, sender=ProductTranslation)
+models.signals.post_delete.connect(_product_text_changed, sender=ProductTranslation)
+
+def _option_matrix_changed(sender, instance=None, **kwargs):
+    if sender is Product:
+        # the product may be configurable, or a variation
+        OptionMatrix.invalidate(instance.id)
+        for parentid in ProductVariation.objects.filter(product=instance.id).values_list('parent', flat=True):
+            OptionMatrix.invalidate(parentid)
+    elif sender is ProductVariation:
+        OptionMatrix.invalidate(instance.parent_id)
+    elif sender is ConfigurableProduct:
+        OptionMatrix.invalidate(instance.product_id)
+    else:
+        # options are shared by any number of products
+        OptionMatrix.invalidate()
+
+models.signals.post_save.connect(_option_matrix_changed, sender=Product)
+models.signals.post_delete.connect(_option_matrix_changed, sender=Product)
+models.signals.post_save.connect(_option_matrix_changed, sender=ProductVariation)
+models.signals.post_delete.connect(_option_matrix_changed, sender=ProductVariation)
+models.signals.post_save.connect(_option_matrix_changed, sender=ConfigurableProduct)
+models.signals.post_delete.connect(_option_matrix_changed, sender=ConfigurableProduct)
+models.signals.post_save.connect(_option_matrix_changed, sender=Option)
+models.signals.post_delete.connect(_option_matrix_changed, sender=Option)
+models.signals.post_save.connect(_option_matrix_changed, sender=OptionGroup)
+models.signals.post_delete.connect(_option_matrix_changed, sender=OptionGroup)
@@ -0,0 +1,284 @@
+"""Inverted word index for product search.
+
+The names, skus, descriptions and meta of products and their translations
+are split into words, reduced to their stems and stored as
+`ProductSearchTerm` rows, so that a search looks up a few indexed terms
+instead of scanning the text of every product.  The index is updated when
+products and translations are saved, and rebuilt in full by the
+satchmo_rebuild_search_index command.
+
+Categories are few, so the words of the categories of a site are indexed
+in process instead, and reloaded along with the category tree.
+"""
+
+from django.db import connection, transaction
+from django.utils.encoding import force_unicode
+from django.utils.html import strip_tags
+from keyedcache.models import VersionedSnapshot
+from product.models import Category, CategoryTree, Product, ProductSearchTerm, ProductTranslation
+import logging
+import re
+
+log = logging.getLogger('product.search')
+
+# Weight of a word for each field it appears in.
+FIELD_WEIGHTS = (
+    ('name', 10),
+    ('sku', 10),
+    ('short_description', 3),
+    ('meta', 3),
+    ('description', 1),
+)
+
+CATEGORY_WEIGHTS = (
+    ('name', 10),
+    ('meta', 3),
+    ('description', 1),
+)
+
+# Highest weight of one term of a product, so long descriptions repeating a
+# word don't outrank a product named for it.
+MAX_WEIGHT = 100
+
+# Most products returned by a search.
+MAX_RESULTS = 500
+
+INDEX_BATCH_SIZE = 100
+
+STOPWORDS = dict.fromkeys(u"""a an and are as at be but by for from has have in into is it its
+    of on or our that the their this to was were will with you your""".split())
+
+_WORDS = re.compile(r'\w+', re.UNICODE)
+
+# (suffix, replacement, shortest stem), tried in order, the first matching
+# suffix wins
+_SUFFIXES = (
+    (u'sses', u'ss', 2),
+    (u'ies', u'y', 2),
+    (u'xes', u'x', 2),
+    (u'ches', u'ch', 2),
+    (u'shes', u'sh', 2),
+    (u'ss', u'ss', 1),
+    (u'us', u'us', 1),
+    (u'eed', u'eed', 1),
+    (u'ing', u'', 4),
+    (u'ed', u'', 4),
+    (u's', u'', 3),
+)
+
+def stem(word):
+    """Strip the common English plural and verb endings from a lowercase word,
+    so that "shirts" finds "shirt" and "printed" finds "print"."""
+    for suffix, replacement, shortest in _SUFFIXES:
+        if word.endswith(suffix):
+            base = word[:-len(suffix)]
+            if len(base) >= shortest:
+                return base + replacement
+            break
+    return word
+
+def tokenize(text):
+    """Split text, which may contain HTML, into stemmed lowercase words,
+    leaving out stopwords and single letters."""
+    if not text:
+        return []
+    words = []
+    for word in _WORDS.findall(strip_tags(force_unicode(text)).lower()):
+        if len(word) < 2 or word in STOPWORDS:
+            continue
+        words.append(stem(word)[:64])
+    return words
+
+def product_terms(product, translations=()):
+    """Return the weighted terms of a product and its translations, as a
+    dictionary of term to weight."""
+    terms = {}
+    for obj in [product] + list(translations):
+        for field, weight in FIELD_WEIGHTS:
+            for word in tokenize(getattr(obj, field, u'')):
+                terms[word] = min(terms.get(word, 0) + weight, MAX_WEIGHT)
+
+    # the whole sku, so "ABC-123" is found as typed
+    if product.sku:
+        sku = product.sku.lower()[:64]
+        terms[sku] = max(terms.get(sku, 0), dict(FIELD_WEIGHTS)['sku'])
+    return terms
+
+def _chunks(seq, size):
+    for start in range(0, len(seq), size):
+        yield seq[start:start+size]
+
+def _write(productids, products, translations):
+    opts = ProductSearchTerm._meta
+    qn = connection.ops.quote_name
+    table = qn(opts.db_table)
+    productcol = qn(opts.get_field('product').column)
+    cursor = connection.cursor()
+    if productids:
+        cursor.execute("DELETE FROM %s WHERE %s IN (%s)" % (table, productcol,
+            ", ".join(["%s"] * len(productids))), list(productids))
+
+    rows = []
+    for product in products:
+        for term, weight in product_terms(product, translations.get(product.id, [])).items():
+            rows.append([product.id, term, weight])
+    if rows:
+        cursor.executemany("INSERT INTO %s (%s, %s, %s) VALUES (%%s, %%s, %%s)" % (table,
+            productcol, qn(opts.get_field('term').column), qn(opts.get_field('weight').column)),
+            rows)
+    transaction.commit_unless_managed()
+    return len(rows)
+
+def _translations(productids):
+    translations = {}
+    for trans in ProductTranslation.objects.filter(product__in=productids, active=True):
+        translations.setdefault(trans.product_id, []).append(trans)
+    return translations
+
+def index_product(product):
+    """Replace the indexed terms of a product."""
+    return _write([product.id], [product], _translations([product.id]))
+
+def reindex_products(productids, batch_size=INDEX_BATCH_SIZE):
+    """Replace the indexed terms of the products with the given ids, removing
+    those of products which no longer exist.  Returns the number of terms."""
+    productids = list(productids)
+    ct = 0
+    for batch in _chunks(productids, batch_size):
+        products = Product.objects.in_bulk(batch)
+        ct += _write(batch, [products[pid] for pid in batch if pid in products],
+            _translations(products.keys()))
+    return ct
+
+def rebuild_index(batch_size=INDEX_BATCH_SIZE, progress=None):
+    """Index every product from scratch, calling `progress(done, total, terms)`
+    after each batch.  Returns the number of products and of terms."""
+    cursor = connection.cursor()
+    cursor.execute("DELETE FROM %s" % connection.ops.quote_name(ProductSearchTerm._meta.db_table))
+    transaction.commit_unless_managed()
+
+    ids = list(Product.objects.values_list('id', flat=True))
+    total = len(ids)
+    done = 0
+    ct = 0
+    for batch in _chunks(ids, batch_size):
+        products = Product.objects.in_bulk(batch)
+        ct += _write([], [products[pid] for pid in batch if pid in products],
+            _translations(batch))
+        done += len(batch)
+        if progress:
+            progress(done, total, ct)
+    return total, ct
+
+_READY = []
+
+def index_ready():
+    """True once the index has been built, so searches can use it."""
+    if not _READY:
+        if not ProductSearchTerm.objects.all()[:1]:
+            return False
+        _READY.append(True)
+    return True
+
+def keyword_terms(keywords):
+    """For each keyword, return the ways it can match: its whole lowercase
+    form, as for a sku, and the list of its stems, all of which must match.
+    Keywords made only of stopwords are left out."""
+    matches = []
+    for keyword in keywords:
+        stems = tokenize(keyword)
+        if stems:
+            matches.append((force_unicode(keyword).lower()[:64], stems))
+    return matches
+
+def search_terms(keywords):
+    """All the terms a search for `keywords` looks up."""
+    terms = {}
+    for whole, stems in keyword_terms(keywords):
+        terms[whole] = True
+        for word in stems:
+            terms[word] = True
+    return terms.keys()
+
+def _rank(found, matches, limit):
+    """Rank the objects of `found`, a dictionary of id to the dictionary of
+    its matching terms and their weights, leaving out those which don't
+    match every keyword."""
+    ranked = []
+    for objid, terms in found.items():
+        for whole, stems in matches:
+            if whole in terms:
+                continue
+            for word in stems:
+                if word not in terms:
+                    break
+            else:
+                continue
+            break
+        else:
+            ranked.append((-sum(terms.values()), objid))
+
+    ranked.sort()
+    return [(objid, -rank) for rank, objid in ranked[:limit]]
+
+def search_products(keywords, limit=MAX_RESULTS, **filters):
+    """Return the ids of the products matching all of the `keywords`, best
+    matches first, as a list of (product id, rank) pairs.
+
+    Only the products matching the Product lookups in `filters`, such as
+    active=True, are ranked, so that products which are never shown don't
+    take the place of those which are.
+    """
+    matches = keyword_terms(keywords)
+    if not matches:
+        return []
+
+    lookups = {}
+    for lookup, value in filters.items():
+        lookups['product__' + lookup] = value
+
+    found = {}
+    for batch in _chunks(search_terms(keywords), INDEX_BATCH_SIZE):
+        for productid, term, weight in ProductSearchTerm.objects.filter(term__in=batch,
+            **lookups).values_list('product', 'term', 'weight'):
+            found.setdefault(productid, {})[term] = weight
+
+    return _rank(found, matches, limit)
+
+class CategoryIndex(VersionedSnapshot):
+    """The weighted terms of every category of one site, loaded with one
+    query, and reloaded whenever the category tree is."""
+
+    cache_name = 'CategorySearchIndex'
+
+    def __init__(self, siteid):
+        self.siteid = siteid
+        self.tree_version = CategoryTree.get(siteid).version
+        self.terms = {}
+        for cat in Category.objects.filter(site__id__exact=siteid).values('id', 'name', 'meta', 'description'):
+            for field, weight in CATEGORY_WEIGHTS:
+                for word in tokenize(cat[field]):
+                    weights = self.terms.setdefault(word, {})
+                    weights[cat['id']] = min(weights.get(cat['id'], 0) + weight, MAX_WEIGHT)
+
+    def is_current(self):
+        return self.tree_version == CategoryTree.get(self.siteid).version
+
+    def search(self, keywords, limit=MAX_RESULTS):
+        """Like `search_products`, for the categories of the site."""
+        matches = keyword_terms(keywords)
+        if not matches:
+            return []
+
+        found = {}
+        for term in search_terms(keywords):
+            for catid, weight in self.terms.get(term, {}).items():
+                found.setdefault(catid, {})[term] = weight
+        return _rank(found, matches, limit)
+
+def search_categories(keywords, siteid):
+    """Return the categories of a site matching all of the `keywords`, best
+    matches first."""
+    ids = [catid for catid, rank in CategoryIndex.get(siteid).search(keywords)]
+    cats = Category.objects.in_bulk(ids)
+    return [cats[catid] for catid in ids if catid in cats]
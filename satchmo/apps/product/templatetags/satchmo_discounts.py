@@ -14,31 +14,45 @@ from tax.templatetags import satchmo_tax
 
 register = template.Library()
 
-def sale_price(product):
-    """Returns the sale price, including tax if that is the default."""
+def _product_discount(product, discount):
+    """`discount` is either one discount, or the best discounts of a listing
+    by product id, as found by `find_best_auto_discounts`."""
+    if isinstance(discount, dict):
+        return discount.get(product.id, None)
+    return discount
+
+def sale_price(product, sales=None):
+    """Returns the sale price, including tax if that is the default.
+
+    Ex: product|sale_price:sales
+    """
     if config_value('TAX', 'DEFAULT_VIEW_TAX'):
-        return taxed_sale_price(product)
+        return taxed_sale_price(product, sales)
     else:
-        return untaxed_sale_price(product)
+        return untaxed_sale_price(product, sales)
 
 register.filter('sale_price', sale_price)
 
-def untaxed_sale_price(product):
-    """Returns the product unit price with the best auto discount applied."""
-    discount = find_best_auto_discount(product)
+def untaxed_sale_price(product, sales=None):
+    """Returns the product unit price with the best auto discount applied.
+    `sales` may be the best discounts of the listing, found together."""
+    if sales is None:
+        discount = find_best_auto_discount(product)
+    else:
+        discount = _product_discount(product, sales)
     price = product.unit_price
         
-    if discount and discount.valid_for_product(cartitem.product):
-        price = calc_discounted_by_percentage(price, disc.percentage)
+    if discount and discount.valid_for_product(product):
+        price = calc_discounted_by_percentage(price, discount.percentage)
     
     return price
 
 register.filter('untaxed_sale_price', sale_price)
 
-def taxed_sale_price(product):
+def taxed_sale_price(product, sales=None):
     """Returns the product unit price with the best auto discount applied and taxes included."""
     taxer = satchmo_tax._get_taxprocessor()
-    price = sale_price(product)
+    price = untaxed_sale_price(product, sales)
     price = price + taxer.by_price(product.taxClass, price)
     return price
 
@@ -129,6 +143,7 @@ def untaxed_discount_price(product, discount):
     
     Ex: product|discount_price:sale
     """
+    discount = _product_discount(product, discount)
     up = product.unit_price
     if discount and discount.valid_for_product(product):
         pcnt = calc_discounted_by_percentage(up, discount.percentage)
@@ -171,7 +186,7 @@ register.filter('discount_saved', discount_saved)
 
 def untaxed_discount_saved(product, discount):
     """Returns the amount saved by the discount"""
-    
+    discount = _product_discount(product, discount)
     if discount and discount.valid_for_product(product):
         price = product.unit_price
         discounted = calc_discounted_by_percentage(price, discount.percentage)
@@ -185,7 +200,7 @@ register.filter('untaxed_discount_saved', discount_saved)
 
 def taxed_discount_saved(product, discount):
     """Returns the amount saved by the discount, after applying taxes."""
-    
+    discount = _product_discount(product, discount)
     if discount and discount.valid_for_product(product):
         price = product.unit_price
         discounted = taxed_discount_price(product, discount)
@@ -5,7 +5,7 @@ from django.template import Context, Template
 from django.utils.translation import get_language, ugettext_lazy as _
 import keyedcache
 from livesettings import config_value
-from product.models import Category, Product
+from product.models import Category, CategoryCounts, Product
 from satchmo_utils.templatetags import get_filter_args
 
 register = template.Library()
@@ -27,15 +27,15 @@ def product_count(category, args=''):
     """
     args, kwargs = get_filter_args(args, boolargs=('variations'))
     variations = kwargs.get('variations', False)
+    if category:
+        counts = CategoryCounts.get(category.site_id)
+        return counts.count(category.id, include_children=True, variations=variations)
+
     try:
         ct = keyedcache.cache_get('product_count', category, variations)
     except keyedcache.NotCachedError:
-        if not category:
-            ct = Product.objects.active_by_site(variations=variations).count()
-        else:
-            ct = category.active_products(include_children=True, variations=variations).count()
-            
-        keyedcache.cache_set('product_count', category, args, value=ct)
+        ct = Product.objects.active_by_site(variations=variations).count()
+        keyedcache.cache_set('product_count', category, variations, value=ct)
     return ct
     
 register.filter('product_count', product_count)
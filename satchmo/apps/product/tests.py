@@ -99,6 +99,36 @@ class OptionGroupTest(TestCase):
         django_config.save()
         self.assertEqual(ProductVariation.objects.filter(parent=django_config).count(), 4)
 
+    def testCreateAllVariations(self):
+        """Variations created in bulk match those created one at a time"""
+        django_shirt = Product.objects.create(slug="django-shirt", name="Django shirt", site=self.site)
+        Price.objects.create(product=django_shirt, price="10.5")
+        django_config = ConfigurableProduct.objects.create(product=django_shirt)
+        django_config.option_group.add(self.sizes, self.colors)
+        django_config.create_variation([self.option_small, self.option_black])
+        Product.objects.create(slug="django-shirt-large-white", name="Clash", site=self.site)
+
+        created = django_config.create_all_variations(batch_size=2)
+        self.assertEqual(len(created), 3)
+        self.assertEqual(ProductVariation.objects.filter(parent=django_config).count(), 4)
+
+        pv = django_config.get_variations_for_options([self.option_large, self.option_white])[0]
+        self.assertEqual(pv.product.slug, "django-shirt-large-white_%i" % django_shirt.id)
+        self.assertEqual(pv.product.sku, pv.product.slug)
+        self.assertEqual(pv.product.name, "Django shirt (Large/White)")
+        self.assertEqual(pv.product.date_added, datetime.date.today())
+        self.assertEqual(pv.unit_price, Decimal("16.50"))
+        self.assertEqual(pv.unique_option_ids,
+            django_config._unique_ids_from_options([self.option_large, self.option_white]))
+        self.assertEqual(pv.product.get_subtypes(), ('ProductVariation',))
+
+        # priced once at the end
+        lookup = ProductPriceLookup.objects.get(productslug=pv.product.slug, quantity=Decimal('1'))
+        self.assertEqual(lookup.price, Decimal("16.50"))
+        self.assertEqual(lookup.parentid, django_shirt.id)
+
+        self.assertEqual(django_config.create_all_variations(), [])
+
 class CategoryTest(TestCase):
     """
     Run some category tests on urls
@@ -110,6 +140,96 @@ class CategoryTest(TestCase):
     def tearDown(self):
         keyedcache.cache_delete()
 
+    def _make_tree(self):
+        root = Category.objects.create(slug="tree-root", name="Root", site=self.site)
+        b = Category.objects.create(slug="tree-b", name="B", parent=root, site=self.site)
+        a = Category.objects.create(slug="tree-a", name="A", parent=root, site=self.site)
+        leaf = Category.objects.create(slug="tree-leaf", name="Leaf", parent=a, site=self.site)
+        return root, a, b, leaf
+
+    def test_tree_parents(self):
+        root, a, b, leaf = self._make_tree()
+        self.assertEqual(leaf.parents(), [root, a])
+        self.assertEqual(unicode(leaf), u"Root :: A :: Leaf")
+        url = urlresolvers.reverse('satchmo_category',
+            kwargs={'parent_slugs' : 'tree-root/tree-a/', 'slug' : 'tree-leaf'})
+        self.assertEqual(leaf.get_absolute_url(), url)
+
+    def test_tree_children(self):
+        root, a, b, leaf = self._make_tree()
+        self.assertEqual(root.get_all_children(), [a, leaf, b])
+        self.assertEqual(root.get_all_children(include_self=True), [root, a, leaf, b])
+        self.assertEqual(a.get_all_children(), [leaf])
+
+    def test_tree_moves(self):
+        root, a, b, leaf = self._make_tree()
+        self.assertEqual(unicode(leaf), u"Root :: A :: Leaf")
+        leaf.parent = b
+        leaf.save()
+        leaf = Category.objects.get(slug="tree-leaf")
+        self.assertEqual(unicode(leaf), u"Root :: B :: Leaf")
+        self.assertEqual(b.get_all_children(), [leaf])
+
+        b.delete()
+        self.assertEqual(root.get_all_children(), [a])
+
+    def test_tree_active_children(self):
+        root, a, b, leaf = self._make_tree()
+        product = Product.objects.create(slug="tree-product", name="Tree", site=self.site, active=True)
+        product.category.add(leaf)
+        # changing categories sends no signal, saving the product does
+        product.save()
+        # b has no products, a only has them below it
+        self.assertEqual(root.get_active_children(), [])
+        product.category.add(a)
+        product.save()
+        self.assertEqual(root.get_active_children(), [a, leaf])
+
+    def test_tree_counts(self):
+        root, a, b, leaf = self._make_tree()
+        counts = CategoryCounts.get(self.site.id)
+        self.assertEqual(counts.count(root.id, include_children=True), 0)
+
+        product = Product.objects.create(slug="count-product", name="Count", site=self.site, active=True)
+        product.category.add(leaf)
+        product.category.add(a)
+        product.save()
+        other = Product.objects.create(slug="count-other", name="Other", site=self.site, active=True)
+        other.category.add(b)
+        other.save()
+
+        counts = CategoryCounts.get(self.site.id)
+        self.assertEqual(counts.count(leaf.id), 1)
+        self.assertEqual(counts.count(a.id), 1)
+        # the product in both a and leaf is only counted once
+        self.assertEqual(counts.count(a.id, include_children=True), 1)
+        self.assertEqual(counts.count(root.id), 0)
+        self.assertEqual(counts.count(root.id, include_children=True), 2)
+
+        other.active = False
+        other.save()
+        counts = CategoryCounts.get(self.site.id)
+        self.assertEqual(counts.count(b.id), 0)
+        self.assertEqual(counts.count(root.id, include_children=True), 1)
+        # inactive products still fill their category
+        self.assert_(counts.has_products(b.id))
+        self.assertFalse(counts.has_products(root.id))
+
+        # changing categories alone needs an explicit recount
+        other.category.remove(b)
+        CategoryCounts.invalidate(self.site.id)
+        self.assertFalse(CategoryCounts.get(self.site.id).has_products(b.id))
+
+        # moving a category changes the rollups without touching products
+        leaf.parent = b
+        leaf.save()
+        counts = CategoryCounts.get(self.site.id)
+        self.assertEqual(counts.count(b.id, include_children=True), 1)
+
+        product.delete()
+        counts = CategoryCounts.get(self.site.id)
+        self.assertEqual(counts.count(root.id, include_children=True), 0)
+
 #    def test_absolute_url(self):
 #        pet_jewelry = Category.objects.create(slug="pet-jewelry", name="Pet Jewelry", site=self.site)
 #        womens_jewelry = Category.objects.create(slug="womens-jewelry", name="Women's Jewelry", site=self.site)
@@ -195,6 +315,46 @@ class DiscountTest(TestCase):
         v = self.discount.isValid()
         self.assertFalse(v[0], False)
         self.assertEqual(v[1], u'This coupon is disabled.')
+
+    def testAutoDiscounts(self):
+        """Automatic discounts are found from the index"""
+        from product.utils import find_best_auto_discount, find_best_auto_discounts
+        on_sale = Product.objects.create(slug="sale-product", name="Sale", site=self.site)
+        other = Product.objects.create(slug="full-price", name="Full", site=self.site)
+
+        sale = Discount.objects.create(description="Sale", code="SALE", percentage="0.10",
+            automatic=True, active=True, startDate=self.discount.startDate,
+            endDate=self.discount.endDate, site=self.site)
+        better = Discount.objects.create(description="Better", code="BETTER", percentage="0.20",
+            automatic=True, active=True, startDate=self.discount.startDate,
+            endDate=self.discount.endDate, site=self.site)
+        sale.validProducts.add(on_sale)
+        better.validProducts.add(on_sale)
+        # changing valid products sends no signal, saving the discount does
+        better.save()
+
+        self.assertEqual(find_best_auto_discount(on_sale), better)
+        self.assertEqual(find_best_auto_discount(other), None)
+        self.assertEqual(find_best_auto_discounts([on_sale, other]), {on_sale.id : better})
+
+        # the filters take the sales of a listing, found together
+        from product.templatetags.satchmo_discounts import untaxed_discount_price, untaxed_sale_price
+        Price.objects.create(product=on_sale, price=Decimal('10.00'), quantity=1)
+        Price.objects.create(product=other, price=Decimal('10.00'), quantity=1)
+        sales = find_best_auto_discounts([on_sale, other])
+        self.assertEqual(untaxed_discount_price(on_sale, sales), Decimal('8.00'))
+        self.assertEqual(untaxed_discount_price(other, sales), Decimal('10.00'))
+        self.assertEqual(untaxed_sale_price(on_sale, sales), Decimal('8.00'))
+        self.assertEqual(untaxed_sale_price(other, sales), Decimal('10.00'))
+        self.assert_(find_best_auto_discount(on_sale).valid_for_product(on_sale))
+        self.assertFalse(find_best_auto_discount(on_sale).valid_for_product(other))
+
+        # not automatic, so looked up directly
+        self.assertFalse(self.discount.valid_for_product(on_sale))
+
+        better.active = False
+        better.save()
+        self.assertEqual(find_best_auto_discount(on_sale), sale)
                 
 
 class CalcFunctionTest(TestCase):
@@ -458,6 +618,75 @@ class ProductTest(TestCase):
         pvprice = Price.objects.create(product=product, quantity=Decimal('1'), price=Decimal("5.00"), expires=nextwk)
         self.assertEqual(product.unit_price, Decimal("5.00"))
 
+    def _lookup_rows(self):
+        rows = [(l.productslug, l.parentid, l.key, l.quantity, l.price, l.discountable)
+            for l in ProductPriceLookup.objects.filter(siteid=self.site.id)]
+        rows.sort()
+        return rows
+
+    def test_rebuild_pricing(self):
+        """Check the batched rebuild matches building lookups product by product"""
+        self.site = Site.objects.get_current()
+        done = []
+        def progress(products, total, prices):
+            done.append((products, total))
+
+        productct, pricect = ProductPriceLookup.objects.rebuild_all(site=self.site,
+            batch_size=2, progress=progress)
+        self.assertEqual(productct, Product.objects.active_by_site(site=self.site, variations=False).count())
+        self.assert_(len(done) > 1)
+        self.assertEqual(done[-1], (productct, productct))
+
+        rows = self._lookup_rows()
+        self.assertEqual(len(rows), pricect)
+
+        lookup = ProductPriceLookup.objects.get(productslug='dj-rocks-l-bl', quantity=Decimal('1'))
+        self.assertEqual(lookup.price, Decimal("23.00"))
+        self.assertEqual(lookup.parentid, Product.objects.get(slug='dj-rocks').id)
+
+        ProductPriceLookup.objects.all().delete()
+        for product in Product.objects.active_by_site(site=self.site, variations=False):
+            ProductPriceLookup.objects.smart_create_for_product(product)
+        self.assertEqual(self._lookup_rows(), rows)
+
+    def test_load_subtypes(self):
+        slugs = ['dj-rocks', 'dj-rocks-s-b', 'PY-Rocks']
+        products = [Product.objects.get(slug=slug) for slug in slugs]
+        Product.objects.load_subtypes(products)
+        for product in products:
+            fresh = Product.objects.get(slug=product.slug)
+            self.assertEqual(product.get_subtypes(), fresh._find_subtypes())
+        self.assertEqual(products[0].get_subtypes(), ('ConfigurableProduct',))
+        self.assertEqual(products[1].get_subtypes(), ('ProductVariation',))
+        self.assertEqual(products[2].get_subtypes(), ())
+
+        # cached for other instances too
+        products = [Product.objects.get(slug=slug) for slug in slugs]
+        Product.objects.load_subtypes(products)
+        self.assertEqual(products[0].get_subtypes(), ('ConfigurableProduct',))
+
+    def test_subtypes_change(self):
+        product = Product.objects.create(slug="subtype-test", name="Subtype", site=Site.objects.get_current())
+        self.assertEqual(product.get_subtypes(), ())
+        ConfigurableProduct.objects.create(product=product)
+        self.assertEqual(product.get_subtypes(), ('ConfigurableProduct',))
+        product = Product.objects.get(slug="subtype-test")
+        self.assertEqual(product.get_subtypes(), ('ConfigurableProduct',))
+        product.configurableproduct.delete()
+        product = Product.objects.get(slug="subtype-test")
+        self.assertEqual(product.get_subtypes(), ())
+
+    def test_subtype_signals(self):
+        """Only product subtypes are watched for subtype changes"""
+        from django.db.models import signals
+        from product.models import _subtype_changed
+        watched = [key[1] for key, receiver in signals.post_save.receivers
+            if key[0] == id(_subtype_changed)]
+        self.assert_(id(ConfigurableProduct) in watched)
+        self.assert_(id(ProductVariation) in watched)
+        self.assertFalse(id(Product) in watched)
+        self.assertFalse(id(None) in watched)
+
     def test_smart_attr(self):
         p = Product.objects.get(slug__iexact='dj-rocks')
         mb = Product.objects.get(slug__iexact='dj-rocks-m-b')
@@ -479,6 +708,89 @@ class ProductTest(TestCase):
         self.assertEqual(p.smart_attr('height'), None)
         self.assertEqual(sb.smart_attr('height'), None)
 
+    def test_search_index(self):
+        from product import search
+        self.assertEqual(search.stem('shirts'), 'shirt')
+        self.assertEqual(search.stem('glasses'), 'glass')
+        self.assertEqual(search.stem('boxes'), 'box')
+        self.assertEqual(search.stem('printed'), 'print')
+        self.assertEqual(search.tokenize('<p>The Python shirts</p>'), ['python', 'shirt'])
+
+        productct, termct = search.rebuild_index(batch_size=3)
+        self.assertEqual(productct, Product.objects.count())
+        self.assert_(search.index_ready())
+
+        djrocks = Product.objects.get(slug='dj-rocks')
+        pyrocks = Product.objects.get(slug='PY-Rocks')
+        ids = [pid for pid, rank in search.search_products(['Shirts'])]
+        self.assert_(djrocks.id in ids)
+        self.assert_(pyrocks.id in ids)
+        ids = [pid for pid, rank in search.search_products(['python', 'rocks'])]
+        self.assertEqual(ids, [pyrocks.id])
+        self.assertEqual(search.search_products(['the']), [])
+
+        # a match in the name outranks one in the description
+        site = Site.objects.get_current()
+        described = Product.objects.create(slug='search-described', name='Poster',
+            description='Goes well with a python shirt', site=site)
+        ids = [pid for pid, rank in search.search_products(['python'])]
+        self.assert_(ids.index(pyrocks.id) < ids.index(described.id))
+
+        # saving updates the index
+        described.name = 'Gadget'
+        described.save()
+        ids = [pid for pid, rank in search.search_products(['gadgets'])]
+        self.assertEqual(ids, [described.id])
+        ProductTranslation.objects.create(product=described, languagecode='de', name='Apparat')
+        ids = [pid for pid, rank in search.search_products(['apparat'])]
+        self.assertEqual(ids, [described.id])
+
+        # variations and inactive products are left out before the limit
+        shown = {'active' : True, 'productvariation__parent__isnull' : True, 'site' : site}
+        self.assertEqual(search.search_products(['django'], limit=1, **shown)[0][0], djrocks.id)
+        hidden = Product.objects.create(slug='search-hidden', name='Python', active=False, site=site)
+        self.assert_(hidden.id in [pid for pid, rank in search.search_products(['python'])])
+        self.failIf(hidden.id in [pid for pid, rank in search.search_products(['python'], **shown)])
+
+        from product.listeners import indexed_product_search_listener
+        results = {}
+        indexed_product_search_listener(Product, keywords=['python'], results=results)
+        self.assertEqual(list(results['products'])[0], pyrocks)
+
+        # categories are found in their own index
+        fiction = Category.objects.get(slug='fiction')
+        scifi = Category.objects.get(slug='scifi')
+        nonfiction = Category.objects.get(slug='nonfiction')
+        self.assertEqual(search.search_categories(['science', 'fiction'], site.id), [scifi])
+        self.assertEqual(search.search_categories(['fictions'], site.id), [fiction, scifi, nonfiction])
+        self.assertEqual(list(Category.objects.search_by_site('fiction')), [fiction, nonfiction, scifi])
+        results = {}
+        indexed_product_search_listener(Product, keywords=['science'], results=results)
+        self.assertEqual(results['categories'], [scifi])
+
+        # and the index follows the category tree
+        poetry = Category.objects.create(slug='poetry', name='Poetry', site=site, parent=fiction)
+        self.assertEqual(search.search_categories(['poetry'], site.id), [poetry])
+
+    def test_prefetch_translations(self):
+        djrocks = Product.objects.get(slug='dj-rocks')
+        pyrocks = Product.objects.get(slug='PY-Rocks')
+        category = Category.objects.all()[0]
+        ProductTranslation.objects.create(product=djrocks, languagecode='de', name='Django rockt')
+        ProductTranslation.objects.create(product=djrocks, languagecode='de', name='Django rockt!', version=2)
+        CategoryTranslation.objects.create(category=category, languagecode='de', name='Kategorie')
+
+        objs = prefetch_translations([djrocks, pyrocks, category], 'de-at')
+        self.assertEqual(objs, [djrocks, pyrocks, category])
+
+        self.assertEqual(djrocks._translationcache['de-at'], None)
+        self.assertEqual(pyrocks._translationcache['de'], None)
+
+        self.assertEqual(djrocks.translated_name('de-at'), 'Django rockt!')
+        self.assertEqual(pyrocks.translated_name('de-at'), pyrocks.name)
+        self.assertEqual(category.translated_name('de-at'), 'Kategorie')
+        self.assertEqual(category.translated_name('de'), 'Kategorie')
+
 class ConfigurableProductTest(TestCase):
     """Test ConfigurableProduct."""
     fixtures = ['products.yaml']
@@ -508,6 +820,54 @@ class ConfigurableProductTest(TestCase):
             dj_rocks.get_variations_for_options([])],
             [6, 7, 8, 9, 10, 11, 12, 13, 14])
 
+    def test_option_matrix(self):
+        dj_rocks = ConfigurableProduct.objects.get(product__slug="dj-rocks")
+        option_small = Option.objects.get(pk=1)
+        option_black = Option.objects.get(pk=4)
+        options = dj_rocks._unique_ids_from_options([option_small, option_black])
+
+        matrix = OptionMatrix.get(dj_rocks.product_id)
+        variation = matrix.find(options)
+        pv = ProductVariation.objects.get(pk=6)
+        self.assertEqual(variation['id'], 6)
+        self.assertEqual(variation['slug'], pv.product.slug)
+        self.assertEqual(variation['key'], pv.optionkey)
+        self.assertEqual(variation['stock'], pv.product.items_in_stock)
+        self.assertEqual(dj_rocks.get_product_from_options(options), pv.product)
+        self.assertEqual(len(dj_rocks.get_valid_options()), 9)
+        self.assert_(list(options) in dj_rocks.get_valid_options())
+
+        # prices are read from the lookups of the variation's key
+        self.assertEqual(dj_rocks.get_variation_price(options), (pv.product.slug, pv.get_qty_price(Decimal('1'))))
+        ProductPriceLookup.objects.create_for_configurableproduct(dj_rocks)
+        ProductPriceLookup.objects.filter(parentid=dj_rocks.product_id,
+            key=variation['key']).update(price=Decimal('99.00'))
+        self.assertEqual(dj_rocks.get_variation_price(options), (pv.product.slug, Decimal('99.00')))
+
+        # deactivating the variation updates the matrix
+        pv.product.active = False
+        pv.product.save()
+        self.failIf(list(options) in dj_rocks.get_valid_options())
+        self.assertEqual(len(dj_rocks.get_valid_options()), 8)
+        self.assertEqual(dj_rocks.get_product_from_options(options), pv.product)
+
+    def test_option_matrix_unicode(self):
+        dj_rocks = ConfigurableProduct.objects.get(product__slug="dj-rocks")
+        option_small = Option.objects.get(pk=1)
+        colors = Option.objects.get(pk=4).option_group
+        green = Option.objects.create(option_group=colors, name=u'Gr\xfcn',
+            value=u'gr\xfcn', sort_order=4)
+        variant = dj_rocks.create_variation([option_small, green], name=u'Django Rocks shirt (Gr\xfcn)',
+            slug='dj-rocks-s-gruen')
+        pv = ProductVariation.objects.get(product=variant)
+
+        options = dj_rocks._unique_ids_from_options([option_small, green])
+        variation = dj_rocks.get_option_matrix().find(options)
+        self.assertEqual(variation['id'], variant.id)
+        self.assertEqual(variation['key'], pv.optionkey)
+        self.assert_(variation['key'].endswith(u'::gr\xfcn'))
+        self.assertEqual(dj_rocks.get_variation_price(options)[0], 'dj-rocks-s-gruen')
+
 class OptionUtilsTest(TestCase):
     """Test the utilities used for serialization of options and selected option details."""
     fixtures = ['products.yaml']
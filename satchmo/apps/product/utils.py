@@ -3,8 +3,10 @@ from livesettings import config_value
 from l10n.utils import moneyfmt
 from product.models import ProductVariation, Option, split_option_unique_id, \
                                    ProductPriceLookup, OptionGroup, Discount, \
-                                   NullDiscount, Product
+                                   NullDiscount, Product, AutoDiscountIndex, \
+                                   prefetch_translations
 from satchmo_utils.numbers import RoundedDecimalError, round_decimal
+import copy
 import datetime
 import logging
 import types
@@ -29,11 +31,11 @@ def calc_discounted_by_percentage(price, percentage):
     return work.quantize(cents)
 
 def find_auto_discounts(product):
+    """The automatic discounts valid today for a product or list of
+    products, best first."""
     if not type(product) in (types.ListType, types.TupleType):
         product = (product,)
-    today = datetime.date.today()
-    discs = Discount.objects.filter(automatic=True, active=True, startDate__lte=today, endDate__gt=today)
-    return discs.filter(validProducts__in=product).order_by('-percentage')
+    return AutoDiscountIndex.get().for_products(product)
 
 def find_best_auto_discount(product):
     discs = find_auto_discounts(product)
@@ -42,6 +44,11 @@ def find_best_auto_discount(product):
     else:
         return None
 
+def find_best_auto_discounts(products):
+    """The best automatic discount for each of a list of products, as a
+    dictionary by product id."""
+    return AutoDiscountIndex.get().best_for_products(products)
+
 def productvariation_details(product, include_tax, user, create=False):
     """Build the product variation details, for conversion to javascript.
 
@@ -127,19 +134,7 @@ def productvariation_details(product, include_tax, user, create=False):
     
 def rebuild_pricing():
     site = Site.objects.get_current()
-    for lookup in ProductPriceLookup.objects.filter(siteid=site.id):
-        lookup.delete()
-    
-    products = Product.objects.active_by_site(site=site, variations=False)
-    
-    productct = products.count()
-    pricect = 0
-    
-    for product in products:        
-        prices = ProductPriceLookup.objects.smart_create_for_product(product)
-        pricect += len(prices)
-    
-    return productct, pricect
+    return ProductPriceLookup.objects.rebuild_all(site=site)
 
 def serialize_options(product, selected_options=()):
     """
@@ -167,7 +162,14 @@ def serialize_options(product, selected_options=()):
     white/small, but you have no white/large - the customer will still see
     the options white and large.
     """    
-    all_options = product.get_valid_options()
+    if hasattr(product, 'get_option_matrix'):
+        # the matrix has the options too
+        matrix = product.get_option_matrix()
+        all_options = matrix.valid_options()
+        known = matrix.options
+    else:
+        all_options = product.get_valid_options()
+        known = None
     group_sortmap = OptionGroup.objects.get_sortmap()
 
     # first get all objects
@@ -189,10 +191,27 @@ def serialize_options(product, selected_options=()):
                     groups[k] = False
                     opts[option] = None
         
-        for option in Option.objects.filter(option_group__id__in = groups.keys(), value__in = vals.keys()):
-            uid = option.unique_id
-            if opts.has_key(uid):
+        if known is not None:
+            # copied, as the matrix is shared and the options get marked
+            # selected and translated
+            groupcopies = {}
+            for uid in opts.keys():
+                option = copy.copy(known[uid])
+                option._translationcache = {}
+                group = groupcopies.get(option.option_group_id, None)
+                if group is None:
+                    group = copy.copy(option.option_group)
+                    group._translationcache = {}
+                    groupcopies[option.option_group_id] = group
+                option._option_group_cache = group
                 opts[uid] = option
+            prefetch_translations(groupcopies.values())
+        else:
+            for option in Option.objects.filter(option_group__id__in = groups.keys(), value__in = vals.keys()):
+                uid = option.unique_id
+                if opts.has_key(uid):
+                    opts[uid] = option
+        prefetch_translations(opts.values())
 
         # now we have all the objects in our "opts" dictionary, so build the serialization dict
 
@@ -6,9 +6,9 @@ from django.utils.translation import ugettext as _
 from l10n.utils import moneyfmt
 from livesettings import config_value
 from product import signals
-from product.models import Category, Product, ConfigurableProduct, sorted_tuple
+from product.models import Category, Product, ConfigurableProduct, prefetch_translations, sorted_tuple
 from product.signals import index_prerender
-from product.utils import find_best_auto_discount
+from product.utils import find_best_auto_discount, find_best_auto_discounts
 from satchmo_utils.numbers import  RoundedDecimalError, round_decimal
 from satchmo_utils.json import json_encode
 from satchmo_utils.views import bad_or_missing
@@ -67,18 +67,21 @@ def category_view(request, slug, parent_slugs='', template='product/category.htm
     """
     try:
         category = Category.objects.get(slug=slug)
-        products = list(category.active_products())
+        products = Product.objects.load_subtypes(list(category.active_products()))
         sale = find_best_auto_discount(products)
+        sales = find_best_auto_discounts(products)
 
     except Category.DoesNotExist:
         return bad_or_missing(request, _('The category you have requested does not exist.'))
 
     child_categories = category.get_all_children()
+    prefetch_translations([category] + list(child_categories) + products)
 
     ctx = {
         'category': category, 
         'child_categories': child_categories,
         'sale' : sale,
+        'sales' : sales,
         'products' : products,
     }
     index_prerender.send(Product, request=request, context=ctx, category=category, object_list=products)
@@ -171,12 +174,12 @@ def get_price(request, product_slug):
     if 'ConfigurableProduct' in product.get_subtypes():
         cp = product.configurableproduct
         chosen_options = optionids_from_post(cp, request.POST)
-        pvp = cp.get_product_from_options(chosen_options)
+        priced = cp.get_variation_price(chosen_options, quantity)
 
-        if not pvp:
+        if not priced:
             return http.HttpResponse(json_encode(('', _("not available"))), mimetype="text/javascript")
-        prod_slug = pvp.slug
-        price = moneyfmt(pvp.get_qty_price(quantity))
+        prod_slug, price = priced
+        price = moneyfmt(price)
     else:
         price = moneyfmt(product.get_qty_price(quantity))
 
@@ -217,12 +220,14 @@ def get_price_detail(request, product_slug):
         if 'ConfigurableProduct' in product.get_subtypes():
             cp = product.configurableproduct
             chosen_options = optionids_from_post(cp, reqdata)
-            product = cp.get_product_from_options(chosen_options)
+            priced = cp.get_variation_price(chosen_options, quantity)
+        else:
+            priced = (product.slug, product.get_qty_price(quantity))
 
-        if product:
-            price = product.get_qty_price(quantity)
+        if priced:
+            prod_slug, price = priced
 
-            results['slug'] = product.slug
+            results['slug'] = prod_slug
             results['price'] = float(price)
             results['success'] = True
             results['message'] = ""
@@ -3,7 +3,7 @@ from django.core.paginator import Paginator, InvalidPage
 from django.shortcuts import get_object_or_404, render_to_response
 from django.template import RequestContext
 from livesettings import config_value
-from product.models import Product
+from product.models import Product, prefetch_translations
 from product.queries import bestsellers
 import logging
         
@@ -15,7 +15,7 @@ def display_bestsellers(request, count=0, template='product/best_sellers.html'):
         count = config_value('PRODUCT','NUM_PAGINATED')
     
     ctx = RequestContext(request, {
-        'products' : bestsellers(count),
+        'products' : prefetch_translations(bestsellers(count)),
     })
     return render_to_response(template, ctx)
         
@@ -34,6 +34,7 @@ def display_recent(request, page=0, count=0, template='product/recently_added.ht
     paginator = Paginator(query, count)
     try:
         currentpage = paginator.page(page)
+        currentpage.object_list = prefetch_translations(currentpage.object_list)
     except InvalidPage:
         currentpage = None
     
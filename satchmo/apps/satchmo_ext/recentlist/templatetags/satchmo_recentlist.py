@@ -1,7 +1,7 @@
 from django.template import Node, NodeList
 from django.template import TemplateSyntaxError
 from django.template import Library
-from product.models import Product
+from product.models import Product, prefetch_translations
 from livesettings import config_value
 
 register = Library()
@@ -15,6 +15,6 @@ def recentlyviewed(recent, slug=""):
     if len(recent) > rmax:
         recent = recent[:rmax]
     return {
-        'recent_products' : recent,
+        'recent_products' : prefetch_translations(recent),
     }
 register.inclusion_tag('recentlist/_recently_viewed.html', takes_context=False)(recentlyviewed)
\ No newline at end of file
@@ -4,7 +4,7 @@ from livesettings import config_value
 from payment.listeners import capture_on_ship_listener
 from product import signals as product_signals
 from product.models import Product
-from product.listeners import default_product_search_listener
+from product.listeners import indexed_product_search_listener
 from satchmo_store.contact import signals as contact_signals
 from satchmo_store.shop import signals
 from satchmo_store.shop.exceptions import OutOfStockError
@@ -47,6 +47,12 @@ def recalc_total_on_contact_change(contact=None, **kwargs):
         order.copy_addresses()
         order.recalculate_total()
 
+def clear_cart_on_cart_update(cart=None, **kwargs):
+    """Make the cart reload its items and prices after it has changed"""
+    clear = getattr(cart, '_clear_items_cache', None)
+    if clear is not None:
+        clear()
+
 def remove_order_on_cart_update(request=None, cart=None, **kwargs):
     """Remove partially completed order when the cart is updated"""
     if request:
@@ -70,8 +76,9 @@ def start_default_listening():
     contact_signals.satchmo_contact_location_changed.connect(recalc_total_on_contact_change, sender=None)
     signals.order_success.connect(notification.order_success_listener, sender=None)
     signals.order_success.connect(ship_downloadable_order, sender=None)
+    signals.satchmo_cart_changed.connect(clear_cart_on_cart_update, sender=None)
     signals.satchmo_cart_changed.connect(remove_order_on_cart_update, sender=None)
-    signals.satchmo_search.connect(default_product_search_listener, sender=Product)
+    signals.satchmo_search.connect(indexed_product_search_listener, sender=Product)
     signals.satchmo_order_status_changed.connect(capture_on_ship_listener)
     signals.satchmo_order_status_changed.connect(notification.notify_on_ship_listener)
     signals.satchmo_cart_add_verify.connect(veto_out_of_stock)
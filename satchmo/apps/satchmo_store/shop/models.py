@@ -24,7 +24,7 @@ from l10n.models import Country
 from l10n.utils import moneyfmt
 from livesettings import ConfigurationSettings, config_value, config_choice_values
 from payment.fields import PaymentChoiceCharField
-from product.models import Discount, Product, DownloadableProduct, PriceAdjustmentCalc, PriceAdjustment, Price, get_product_quantity_adjustments
+from product.models import Discount, Product, DownloadableProduct, PriceAdjustmentCalc, PriceAdjustment, Price, get_current_prices, get_product_quantity_adjustments
 from satchmo_store.contact.models import Contact
 from satchmo_utils.numbers import trunc_decimal
 from shipping.fields import ShippingChoiceCharField
@@ -278,9 +278,31 @@ class Cart(models.Model):
 
     objects = CartManager()
 
+    def _get_items(self):
+        """The items in this cart, loaded with their products, subtypes and
+        details in a few queries and kept until the cart changes.  Each item prices
+        its line only once while it is kept."""
+        items = getattr(self, '_items_cache', None)
+        if items is None:
+            items = list(self.cartitem_set.select_related('product'))
+            Product.objects.load_subtypes([item.product for item in items])
+            details = {}
+            if items:
+                for detail in CartItemDetails.objects.filter(cartitem__cart=self):
+                    details.setdefault(detail.cartitem_id, []).append(detail)
+            for item in items:
+                item._cart_cache = self
+                item._details_cache = details.get(item.id, [])
+                item._prices_cache = {}
+            self._items_cache = items
+        return items
+
+    def _clear_items_cache(self):
+        self._items_cache = None
+
     def _get_count(self):
         itemCount = 0
-        for item in self.cartitem_set.all():
+        for item in self._get_items():
             itemCount += item.quantity
         return (itemCount)
     numItems = property(_get_count)
@@ -292,7 +314,7 @@ class Cart(models.Model):
 
     def _get_total(self, include_discount=True):
         total = Decimal("0")
-        for item in self.cartitem_set.all():
+        for item in self._get_items():
             if include_discount:
                 total += item.line_total
             else:
@@ -306,10 +328,10 @@ class Cart(models.Model):
     undiscounted_total = property(_get_undiscounted_total)
     
     def __iter__(self):
-        return iter(self.cartitem_set.all())
+        return iter(self._get_items())
 
     def __len__(self):
-        return self.cartitem_set.count()
+        return len(self._get_items())
 
     def __unicode__(self):
         return u"Shopping Cart (%s)" % self.date_time_created
@@ -350,6 +372,7 @@ class Cart(models.Model):
             for data in details:
                 item_to_modify.add_detail(data)
 
+        self._clear_items_cache()
         return item_to_modify
 
     def remove_item(self, chosen_item_id, number_removed):
@@ -357,11 +380,13 @@ class Cart(models.Model):
         item_to_modify.quantity -= number_removed
         if item_to_modify.quantity <= 0:
             item_to_modify.delete()
+        self._clear_items_cache()
         self.save()
 
     def empty(self):
         for item in self.cartitem_set.all():
             item.delete()
+        self._clear_items_cache()
         self.save()
 
     def save(self, force_insert=False, force_update=False):
@@ -376,7 +401,7 @@ class Cart(models.Model):
 
     def _get_shippable(self):
         """Return whether the cart contains shippable items."""
-        for cartitem in self.cartitem_set.all():
+        for cartitem in self._get_items():
             if cartitem.is_shippable:
                 return True
         return False
@@ -386,7 +411,7 @@ class Cart(models.Model):
         """Return a list of shippable products, where each item is split into
         multiple elements, one for each quantity."""
         items = []
-        for cartitem in self.cartitem_set.all():
+        for cartitem in self._get_items():
             if cartitem.is_shippable:
                 p = cartitem.product
                 q =  int(cartitem.quantity.quantize(Decimal('0'), ROUND_CEILING))
@@ -413,8 +438,14 @@ class CartItem(models.Model):
     quantity = models.DecimalField(_("Quantity"),  max_digits=18,  decimal_places=6)
 
     def _get_line_unitprice(self, include_discount=True):
-        # Get the qty discount price as the unit price for the line.
+        # Items loaded by their cart remember their prices until it changes.
+        prices = getattr(self, '_prices_cache', None)
+        if prices is not None:
+            key = (include_discount, self.quantity)
+            if key in prices:
+                return prices[key]
 
+        # Get the qty discount price as the unit price for the line.
         self.qty_price = self.get_qty_price(self.quantity, include_discount=include_discount)
         self.detail_price = self.get_detail_price()
         #send signal to possibly adjust the unitprice
@@ -426,6 +457,8 @@ class CartItem(models.Model):
         del self.qty_price
         del self.detail_price
 
+        if prices is not None:
+            prices[key] = price
         return price
 
     unit_price = property(_get_line_unitprice)
@@ -439,7 +472,7 @@ class CartItem(models.Model):
         """Get the delta price based on detail modifications"""
         delta = Decimal("0")
         if self.has_details:
-            for detail in self.details.all():
+            for detail in self._get_details():
                 if detail.price_change and detail.value:
                     delta += detail.price_change
         return delta
@@ -470,11 +503,21 @@ class CartItem(models.Model):
         detl = CartItemDetails(cartitem=self, name=data['name'], value=data['value'], sort_order=data['sort_order'], price_change=data['price_change'])
         detl.save()
         #self.details.add(detl)
+        self._clear_cart_cache()
+
+    def _get_details(self):
+        details = getattr(self, '_details_cache', None)
+        if details is None:
+            details = self.details.all()
+        return details
 
     def _has_details(self):
         """
         Determine if this specific item has more detail
         """
+        details = getattr(self, '_details_cache', None)
+        if details is not None:
+            return len(details) > 0
         return (self.details.count() > 0)
 
     has_details = property(_has_details)
@@ -485,6 +528,23 @@ class CartItem(models.Model):
         return u'%s - %s %s%s' % (self.quantity, self.product.name,
             force_unicode(currency), self.line_total)
 
+    def _clear_cart_cache(self):
+        """Forget prices and details, and the items of the cart this item
+        was loaded by."""
+        self._prices_cache = None
+        self._details_cache = None
+        cart = getattr(self, '_cart_cache', None)
+        if cart is not None:
+            cart._clear_items_cache()
+
+    def save(self, force_insert=False, force_update=False):
+        super(CartItem, self).save(force_insert=force_insert, force_update=force_update)
+        self._clear_cart_cache()
+
+    def delete(self):
+        super(CartItem, self).delete()
+        self._clear_cart_cache()
+
     class Meta:
         verbose_name = _("Cart Item")
         verbose_name_plural = _("Cart Items")
@@ -560,6 +620,33 @@ class OrderManager(models.Manager):
             pass
         return False
 
+# Order amounts are stored with ten decimal places.
+_DB_PLACES = Decimal("0.0000000001")
+
+def _db_decimal(value):
+    """A decimal as it will be stored, for finding changed values."""
+    if isinstance(value, Decimal):
+        return value.quantize(_DB_PLACES)
+    return value
+
+# The OrderItem fields recalculating an order may change.
+_RECALC_FIELDS = ('unit_price', 'unit_tax', 'line_item_price', 'tax', 'discount')
+
+def _item_values(item):
+    return tuple([_db_decimal(getattr(item, field)) for field in _RECALC_FIELDS])
+
+def _save_changed_items(items, original):
+    """Write back the items whose recalculated fields differ from
+    `original`, with one update for each set of new values."""
+    changed = {}
+    for item in items:
+        values = _item_values(item)
+        if values != original[item.id]:
+            changed.setdefault(values, []).append(item.id)
+
+    for values, ids in changed.items():
+        OrderItem.objects.filter(id__in=ids).update(**dict(zip(_RECALC_FIELDS, values)))
+
 class Order(models.Model):
     """
     Orders contain a copy of all the information at the time the order was
@@ -811,31 +898,72 @@ class Order(models.Model):
         else:
             self.force_recalculate_total(save=save)
 
+    def _load_items(self):
+        """The items of this order with their products, subtypes and details,
+        loaded in a few queries."""
+        items = list(self.orderitem_set.select_related('product'))
+        details = {}
+        if items:
+            for detail in OrderItemDetail.objects.filter(item__order=self):
+                details.setdefault(detail.item_id, []).append(detail)
+        Product.objects.load_subtypes([item.product for item in items])
+        for item in items:
+            item._order_cache = self
+            item._details_cache = details.get(item.id, [])
+        return items
+
+    def taxable_items(self):
+        """The taxable items of this order, from memory while it is being
+        recalculated."""
+        items = getattr(self, '_recalc_items', None)
+        if items is None:
+            return self.orderitem_set.filter(product__taxable=True)
+        return [item for item in items if item.product.taxable]
+
     def force_recalculate_total(self, save=True):
-        """Calculates sub_total, taxes and total."""
+        """Calculates sub_total, taxes and total.
+
+        The items, their prices and details are loaded once, every line is
+        priced, discounted and taxed in memory, and only the items and tax
+        details which changed are written back.
+        """
+        items = self._load_items()
+        self._recalc_items = items
+        try:
+            self._recalculate(items, save)
+        finally:
+            self._recalc_items = None
+
+    def _recalculate(self, items, save):
         zero = Decimal("0.0000000000")
         total_discount = Decimal("0.0000000000")
 
         discount = Discount.objects.by_code(self.discount_code)
-        discount.calc(self)
+        discount.calc(self, items=items)
 
         discounts = discount.item_discounts
+        prices = get_current_prices([lineitem.product for lineitem in items])
+        taxProcessor = get_tax_processor(self)
+        original = {}
         itemprices = []
         fullprices = []
-        for lineitem in self.orderitem_set.all():
+        for lineitem in items:
             lid = lineitem.id
+            original[lid] = _item_values(lineitem)
             if lid in discounts:
                 lineitem.discount = discounts[lid]
             else:
                 lineitem.discount = zero
             # now double check against other discounts, such as tiered discounts
-            adjustment = get_product_quantity_adjustments(lineitem.product, qty=lineitem.quantity)
+            adjustment = get_product_quantity_adjustments(lineitem.product, qty=lineitem.quantity,
+                prices=prices.get(lineitem.product_id, []))
             if adjustment and adjustment.price:
                 baseprice = adjustment.price.price
                 finalprice = adjustment.final_price()
                 #We need to add in any OrderItemDetail price adjustments before we do anything else 
-                baseprice += lineitem.get_detail_price() 
-                finalprice += lineitem.get_detail_price() 
+                detailprice = lineitem.get_detail_price()
+                baseprice += detailprice
+                finalprice += detailprice
                 if baseprice > finalprice or baseprice != lineitem.unit_price:
                     unitdiscount = (lineitem.discount/lineitem.quantity) + baseprice-finalprice
                     unitdiscount = trunc_decimal(unitdiscount, 2)
@@ -848,11 +976,14 @@ class Order(models.Model):
                     log.debug('Adjusting lineitem unit price for %s. Full price=%s, discount=%s.  Final price for qty %d is %s', 
                         lineitem.product.slug, baseprice, unitdiscount, lineitem.quantity, fullydiscounted)
             if save:
-                lineitem.save()
+                lineitem.update_tax(processor=taxProcessor)
 
             itemprices.append(lineitem.sub_total)
             fullprices.append(lineitem.line_item_price)
 
+        if save:
+            _save_changed_items(items, original)
+
         shipprice = Price()
         shipprice.price = self.shipping_cost
         shipadjust = PriceAdjustmentCalc(shipprice)
@@ -878,17 +1009,9 @@ class Order(models.Model):
 
         self.sub_total = full_sub_total
 
-        taxProcessor = get_tax_processor(self)
-        totaltax, taxrates = taxProcessor.process()
+        totaltax, taxrates = taxProcessor.process(self)
         self.tax = totaltax
-
-        # clear old taxes
-        for taxdetl in self.taxes.all():
-            taxdetl.delete()
-
-        for taxdesc, taxamt in taxrates.items():
-            taxdetl = OrderTaxDetail(order=self, tax=taxamt, description=taxdesc, method=taxProcessor.method)
-            taxdetl.save()
+        self._save_tax_details(taxrates, taxProcessor.method)
 
         log.debug("Order #%i, recalc: sub_total=%s, shipping=%s, discount=%s, tax=%s",
             self.id,
@@ -902,6 +1025,29 @@ class Order(models.Model):
         if save:
             self.save()
 
+    def _save_tax_details(self, taxrates, method):
+        """Make the tax details match `taxrates`, changing only the rows
+        which differ."""
+        existing = {}
+        stale = []
+        for taxdetl in self.taxes.all():
+            if taxdetl.description in existing:
+                stale.append(taxdetl.id)
+            else:
+                existing[taxdetl.description] = taxdetl
+
+        for taxdesc, taxamt in taxrates.items():
+            taxdetl = existing.pop(taxdesc, None)
+            if taxdetl is None:
+                taxdetl = OrderTaxDetail(order=self, tax=taxamt, description=taxdesc, method=method)
+                taxdetl.save()
+            elif _db_decimal(taxdetl.tax) != _db_decimal(taxamt) or taxdetl.method != method:
+                OrderTaxDetail.objects.filter(id=taxdetl.id).update(tax=taxamt, method=method)
+
+        stale.extend([taxdetl.id for taxdetl in existing.values()])
+        if stale:
+            OrderTaxDetail.objects.filter(id__in=stale).delete()
+
     def shippinglabel(self):
         url = urlresolvers.reverse('satchmo_print_shipping', None, None, {'doc' : 'shippinglabel', 'id' : self.id})
         return mark_safe(u'<a href="%s">%s</a>' % (url, ugettext('View')))
@@ -1046,6 +1192,9 @@ class OrderItem(models.Model):
     
     def _has_details(self):
         """Determine if this specific item has more detail"""
+        details = getattr(self, '_details_cache', None)
+        if details is not None:
+            return len(details) > 0
         return (self.orderitemdetail_set.count() > 0)
     
     has_details = property(_has_details)
@@ -1054,7 +1203,10 @@ class OrderItem(models.Model):
         """Get the delta price based on detail modifications"""
         delta = Decimal("0.000000")
         if self.has_details:
-            for detail in self.orderitemdetail_set.all():
+            details = getattr(self, '_details_cache', None)
+            if details is None:
+                details = self.orderitemdetail_set.all()
+            for detail in details:
                 if detail.price_change and detail.value:
                     delta += detail.price_change
         return delta
@@ -1086,9 +1238,10 @@ class OrderItem(models.Model):
         self.update_tax()
         super(OrderItem, self).save(force_insert=force_insert, force_update=force_update)
 
-    def update_tax(self):
+    def update_tax(self, processor=None):
         taxclass = self.product.taxClass
-        processor = get_tax_processor(order=self.order)
+        if processor is None:
+            processor = get_tax_processor(order=self.order)
         self.unit_tax = processor.by_price(taxclass, self.unit_price)
         self.tax = processor.by_orderitem(self)
 
@@ -1,5 +1,6 @@
+from django.contrib.sites.models import Site
 from django.template import Library, Node
-from product.models import Category
+from product.models import Category, CategoryCounts, CategoryTree, prefetch_translations
 from satchmo_utils.templatetags import get_filter_args
 import logging
 
@@ -12,10 +13,17 @@ except ImportError:
 
 register = Library()
 
-def recurse_for_children(current_node, parent_node, active_cat, show_empty=True):
-    child_count = current_node.child.count()
+def recurse_for_children(current_node, parent_node, active_cat, show_empty=True, tree=None, cats=None, counts=None):
+    """Add `current_node` and its children to the list.  When given the site's
+    `CategoryTree`, a dictionary of all its categories by id and its
+    `CategoryCounts`, the children are found without querying the database."""
+    if tree is None:
+        child_count = current_node.child.count()
+    else:
+        child_ids = [catid for catid in tree.children.get(current_node.id, []) if catid in cats]
+        child_count = len(child_ids)
 
-    if show_empty or child_count > 0 or current_node.product_set.count() > 0:
+    if show_empty or child_count > 0 or _has_products(current_node, counts):
         temp_parent = SubElement(parent_node, 'li')
         attrs = {'href': current_node.get_absolute_url()}
         if current_node == active_cat:
@@ -25,9 +33,17 @@ def recurse_for_children(current_node, parent_node, active_cat, show_empty=True)
 
         if child_count > 0:
             new_parent = SubElement(temp_parent, 'ul')
-            children = current_node.child.all()
+            if tree is None:
+                children = current_node.child.all()
+            else:
+                children = [cats[catid] for catid in child_ids]
             for child in children:
-                recurse_for_children(child, new_parent, active_cat)
+                recurse_for_children(child, new_parent, active_cat, tree=tree, cats=cats, counts=counts)
+
+def _has_products(category, counts=None):
+    if counts is None:
+        return category.product_set.count() > 0
+    return counts.has_products(category.id)
 
 def category_tree(id=None):
     """
@@ -52,8 +68,15 @@ def category_tree(id=None):
     if id:
         active_cat = Category.objects.get(id=id)
     root = Element("ul")
-    for cats in Category.objects.root_categories():
-        recurse_for_children(cats, root, active_cat)
+    site = Site.objects.get_current()
+    tree = CategoryTree.get(site.id)
+    # every category of the site in one query, the tree gives the structure
+    cats = Category.objects.in_bulk(tree.nodes.keys())
+    prefetch_translations(cats.values())
+    counts = CategoryCounts.get(site.id)
+    for catid in tree.children.get(None, []):
+        if catid in cats:
+            recurse_for_children(cats[catid], root, active_cat, tree=tree, cats=cats, counts=counts)
     return tostring(root, 'utf-8')
 
 register.simple_tag(category_tree)
@@ -571,6 +571,37 @@ class CartTest(TestCase):
         self.assertEqual(item2.unit_price, Decimal("23.00"))
         self.assertEqual(cart.total, Decimal("43.00"))
 
+    def test_cart_snapshot(self):
+        lb = Product.objects.get(slug__iexact='dj-rocks-l-bl')
+        sb = Product.objects.get(slug__iexact='dj-rocks-s-b')
+
+        cart = Cart(site=Site.objects.get_current())
+        cart.save()
+        cart.add_item(sb, 1)
+        cart.add_item(lb, 2, details=[{'name' : 'gift', 'value' : 'yes',
+            'sort_order' : 0, 'price_change' : Decimal("1.00")}])
+        self.assertEqual(len(cart), 2)
+        self.assertEqual(cart.numItems, 3)
+        self.assertEqual(cart.total, Decimal("68.00"))
+        self.assert_(cart._get_items() is cart._get_items())
+
+        # changing an item through the cart reloads it
+        item = list(cart)[0]
+        item.quantity = 2
+        item.save()
+        self.assertEqual(cart.total, Decimal("88.00"))
+
+        # changes made elsewhere are picked up from the cart changed signal
+        other = CartItem.objects.get(cart=cart, product=lb)
+        other.delete()
+        self.assertEqual(cart.total, Decimal("88.00"))
+        signals.satchmo_cart_changed.send(cart, cart=cart, request=None)
+        self.assertEqual(cart.total, Decimal("40.00"))
+
+        cart.empty()
+        self.assertEqual(len(cart), 0)
+        self.assertEqual(cart.total, Decimal("0"))
+
 class ConfigTest(TestCase):
     fixtures = ['l10n-data.yaml', 'sample-store-data.yaml', 'test-config.yaml']
 
@@ -905,6 +936,38 @@ class OrderTest(TestCase):
         pmt.save()
     
         self.assert_(order.is_partially_paid)
+
+    def testRecalculateChangedItems(self):
+        order = make_test_order(self.US, '', include_non_taxed=True)
+        order.recalculate_total()
+        self.assertEqual(order.sub_total, Decimal('105.00'))
+        self.assertEqual(order.total, Decimal('115.00'))
+        taxes = order.taxes.count()
+
+        book = Product.objects.get(slug='neat-book-hard')
+        Price.objects.filter(product=book).update(price=Decimal('4.00'))
+        order = Order.objects.get(id=order.id)
+        order.recalculate_total()
+        self.assertEqual(order.sub_total, Decimal('104.00'))
+        self.assertEqual(order.total, Decimal('114.00'))
+        self.assertEqual(order.taxes.count(), taxes)
+
+        item = OrderItem.objects.get(order=order, product=book)
+        self.assertEqual(item.unit_price, Decimal('4.00'))
+        self.assertEqual(item.line_item_price, Decimal('4.00'))
+        item = OrderItem.objects.get(order=order, product__slug='dj-rocks-s-b')
+        self.assertEqual(item.line_item_price, Decimal('100.00'))
+
+    def testRecalculateWithoutDiscount(self):
+        """Orders without a discount code are recalculated with a NullDiscount"""
+        order = make_test_order(self.US, '')
+        self.assertFalse(order.discount_code)
+        order.force_recalculate_total()
+        self.assertEqual(order.discount, Decimal('0.00'))
+        self.assertEqual(order.sub_total, Decimal('100.00'))
+        order = Order.objects.get(id=order.id)
+        order.recalculate_total()
+        self.assertEqual(order.discount, Decimal('0.00'))
         
 class QuickOrderTest(TestCase):
     """Test quickorder sheet."""
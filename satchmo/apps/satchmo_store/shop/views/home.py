@@ -3,6 +3,7 @@ from django.shortcuts import render_to_response
 from django.template import RequestContext
 from django.utils.translation import ugettext as _
 from livesettings import config_value
+from product.models import prefetch_translations
 from product.views import display_featured
 
 def home(request, template="shop/index.html"):
@@ -29,6 +30,7 @@ def home(request, template="shop/index.html"):
             
     is_paged = paginator.num_pages > 1
     page = paginator.page(currpage)
+    page.object_list = prefetch_translations(page.object_list)
         
     ctx = RequestContext(request, {
         'all_products_list' : page.object_list,        
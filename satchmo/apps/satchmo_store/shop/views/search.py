@@ -1,6 +1,7 @@
 from django.shortcuts import render_to_response
 from django.template import RequestContext
-from product.models import Product
+from product.models import Product, prefetch_translations
+from product.utils import find_best_auto_discounts
 from satchmo_store.shop import signals
 
 def search_view(request, template="shop/search.html"):
@@ -17,12 +18,21 @@ def search_view(request, template="shop/search.html"):
 
     results = {}
     
-    # this signal will usually call listeners.default_product_search_listener
+    # this signal will usually call listeners.indexed_product_search_listener
     signals.satchmo_search.send(Product, request=request, 
         category=category, keywords=keywords, results=results)
 
+    # iterating a queryset here keeps the prefetched objects in it
+    for key in ('categories', 'products'):
+        if key in results:
+            prefetch_translations(results[key])
+
+    # the sale of each product, found together
+    sales = find_best_auto_discounts(results.get('products', []))
+
     context = RequestContext(request, {
             'results': results,
+            'sales' : sales,
             'category' : category,
             'keywords' : keywords})
     return render_to_response(template, context)
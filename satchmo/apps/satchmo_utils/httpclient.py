@@ -0,0 +1,284 @@
+"""Keep-alive HTTP client for payment gateways and shipping carriers.
+
+Connections are kept open and pooled per scheme, host and port, so that
+repeated quotes and charges don't pay for a new TCP and SSL handshake on
+every call.  `urlopen` is a drop-in replacement for `urllib2.urlopen` for
+simple GET and POST requests, raising `urllib2.HTTPError` and
+`urllib2.URLError` just like it.
+
+Requests which would go through a proxy, set in the environment or by an
+opener installed with `urllib2.install_opener`, are handed to
+`urllib2.urlopen` instead.  Redirects are followed for GET requests only,
+a redirected POST raises `urllib2.HTTPError`.
+"""
+
+import httplib
+import logging
+import select
+import socket
+import sys
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+from StringIO import StringIO
+from urllib import splitport
+
+log = logging.getLogger('satchmo_utils.httpclient')
+
+# httplib takes a connect timeout from Python 2.6 on.
+_CONNECT_TIMEOUT = sys.version_info >= (2, 6)
+
+_REDIRECTS = (301, 302, 303, 307)
+
+def _proxies():
+    """The proxies of the opener installed in urllib2, or else those set in
+    the environment, by scheme."""
+    opener = getattr(urllib2, '_opener', None)
+    if opener is not None:
+        for handler in opener.handlers:
+            if isinstance(handler, urllib2.ProxyHandler):
+                return handler.proxies
+    return urllib.getproxies()
+
+def _urllib2_open(url, data, headers, timeout):
+    # a fresh opener unless one is installed, since the one urllib2.urlopen
+    # would install keeps the proxies of the moment for good
+    opener = getattr(urllib2, '_opener', None) or urllib2.build_opener()
+    request = urllib2.Request(url, data, headers)
+    if _CONNECT_TIMEOUT:
+        return opener.open(request, timeout=timeout)
+    return opener.open(request)
+
+def _is_dropped(conn):
+    """Whether the server has closed an idle connection.  An idle socket
+    which is readable has either reached its end or holds data nobody asked
+    for, and can't carry a new request either way."""
+    if conn.sock is None:
+        return True
+    try:
+        return bool(select.select([conn.sock], [], [], 0)[0])
+    except (select.error, socket.error):
+        return True
+
+def _nothing_received(e):
+    """Whether a BadStatusLine means the connection was closed before any
+    reply, which the versions of httplib report differently."""
+    line = getattr(e, 'line', None)
+    return not line or line == "''" or line.startswith('No status line')
+
+class Response(StringIO):
+    """The body and headers of a response, read in full."""
+
+    def __init__(self, url, code, msg, headers, body):
+        StringIO.__init__(self, body)
+        self.url = url
+        self.code = code
+        self.msg = msg
+        self.headers = headers
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+class ConnectionPool(object):
+    """Keeps up to `size` idle connections open to each host.
+
+    Connecting and requests time out after `timeout` seconds.  Failing to
+    connect is retried `retries` times, waiting `backoff` seconds, doubled on
+    every attempt.  A request is only sent again when the idle connection it
+    was sent on turns out to be closed before the request could be written,
+    or, for a GET, before the server replied anything at all.  Otherwise any
+    failure is raised, since the server may have acted on the request.
+    GET requests follow up to `redirects` redirects.
+    """
+
+    def __init__(self, size=4, timeout=30, retries=2, backoff=0.5, redirects=5):
+        self.size = size
+        self.redirects = redirects
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _connect(self, key, timeout):
+        scheme, host, port = key
+        if scheme == 'https':
+            cls = httplib.HTTPSConnection
+        else:
+            cls = httplib.HTTPConnection
+
+        wait = self.backoff
+        attempt = 0
+        while True:
+            try:
+                if _CONNECT_TIMEOUT:
+                    conn = cls(host, port, timeout=timeout)
+                else:
+                    conn = cls(host, port)
+                conn.connect()
+                conn.sock.settimeout(timeout)
+                return conn
+            except socket.error, e:
+                if attempt >= self.retries:
+                    raise urllib2.URLError(e)
+                attempt += 1
+                log.debug('Could not connect to %s:%s, retrying in %s seconds: %s', host, port, wait, e)
+                time.sleep(wait)
+                wait *= 2
+
+    def _get(self, key):
+        """Return an idle connection to the host, or None."""
+        self._lock.acquire()
+        try:
+            idle = self._idle.get(key, None)
+            if idle:
+                return idle.pop()
+            return None
+        finally:
+            self._lock.release()
+
+    def _put(self, key, conn):
+        self._lock.acquire()
+        try:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.size:
+                idle.append(conn)
+                return
+        finally:
+            self._lock.release()
+        conn.close()
+
+    def clear(self):
+        """Close every idle connection."""
+        self._lock.acquire()
+        try:
+            idle = self._idle
+            self._idle = {}
+        finally:
+            self._lock.release()
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def urlopen(self, url, data=None, headers=None, timeout=None):
+        """Request `url`, a string or a `urllib2.Request`, POSTing `data` if
+        given, and return the response, read in full."""
+        if isinstance(url, urllib2.Request):
+            request = url
+            url = request.get_full_url()
+            if data is None:
+                data = request.get_data()
+            request_headers = dict(request.header_items())
+        else:
+            request_headers = {}
+        if headers:
+            request_headers.update(headers)
+        if timeout is None:
+            timeout = self.timeout
+
+        redirects = 0
+        while True:
+            if urlparse.urlsplit(url)[0].lower() in _proxies():
+                return _urllib2_open(url, data, request_headers, timeout)
+
+            result = self._open(url, data, request_headers, timeout)
+            if result.code not in _REDIRECTS:
+                return result
+
+            location = result.headers.getheader('location') or result.headers.getheader('uri')
+            if data is not None:
+                raise urllib2.HTTPError(url, result.code,
+                    'POST redirected to %s, not followed' % location, result.headers, result)
+            if not location or redirects >= self.redirects:
+                raise urllib2.HTTPError(url, result.code,
+                    'redirect to %s not followed' % location, result.headers, result)
+            redirects += 1
+            url = urlparse.urljoin(url, location)
+
+    def _open(self, url, data, request_headers, timeout):
+        """Send one request, returning the response read in full."""
+        request_headers = request_headers.copy()
+        scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+        scheme = scheme.lower()
+        if scheme not in ('http', 'https'):
+            raise urllib2.URLError('unsupported url scheme: %s' % scheme)
+        host, port = splitport(netloc)
+        if port:
+            port = int(port)
+        elif scheme == 'https':
+            port = httplib.HTTPS_PORT
+        else:
+            port = httplib.HTTP_PORT
+        key = (scheme, host, port)
+
+        if not path:
+            path = '/'
+        if query:
+            path = '%s?%s' % (path, query)
+
+        if data is None:
+            method = 'GET'
+        else:
+            method = 'POST'
+            if isinstance(data, unicode):
+                data = data.encode('utf-8')
+            if 'Content-type' not in request_headers:
+                request_headers['Content-type'] = 'application/x-www-form-urlencoded'
+
+        while True:
+            conn = self._get(key)
+            reused = conn is not None
+            if reused and _is_dropped(conn):
+                conn.close()
+                continue
+            if not reused:
+                conn = self._connect(key, timeout)
+            else:
+                conn.sock.settimeout(timeout)
+
+            try:
+                conn.request(method, path, data, request_headers)
+            except (socket.error, httplib.HTTPException), e:
+                conn.close()
+                if reused and not isinstance(e, socket.timeout):
+                    # the server closed the idle connection, use a new one
+                    log.debug('Connection to %s:%s was closed, reconnecting: %s', host, port, e)
+                    continue
+                raise urllib2.URLError(e)
+
+            try:
+                response = conn.getresponse()
+                body = response.read()
+            except httplib.BadStatusLine, e:
+                conn.close()
+                if reused and method == 'GET' and _nothing_received(e):
+                    # closed as the request arrived, and safe to ask again
+                    log.debug('Connection to %s:%s was closed, reconnecting: %s', host, port, e)
+                    continue
+                raise urllib2.URLError(e)
+            except (socket.error, httplib.HTTPException), e:
+                # the server may have acted on the request, never send it again
+                conn.close()
+                raise urllib2.URLError(e)
+            break
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._put(key, conn)
+
+        result = Response(url, response.status, response.reason, response.msg, body)
+        if response.status >= 400:
+            raise urllib2.HTTPError(url, response.status, response.reason, response.msg, result)
+        return result
+
+_POOL = ConnectionPool()
+
+def urlopen(url, data=None, headers=None, timeout=None):
+    """Request `url` on the shared connection pool, see `ConnectionPool.urlopen`."""
+    return _POOL.urlopen(url, data=data, headers=headers, timeout=timeout)
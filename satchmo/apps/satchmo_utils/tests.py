@@ -1,5 +1,62 @@
 from django.test import TestCase
+from satchmo_utils.httpclient import ConnectionPool
 from satchmo_utils.numbers import round_decimal, RoundedDecimalError, trunc_decimal
+from satchmo_utils.thumbnail import jobs, utils
+import BaseHTTPServer
+import os
+import shutil
+import SocketServer
+import tempfile
+import threading
+import time
+import urllib2
+
+class EchoHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Keep-alive handler which echoes the posted data, or fails on /error.
+    On /drop it hangs up without replying, on /once it closes the connection
+    after replying.  /moved redirects to /echo."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        if self.path == '/moved':
+            self.send_response(302)
+            self.send_header('Location', '/echo')
+            body = ''
+        else:
+            self.send_response(200)
+            body = 'echo:' + self.path
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.clients.append(self.client_address)
+        self.server.paths.append(self.path)
+        if self.path == '/drop':
+            self.close_connection = 1
+            return
+        if self.path == '/once':
+            self.close_connection = 1
+        if self.path == '/error':
+            code, body = 500, 'error'
+        elif self.path == '/moved':
+            code, body = 302, ''
+        else:
+            code, body = 200, 'echo:' + data
+        self.send_response(code)
+        if code == 302:
+            self.send_header('Location', '/echo')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class EchoServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
 
 class TestRoundedDecimals(TestCase):
     
@@ -45,4 +102,130 @@ class TestRoundedDecimals(TestCase):
         self.assertEqual(val, Decimal("0.01"))
         val = trunc_decimal("0.009", 2)
         self.assertEqual(val, Decimal("0.01"))
-        
\ No newline at end of file
+        
+
+class TestHttpClient(TestCase):
+
+    def setUp(self):
+        self.server = EchoServer(('127.0.0.1', 0), EchoHandler)
+        self.server.clients = []
+        self.server.paths = []
+        t = threading.Thread(target=self.server.serve_forever)
+        t.setDaemon(True)
+        t.start()
+        self.url = 'http://127.0.0.1:%i' % self.server.server_port
+        self.pool = ConnectionPool(retries=1, backoff=0.01)
+
+    def tearDown(self):
+        self.pool.clear()
+
+    def testKeepAlive(self):
+        for i in range(3):
+            request = urllib2.Request(self.url + '/echo', data='n=%i' % i)
+            self.assertEqual(self.pool.urlopen(request).read(), 'echo:n=%i' % i)
+        # all three requests were sent on one connection
+        self.assertEqual(len(self.server.clients), 3)
+        self.assertEqual(len(dict.fromkeys(self.server.clients)), 1)
+
+    def testErrors(self):
+        try:
+            self.pool.urlopen(self.url + '/error', 'x')
+            self.fail('expected an HTTPError')
+        except urllib2.HTTPError, e:
+            self.assertEqual(e.code, 500)
+
+        # the connection is still usable after an error response
+        self.assertEqual(self.pool.urlopen(self.url, 'y').read(), 'echo:y')
+
+        self.assertRaises(urllib2.URLError, self.pool.urlopen, 'http://127.0.0.1:1/', 'z')
+
+    def testNeverResent(self):
+        self.assertEqual(self.pool.urlopen(self.url + '/echo', 'a').read(), 'echo:a')
+        # the reply is lost after the server read the request on a reused
+        # connection, so the charge may have gone through
+        self.assertRaises(urllib2.URLError, self.pool.urlopen, self.url + '/drop', 'b')
+        self.assertEqual(self.server.paths.count('/drop'), 1)
+
+    def testIdleConnectionClosed(self):
+        self.assertEqual(self.pool.urlopen(self.url + '/once', 'a').read(), 'echo:a')
+        time.sleep(0.1)
+        # the closed connection is noticed before anything is sent on it
+        self.assertEqual(self.pool.urlopen(self.url + '/echo', 'b').read(), 'echo:b')
+        self.assertEqual(len(dict.fromkeys(self.server.clients)), 2)
+
+    def testRedirects(self):
+        response = self.pool.urlopen(self.url + '/moved')
+        self.assertEqual(response.read(), 'echo:/echo')
+        self.assertEqual(response.geturl(), self.url + '/echo')
+
+        # a POST may not be sent again to another address
+        try:
+            self.pool.urlopen(self.url + '/moved', 'x')
+            self.fail('expected an HTTPError')
+        except urllib2.HTTPError, e:
+            self.assertEqual(e.code, 302)
+        self.assertEqual(self.server.paths, ['/moved', '/echo', '/moved'])
+
+    def testProxied(self):
+        saved = os.environ.get('http_proxy', None)
+        os.environ['http_proxy'] = self.url
+        try:
+            response = self.pool.urlopen('http://gateway.invalid/echo', 'a')
+        finally:
+            if saved is None:
+                del os.environ['http_proxy']
+            else:
+                os.environ['http_proxy'] = saved
+        # sent to the proxy, which echoes it
+        self.assertEqual(response.read(), 'echo:a')
+        self.assertEqual(self.server.paths, ['http://gateway.invalid/echo'])
+
+class TestThumbnailJobs(TestCase):
+
+    def setUp(self):
+        try:
+            import Image
+        except ImportError:
+            from PIL import Image
+        self.dir = tempfile.mkdtemp()
+        self.photo = os.path.join(self.dir, 'photo.jpg')
+        Image.new('RGB', (200, 100)).save(self.photo)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testParseSizes(self):
+        self.assertEqual(jobs.parse_sizes('120, 85x85,x60, bad'),
+            [(120, None), (85, 85), (None, 60)])
+
+    def testQueued(self):
+        # rendering only looks up the thumbnail, and queues the missing one
+        self.assertEqual(jobs.get_thumbnail_url(self.photo, width=50), self.photo)
+        self.assert_(jobs.wait_for_thumbnails())
+        thumb = os.path.join(self.dir, 'photo_t50.jpg')
+        self.assert_(os.path.isfile(thumb))
+        self.assertEqual(jobs.get_thumbnail_url(self.photo, width=50), thumb)
+
+    def testMakeAll(self):
+        missing = os.path.join(self.dir, 'missing.jpg')
+        ct = jobs.make_all_thumbnails([self.photo, missing], sizes=[(40, 40), (None, 30)], processes=1)
+        self.assertEqual(ct, 2)
+        self.assert_(os.path.isfile(os.path.join(self.dir, 'photo_t_w40_h40.jpg')))
+        self.assert_(os.path.isfile(os.path.join(self.dir, 'photo_t_h30.jpg')))
+
+    def testMetadataIndex(self):
+        self.assertEqual(utils.get_image_size(self.photo), (200, 100))
+        jobs.make_thumbnails(self.photo, sizes=[(50, None), (200, None)])
+        info = utils.get_image_info(self.photo)
+        self.assertEqual(info['thumbnails'], {(50, None) : True, (200, None) : False})
+
+        # answered from the index, without looking at the files
+        os.rename(self.photo, self.photo + '.moved')
+        self.assertEqual(utils.get_image_size(self.photo), (200, 100))
+        self.assertEqual(utils.lookup_thumbnail(self.photo, width=50),
+            os.path.join(self.dir, 'photo_t50.jpg'))
+        self.assertEqual(utils.lookup_thumbnail(self.photo, width=200), self.photo)
+
+        utils.forget_image(self.photo)
+        self.assertEqual(utils.lookup_thumbnail(self.photo, width=50), None)
+        utils.forget_image(self.photo)
@@ -1,4 +1,5 @@
-from livesettings import ConfigurationGroup, config_register_list, IntegerValue, BooleanValue
+from livesettings import ConfigurationGroup, config_register_list, IntegerValue, BooleanValue, \
+    PositiveIntegerValue, StringValue
 from django.utils.translation import ugettext_lazy as _
 
 THUMB_GROUP = ConfigurationGroup('THUMBNAIL', _('Thumbnail Settings'))
@@ -15,5 +16,17 @@ config_register_list(
         'RENAME_IMAGES',
         description=_("Rename product images?"),
         help_text=_("Automatically rename product images on upload?"),
-        default=True)
+        default=True),
+
+    StringValue(THUMB_GROUP,
+        'SIZES',
+        description=_("Thumbnail sizes"),
+        help_text=_("Comma separated sizes of the thumbnails made in the background whenever an image is saved, as width (120), width and height (85x85) or height only (x60)."),
+        default="85, 120"),
+
+    PositiveIntegerValue(THUMB_GROUP,
+        'PROCESSES',
+        description=_("Thumbnail processes"),
+        help_text=_("How many processes satchmo_make_thumbnails uses to make thumbnails."),
+        default=2)
 )
@@ -1,7 +1,8 @@
 from django.db.models import signals
 from django.db.models.fields.files import ImageField
 from livesettings import config_value, SettingNotSet
-from satchmo_utils.thumbnail.utils import remove_model_thumbnails, rename_by_field
+from satchmo_utils.thumbnail.jobs import queue_thumbnails
+from satchmo_utils.thumbnail.utils import forget_image, remove_model_thumbnails, rename_by_field
 from satchmo_utils import normalize_dir
 import config
 import logging
@@ -90,6 +91,12 @@ class ImageWithThumbnailField(ImageField):
             instance.save()
             self._renaming = False
 
+        image = getattr(instance, self.attname)
+        if image:
+            # the file may have been replaced, index it afresh
+            forget_image(image.path)
+            queue_thumbnails(image.name)
+
     def contribute_to_class(self, cls, name):
         super(ImageWithThumbnailField, self).contribute_to_class(cls, name)
         signals.pre_delete.connect(_delete, sender=cls)
@@ -0,0 +1,189 @@
+"""Thumbnail generation away from page rendering.
+
+Images saved through an `ImageWithThumbnailField` are queued, and a
+background thread makes their thumbnails in every configured size.  The
+thumbnail filter only looks up thumbnails in the image metadata index,
+queueing the missing ones, so rendering a page never decodes or resizes an
+image.  The satchmo_make_thumbnails command makes the thumbnails of every
+image, on a pool of processes where multiprocessing is available.
+"""
+
+from django.conf import settings
+from livesettings import config_value
+from satchmo_utils.thumbnail.utils import lookup_thumbnail, make_thumbnail, _get_path_from_url
+import itertools
+import logging
+import os
+import Queue
+import threading
+import time
+
+try:
+    import multiprocessing
+except ImportError:
+    # Python < 2.6
+    multiprocessing = None
+
+log = logging.getLogger('thumbnail.jobs')
+
+_QUEUE = Queue.Queue()
+_PENDING = {}
+_WORKER = []
+_LOCK = threading.Lock()
+
+def parse_sizes(value):
+    """Parse sizes written as "120, 85x85, x60" into (width, height) pairs,
+    either of which may be None."""
+    sizes = []
+    for size in value.split(','):
+        size = size.strip().lower()
+        if not size:
+            continue
+        if 'x' in size:
+            width, height = size.split('x', 1)
+        else:
+            width, height = size, ''
+        try:
+            width = width.strip() and int(width) or None
+            height = height.strip() and int(height) or None
+        except ValueError:
+            log.warn("Ignoring invalid thumbnail size: %s", size)
+            continue
+        if width or height:
+            sizes.append((width, height))
+    return sizes
+
+def thumbnail_sizes():
+    """The configured thumbnail sizes."""
+    return parse_sizes(config_value('THUMBNAIL', 'SIZES'))
+
+def _make(job):
+    """Make the thumbnails of one image, returning how many sizes were made.
+    Takes a single tuple so that it can be mapped over a process pool."""
+    photo_url, sizes, quality, root, url_root = job
+    if not os.path.isfile(_get_path_from_url(photo_url, root, url_root)):
+        log.debug("Not making thumbnails of missing image: %s", photo_url)
+        return 0
+    for width, height in sizes:
+        make_thumbnail(photo_url, width=width, height=height, root=root, url_root=url_root,
+            quality=quality)
+    return len(sizes)
+
+def make_thumbnails(photo_url, sizes=None, root=settings.MEDIA_ROOT, url_root=settings.MEDIA_URL):
+    """Make, or bring up to date, the thumbnails of an image in every size."""
+    if sizes is None:
+        sizes = thumbnail_sizes()
+    return _make((photo_url, sizes, config_value('THUMBNAIL', 'IMAGE_QUALITY'), root, url_root))
+
+def _worker():
+    while True:
+        key, job = _QUEUE.get()
+        try:
+            try:
+                _make(job)
+            except Exception:
+                log.exception("Error making thumbnails of %s", job[0])
+        finally:
+            _LOCK.acquire()
+            try:
+                del _PENDING[key]
+            finally:
+                _LOCK.release()
+
+def queue_thumbnails(photo_url, sizes=None, root=settings.MEDIA_ROOT, url_root=settings.MEDIA_URL):
+    """Queue the thumbnails of an image to be made in the background, in the
+    given sizes or all configured sizes.  Returns False if they were already
+    queued."""
+    if not photo_url:
+        return False
+    if sizes is None:
+        sizes = thumbnail_sizes()
+    key = (photo_url, tuple(sizes), root, url_root)
+
+    _LOCK.acquire()
+    try:
+        if key in _PENDING:
+            return False
+        _PENDING[key] = True
+        if not _WORKER:
+            t = threading.Thread(target=_worker)
+            t.setDaemon(True)
+            t.start()
+            _WORKER.append(t)
+    finally:
+        _LOCK.release()
+
+    _QUEUE.put((key, (photo_url, list(sizes), config_value('THUMBNAIL', 'IMAGE_QUALITY'),
+        root, url_root)))
+    return True
+
+def wait_for_thumbnails(timeout=30):
+    """Wait until every queued thumbnail has been made, returning False if
+    some are still pending after `timeout` seconds."""
+    end = time.time() + timeout
+    while _PENDING:
+        if time.time() > end:
+            return False
+        time.sleep(0.05)
+    return True
+
+def get_thumbnail_url(photo_url, width=None, height=None, root=settings.MEDIA_ROOT, url_root=settings.MEDIA_URL):
+    """Return the URL of the thumbnail of an image if it has been made.
+    Otherwise queue it, and return the URL of the image itself."""
+    url = lookup_thumbnail(photo_url, width, height, root, url_root)
+    if url is None:
+        queue_thumbnails(photo_url, [(width, height)], root, url_root)
+        url = photo_url
+    return url
+
+def image_urls():
+    """The images of every `ImageWithThumbnailField` of every installed model."""
+    from django.db.models import get_models
+    from satchmo_utils.thumbnail.field import ImageWithThumbnailField
+
+    seen = {}
+    urls = []
+    for model in get_models():
+        for field in model._meta.fields:
+            if isinstance(field, ImageWithThumbnailField):
+                for name in model._default_manager.values_list(field.attname, flat=True):
+                    if name and name not in seen:
+                        seen[name] = True
+                        urls.append(name)
+    return urls
+
+def make_all_thumbnails(photo_urls, sizes=None, processes=None, progress=None):
+    """Make the thumbnails of many images, on a pool of `processes` processes
+    if multiprocessing is available, calling `progress(done, total)` as
+    images are finished.  Returns the number of thumbnails made or checked."""
+    if sizes is None:
+        sizes = thumbnail_sizes()
+    if processes is None:
+        processes = config_value('THUMBNAIL', 'PROCESSES')
+    quality = config_value('THUMBNAIL', 'IMAGE_QUALITY')
+    jobs = [(url, sizes, quality, settings.MEDIA_ROOT, settings.MEDIA_URL) for url in photo_urls]
+    total = len(jobs)
+
+    pool = None
+    if processes > 1 and total > 1 and multiprocessing is not None:
+        # the workers don't use the database, and must not share its connection
+        from django.db import connection
+        connection.close()
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(_make, jobs, 10)
+    else:
+        results = itertools.imap(_make, jobs)
+
+    ct = 0
+    done = 0
+    try:
+        for made in results:
+            ct += made
+            done += 1
+            if progress:
+                progress(done, total)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return ct
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+from satchmo_utils.thumbnail import jobs
+import time
+
+class Command(BaseCommand):
+    help = "Makes the thumbnails of every product and category image, in every configured size."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--processes', dest='processes', type='int', default=None,
+            help='Number of processes making thumbnails, defaults to the PROCESSES setting.'),
+        make_option('--sizes', dest='sizes', default=None,
+            help='Sizes to make, such as "120,85x85", defaults to the SIZES setting.'),
+        )
+
+    requires_model_validation = True
+
+    def handle(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        sizes = options.get('sizes', None)
+        if sizes:
+            sizes = jobs.parse_sizes(sizes)
+
+        urls = jobs.image_urls()
+        if verbosity > 0:
+            print "Making thumbnails of %i images" % len(urls)
+
+        start = time.time()
+
+        def progress(done, total):
+            if verbosity > 1 and (done % 100 == 0 or done == total):
+                elapsed = max(time.time() - start, 0.001)
+                print "Finished %i of %i images (%.1f images/sec)" % (done, total, done / elapsed)
+
+        ct = jobs.make_all_thumbnails(urls, sizes=sizes, processes=options.get('processes', None),
+            progress=progress)
+
+        if verbosity > 0:
+            elapsed = max(time.time() - start, 0.001)
+            print "Made or checked %i thumbnails of %i images in %.1f seconds (%.1f images/sec)" % (
+                ct, len(urls), elapsed, len(urls) / elapsed)
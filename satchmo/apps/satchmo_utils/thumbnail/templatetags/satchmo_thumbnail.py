@@ -6,13 +6,19 @@
 from django import template
 from django.conf import settings
 from django.template import TemplateSyntaxError
-from satchmo_utils.thumbnail.utils import make_thumbnail, get_image_size
+from satchmo_utils.thumbnail.jobs import get_thumbnail_url
+from satchmo_utils.thumbnail.utils import get_image_size
 register = template.Library()
 ##################################################
 ## FILTERS ##
 
 def thumbnail(url, args=''):
-    """ Returns thumbnail URL and create it if not already exists.
+    """ Returns thumbnail URL if it has been made.
+
+If not, the thumbnail is queued to be made in the background and the original
+URL is returned, so that rendering never waits for an image to be resized.
+Thumbnails in the sizes set in the THUMBNAIL SIZES setting are made whenever
+an image is saved.
 
 .. note:: requires PIL_,
     if PIL_ is not found or thumbnail can not be created returns original URL.
@@ -65,9 +71,7 @@ or if only a width is requested (to be compatibile with admin interface)::
     if ('width' not in kwargs) and ('height' not in kwargs):
         raise template.TemplateSyntaxError, "thumbnail filter requires arguments (width and/or height)"
     
-    ret = make_thumbnail(url, **kwargs)
-    if ret is None:
-        ret = url
+    ret = get_thumbnail_url(url, **kwargs)
 
     if not ret.startswith(settings.MEDIA_URL):
         ret = settings.MEDIA_URL + ret
@@ -7,14 +7,18 @@ try:
 except ImportError:
     from PIL import Image
 from django.conf import settings
-from django.core.cache import get_cache
 from django.db.models.fields.files import ImageField
+from keyedcache import cache_delete, cache_get, cache_key, cache_set, md5_hash, NotCachedError
 from satchmo_utils.thumbnail.text import URLify
 from livesettings import config_value
+import logging
 
-image_cache = get_cache('locmem:///')
+log = logging.getLogger('thumbnail.utils')
 
-_FILE_CACHE_TIMEOUT = 60 * 60 * 60 * 24 * 31 # 1 month
+# memcached reads an expiry of more than 30 days as a unix timestamp, which
+# would expire the entries at once, so keep them 30 days at most
+_FILE_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+_MISSING_FILE_TIMEOUT = 60
 _THUMBNAIL_GLOB = '%s_t*%s'
 
 def _get_thumbnail_path(path, width=None, height=None):
@@ -67,8 +71,78 @@ def _has_thumbnail(photo_url, width=None, height=None, root=settings.MEDIA_ROOT,
 
     return os.path.isfile(_get_path_from_url(_get_thumbnail_path(photo_url, width, height), root, url_root))
 
-def make_thumbnail(photo_url, width=None, height=None, root=settings.MEDIA_ROOT, url_root=settings.MEDIA_URL):
-    """ create thumbnail """
+##################################################
+## IMAGE METADATA INDEX ##
+
+def _image_key(path):
+    return cache_key('ImageInfo', md5_hash(os.path.normpath(path)))
+
+def get_image_info(path):
+    """ Return the indexed metadata of the image at filesystem `path`.
+
+        The index is kept in keyedcache, so it is shared by every process.
+        Each entry is a dictionary of the image ``mtime``, its ``size`` once
+        known, and the ``thumbnails`` made of it, keyed by (width, height),
+        with False for sizes the image already has.  Missing images have an
+        ``mtime`` of None.
+    """
+    key = _image_key(path)
+    try:
+        return cache_get(key)
+    except NotCachedError:
+        pass
+
+    if os.path.isfile(path):
+        info = {'mtime' : os.path.getmtime(path), 'size' : None, 'thumbnails' : {}}
+        cache_set(key, value=info, length=_FILE_CACHE_TIMEOUT)
+    else:
+        info = {'mtime' : None, 'size' : None, 'thumbnails' : {}}
+        cache_set(key, value=info, length=_MISSING_FILE_TIMEOUT)
+    return info
+
+def _update_image_info(path, size=None, thumbnail=None, made=True):
+    info = get_image_info(path)
+    if info['mtime'] is None:
+        return
+    if size is not None:
+        info['size'] = size
+    if thumbnail is not None:
+        info['thumbnails'][thumbnail] = made
+    cache_set(_image_key(path), value=info, length=_FILE_CACHE_TIMEOUT)
+
+def forget_image(path):
+    """ Drop an image from the metadata index, after it is replaced or removed """
+    cache_delete(_image_key(path))
+
+def lookup_thumbnail(photo_url, width=None, height=None, root=settings.MEDIA_ROOT, url_root=settings.MEDIA_URL):
+    """ Return the URL of the thumbnail of photo_url, photo_url itself if the
+        image already has the requested size, or None if no thumbnail has
+        been made.  Answered from the metadata index, without touching the
+        filesystem once the image is indexed.
+    """
+
+    # one of width/height is required
+    assert (width is not None) or (height is not None)
+
+    path = _get_path_from_url(photo_url, root, url_root)
+    info = get_image_info(path)
+    if info['mtime'] is None:
+        return None
+
+    made = info['thumbnails'].get((width, height), None)
+    if made is None and _has_thumbnail(photo_url, width, height, root, url_root):
+        # made before it was indexed
+        made = True
+        _update_image_info(path, thumbnail=(width, height))
+
+    if made:
+        return _get_thumbnail_path(photo_url, width, height)
+    elif made is False:
+        return photo_url
+    return None
+
+def make_thumbnail(photo_url, width=None, height=None, root=settings.MEDIA_ROOT, url_root=settings.MEDIA_URL, quality=None):
+    """ create thumbnail, saved with `quality` or the configured IMAGE_QUALITY """
 
     # one of width/height is required
     assert (width is not None) or (height is not None)
@@ -83,6 +157,7 @@ def make_thumbnail(photo_url, width=None, height=None, root=settings.MEDIA_ROOT,
         # thumbnail already exists
         if not (os.path.getmtime(photo_path) > os.path.getmtime(th_path)):
             # if photo mtime is newer than thumbnail recreate thumbnail
+            _update_image_info(photo_path, thumbnail=(width, height))
             return th_url
 
     # make thumbnail
@@ -94,32 +169,35 @@ def make_thumbnail(photo_url, width=None, height=None, root=settings.MEDIA_ROOT,
         return photo_url
 
     # make proper size
+    same = False
     if (width is not None) and (height is not None):
-        if (orig_w == width) and (orig_h == height):
-            # same dimensions
-            return None
+        same = (orig_w == width) and (orig_h == height)
         size = (width, height)
     elif width is not None:
-        if orig_w == width:
-            # same dimensions
-            return None
+        same = orig_w == width
         size = (width, orig_h)
     elif height is not None:
-        if orig_h == height:
-            # same dimensions
-            return None
+        same = orig_h == height
         size = (orig_w, height)
 
+    if same:
+        # same dimensions
+        _update_image_info(photo_path, thumbnail=(width, height), made=False)
+        return None
+
     try:
         img = Image.open(photo_path).copy()
         img.thumbnail(size, Image.ANTIALIAS)
-        img.save(th_path, quality=config_value('THUMBNAIL', 'IMAGE_QUALITY'))
+        if quality is None:
+            quality = config_value('THUMBNAIL', 'IMAGE_QUALITY')
+        img.save(th_path, quality=quality)
     except Exception, err:
         # this goes to webserver error log
         import sys
         print >>sys.stderr, '[MAKE THUMBNAIL] error %s for file %r' % (err, photo_url)
         return photo_url
 
+    _update_image_info(photo_path, thumbnail=(width, height))
     return th_url
 
 def _remove_thumbnails(photo_url, root=settings.MEDIA_ROOT, url_root=settings.MEDIA_URL):
@@ -136,7 +214,7 @@ def _remove_thumbnails(photo_url, root=settings.MEDIA_ROOT, url_root=settings.ME
         except OSError:
             # no reason to crash due to bad paths.
             log.warn("Could not delete image thumbnail: %s", path)
-        image_cache.delete(path) # delete from cache
+    forget_image(file_name)
 
 def remove_model_thumbnails(model):
     """ remove all thumbnails for all ImageFields (and subclasses) in the model """
@@ -166,67 +244,30 @@ def _get_thumbnail_url(photo_url, width=None, height=None, root=settings.MEDIA_R
         if thumbnail file do not exists returns original URL
     """
 
-    # one of width/height is required
-    assert (width is not None) or (height is not None)
-
-    if _has_thumbnail(photo_url, width, height, root, url_root):
-        return _get_thumbnail_path(photo_url, width, height)
-    else:
-        return photo_url
-
-def _set_cached_file(path, value):
-    """ Store file dependent data in cache.
-        Timeout is set to _FILE_CACHE_TIMEOUT (1month).
-    """
-
-    mtime = os.path.getmtime(path)
-    image_cache.set(path, (mtime, value,), _FILE_CACHE_TIMEOUT)
-
-def _get_cached_file(path, default=None):
-    """ Get file content from cache.
-        If modification time differ return None and delete
-        data from cache.
-    """
-
-    cached = image_cache.get(path, default)
-    if cached is None:
-        return None
-    mtime, value = cached
-
-    if (not os.path.isfile(path)) or (os.path.getmtime(path) != mtime): # file is changed or deleted
-        image_cache.delete(path) # delete from cache
-        # remove thumbnails if exists
-        base, ext = os.path.splitext(os.path.basename(path))
-        basedir = os.path.dirname(path)
-        for file in fnmatch.filter(os.listdir(basedir), _THUMBNAIL_GLOB % (base, ext)):
-            os.remove(os.path.join(basedir, file))
-        return None
-    else:
-        return value
+    return lookup_thumbnail(photo_url, width, height, root, url_root) or photo_url
 
 def get_image_size(photo_url, root=settings.MEDIA_ROOT, url_root=settings.MEDIA_URL):
     """ returns image size.
 
-        image sizes are cached (using separate locmem:/// cache instance)
+        image sizes are kept in the image metadata index, so the image is
+        only opened the first time
     """
 
     path = _get_path_from_url(photo_url, root, url_root)
 
-    size = _get_cached_file(path)
-    if size is None:
-        try:
-            size = Image.open(path).size
-        except Exception, err:
-            # this goes to webserver error log
-            import sys
-            print >>sys.stderr, '[GET IMAGE SIZE] error %s for file %r' % (err, photo_url)
-            return None, None
-
-        if size is not None:
-            _set_cached_file(path, size)
-        else:
-            return None, None
+    info = get_image_info(path)
+    if info['size'] is not None:
+        return info['size']
+
+    try:
+        size = Image.open(path).size
+    except Exception, err:
+        # this goes to webserver error log
+        import sys
+        print >>sys.stderr, '[GET IMAGE SIZE] error %s for file %r' % (err, photo_url)
+        return None, None
 
+    _update_image_info(path, size=size)
     return size
 
 
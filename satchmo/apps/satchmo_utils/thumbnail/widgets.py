@@ -2,7 +2,7 @@ from django import forms
 from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
 from django.utils.safestring import mark_safe
-from satchmo_utils.thumbnail.utils import make_admin_thumbnail
+from satchmo_utils.thumbnail.jobs import get_thumbnail_url
 
 class AdminImageWithThumbnailWidget(forms.FileInput):
     """
@@ -14,9 +14,7 @@ class AdminImageWithThumbnailWidget(forms.FileInput):
     def render(self, name, value, attrs=None):
         output = []
         if value and hasattr(value, "url"):
-            thumb = make_admin_thumbnail(value.url)
-            if not thumb:
-                thumb = value.url
+            thumb = get_thumbnail_url(value.url, width=120)
             output.append('<img src="%s" /><br/>%s<br/> %s ' % \
                 (thumb, value.url, _('Change:')))
         output.append(super(AdminImageWithThumbnailWidget, self).render(name, value, attrs))
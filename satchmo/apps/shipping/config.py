@@ -13,6 +13,34 @@ SHIPPING_ACTIVE = config_register(MultipleStringValue(SHIPPING_GROUP,
     default=["shipping.modules.per"],
     choices=[('shipping.modules.per', _('Per piece'))]
     ))
+
+config_register(FloatValue(SHIPPING_GROUP,
+    'QUOTE_TIMEOUT',
+    description=_("Shipping quote timeout"),
+    help_text=_("Seconds to wait for a carrier to return a shipping quote.  Carriers which take longer are not offered."),
+    default=10.0
+    ))
+
+config_register(PositiveIntegerValue(SHIPPING_GROUP,
+    'QUOTE_THREADS',
+    description=_("Concurrent shipping quotes"),
+    help_text=_("The number of carriers which may be asked for a shipping quote at the same time."),
+    default=4
+    ))
+
+config_register(PositiveIntegerValue(SHIPPING_GROUP,
+    'RATE_CACHE_TTL',
+    description=_("Carrier rate cache time"),
+    help_text=_("Seconds to reuse a carrier's quote for shipments with the same origin, destination, packages and service.  0 to disable."),
+    default=3600
+    ))
+
+config_register(PositiveIntegerValue(SHIPPING_GROUP,
+    'RATE_ERROR_TTL',
+    description=_("Carrier error cache time"),
+    help_text=_("Seconds to wait before asking a carrier again about a shipment it failed to quote.  0 to disable."),
+    default=120
+    ))
     
 # --- Load default shipping modules.  Ignore import errors, user may have deleted them. ---
 # DO NOT ADD 'tiered' or 'no' to this list.  
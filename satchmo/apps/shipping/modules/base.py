@@ -1,4 +1,19 @@
+try:
+    from decimal import Decimal, ROUND_CEILING
+except:
+    from django.utils._decimal import Decimal, ROUND_CEILING
+
+from keyedcache import cache_get, cache_set, NotCachedError
+from livesettings import config_value
+import keyedcache
+import logging
+
+log = logging.getLogger('shipping.modules.base')
+
 class BaseShipper(object):
+    # set on shippers which ask a carrier for their quotes
+    remote_quote = False
+
     def __init__(self, cart=None, contact=None):
         self._calculated = False
         self.cart = cart
@@ -15,4 +30,91 @@ class BaseShipper(object):
         """
         self.cart = cart
         self.contact = contact
-        self._calculated = True
\ No newline at end of file
+        self._calculated = True
+
+class RateUnavailable(Exception):
+    """The carrier failed to quote this shipment recently."""
+
+def round_up(value, step):
+    if value is None:
+        return ''
+    step = Decimal(step)
+    value = Decimal(str(value))
+    return str((value / step).to_integral(rounding=ROUND_CEILING) * step)
+
+def _address(address, country=None):
+    if country is None:
+        country = address.country.iso2_code
+    return (country, (address.postal_code or '').replace(' ', '').upper())
+
+def shipment_packages(products, weight_step='0.1', length_step='1'):
+    """Describe each of the products as a package, with the weight and
+    dimensions rounded up to the carrier's granularity."""
+    packages = []
+    for product in products:
+        packages.append((
+            round_up(product.smart_attr('weight'), weight_step),
+            (product.smart_attr('weight_units') or '').upper(),
+            round_up(product.smart_attr('length'), length_step),
+            round_up(product.smart_attr('width'), length_step),
+            round_up(product.smart_attr('height'), length_step),
+            (product.smart_attr('length_units') or '').upper(),
+            ))
+    packages.sort()
+    return tuple(packages)
+
+def shipment_signature(origin, destination, packages, service='', origin_country=None):
+    """Return the normalized description of a shipment, the same for every
+    cart which would get the same quote from a carrier.
+
+    `origin` and `destination` are addresses, of which only the country and
+    postal code are used.  `packages` is as returned by `shipment_packages`,
+    and `service` holds whatever else the carrier's request depends on.
+    """
+    return (_address(origin, origin_country), _address(destination),
+        packages, service)
+
+class RateCache(object):
+    """Carrier responses, shared between carts by shipment signature.
+
+    Responses are kept for SHIPPING.RATE_CACHE_TTL seconds.  Carrier errors
+    are remembered for SHIPPING.RATE_ERROR_TTL seconds, so that a failing
+    carrier is not asked again on every page.
+    """
+
+    def __init__(self, carrier, signature):
+        self.carrier = carrier
+        self.signature = signature
+
+    def get(self):
+        """Return the cached response, or None.  Raises RateUnavailable if
+        the carrier recently failed to quote this shipment."""
+        try:
+            error, response = cache_get('ShippingRate', self.carrier, self.signature)
+        except NotCachedError:
+            return None
+        if error:
+            raise RateUnavailable(response)
+        return response
+
+    def set(self, response):
+        ttl = config_value('SHIPPING', 'RATE_CACHE_TTL')
+        if ttl:
+            cache_set('ShippingRate', self.carrier, self.signature,
+                value=(False, response), length=ttl)
+
+    def set_error(self, message=''):
+        ttl = config_value('SHIPPING', 'RATE_ERROR_TTL')
+        if ttl:
+            log.debug('%s failed, not asking again for %i seconds: %s', self.carrier, ttl, message)
+            cache_set('ShippingRate', self.carrier, self.signature,
+                value=(True, message), length=ttl)
+
+    def flush(cls, carrier=None):
+        """Forget the cached rates, of every carrier if none is given."""
+        if carrier:
+            keyedcache.cache_delete('ShippingRate', carrier, children=True)
+        else:
+            keyedcache.cache_delete('ShippingRate', children=True)
+
+    flush = classmethod(flush)
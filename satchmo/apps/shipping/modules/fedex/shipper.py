@@ -11,9 +11,9 @@ from decimal import Decimal
 from django.utils.translation import ugettext as _
 from django.utils.safestring import mark_safe 
 from django.template import loader, Context
-from django.core.cache import cache
 
-from shipping.modules.base import BaseShipper
+from shipping.modules.base import BaseShipper, RateCache, RateUnavailable, shipment_signature
+from satchmo_utils.httpclient import urlopen
 from shipping import signals
 from livesettings import config_get_group
 
@@ -24,7 +24,8 @@ import logging
 log = logging.getLogger('fedex.shipper')
 
 class Shipper(BaseShipper):
-    
+    remote_quote = True
+
     def __init__(self, cart=None, contact=None, service_type=None):
 
         self._calculated = False
@@ -129,10 +130,59 @@ class Shipper(BaseShipper):
         '''
 
         conn = urllib2.Request(url=connection, data=request)
-        f = urllib2.urlopen(conn)
+        f = urlopen(conn)
         all_results = f.read()
         self.raw_response = all_results
         return(minidom.parseString(all_results))
+
+    def _quote(self, connection, shippingdata, verbose=False):
+        '''
+          Return the charge and transit time of one box, from the shared rate
+          cache if possible, or None if FedEx could not quote it.
+        '''
+        config = shippingdata['config']
+        signature = shipment_signature(shippingdata['shipping_address'],
+            shippingdata['contact'].shipping_address,
+            ((shippingdata['box_weight'], shippingdata['box_weight_units']),),
+            service=(connection, config['account'], config['ship_type'],
+                config['packaging'], shippingdata['box_price']),
+            origin_country=shippingdata['shipping_country_code'])
+        rates = RateCache('FedEx', signature)
+        try:
+            response = rates.get()
+        except RateUnavailable:
+            if verbose:
+                log.debug("FedEx recently failed to quote this shipment")
+            return None
+
+        if response is not None:
+            self.raw_response = response
+            response = minidom.parseString(response)
+        else:
+            c = Context(shippingdata)
+            t = loader.get_template('shipping/fedex/request.xml')
+            request = t.render(c)
+            try:
+                response = self._process_request(connection, request)
+            except urllib2.URLError:
+                log.warn("Error opening url: %s", connection)
+                rates.set_error(connection)
+                return None
+
+            if verbose:
+                log.debug("Fedex request: %s", request)
+                log.debug("Fedex response: %s", self.raw_response)
+
+            error = self._check_for_error(response)
+            if error:
+                rates.set_error(error[0])
+                return None
+            rates.set(self.raw_response)
+
+        this_charge = float(response.documentElement.getElementsByTagName('NetCharge')[0].firstChild.nodeValue)
+        this_discount = float(response.documentElement.getElementsByTagName('EffectiveNetDiscount')[0].firstChild.nodeValue)
+        delivery_days = response.documentElement.getElementsByTagName('TimeInTransit')[0].firstChild.nodeValue
+        return (this_charge + this_discount, delivery_days)
     
     def calculate(self, cart, contact):
         '''
@@ -228,28 +278,12 @@ class Shipper(BaseShipper):
             }
             signals.shipping_data_query.send(Shipper, shipper=self, cart=cart, shippingdata=shippingdata)
 
-            c = Context(shippingdata)
-            t = loader.get_template('shipping/fedex/request.xml')
-            request = t.render(c)
-
-            try:
-                response = self._process_request(connection, request)
-                error = self._check_for_error(response)
-            
-                if verbose:
-                    log.debug("Fedex request: %s", request)
-                    log.debug("Fedex response: %s", self.raw_response)
-
-                if not error:
-                    this_charge = float(response.documentElement.getElementsByTagName('NetCharge')[0].firstChild.nodeValue)
-                    this_discount = float(response.documentElement.getElementsByTagName('EffectiveNetDiscount')[0].firstChild.nodeValue)
-                    self.delivery_days = response.documentElement.getElementsByTagName('TimeInTransit')[0].firstChild.nodeValue
-
-                    total_cost = this_charge + this_discount
-                    self.charges += total_cost
-            except urllib2.URLError:
-                log.warn("Error opening url: %s", connection)
+            quote = self._quote(connection, shippingdata, verbose)
+            if quote is None:
                 error = True
+            else:
+                total_cost, self.delivery_days = quote
+                self.charges += total_cost
                 
         else:
             # process each shippable separately
@@ -263,35 +297,26 @@ class Shipper(BaseShipper):
             # So, to simulate this functionality, and return a total 
             # price, we have to loop through all of our items, and 
             # pray the customer isn't ordering a thousand boxes of bagels.
+            #
+            # Boxes with the same weight and price share a quote.
             for product in cart.get_shipment_list():
-                c = Context({
+                shippingdata = {
                   'config': configuration,
                   'box_weight' : '%.1f' % (product.weight or 0.0),
                   'box_weight_units' : product.weight_units and product.weight_units.upper() or 'LB',
                   'box_price' : '%.2f' % product.unit_price,
                   'contact': contact,
-                })
-    
-                t = loader.get_template('shipping/fedex/request.xml')
-                request = t.render(c)
-
-                response = self._process_request(connection, request)
-                error = self._check_for_error(response)
-                
-                if verbose:
-                    log.debug("Fedex request: %s", request)
-                    log.debug("Fedex response: %s", self.raw_response)
-
-                if not error:
-                    this_charge = float(response.documentElement.getElementsByTagName('NetCharge')[0].firstChild.nodeValue)
-                    this_discount = float(response.documentElement.getElementsByTagName('EffectiveNetDiscount')[0].firstChild.nodeValue)
-                    self.delivery_days = response.documentElement.getElementsByTagName('TimeInTransit')[0].firstChild.nodeValue
-
-                    total_cost = this_charge + this_discount
-                    self.charges += total_cost
-                    
-                else:
+                  'shipping_address' : shop_details,
+                  'shipping_phone' : shop_details.phone,
+                  'shipping_country_code' : shop_details.country.iso2_code
+                }
+
+                quote = self._quote(connection, shippingdata, verbose)
+                if quote is None:
+                    error = True
                     break
+                total_cost, self.delivery_days = quote
+                self.charges += total_cost
 
         if not error:
             self.charges = str(self.charges)
@@ -12,12 +12,12 @@ It is recommended that you refer to the UPS shipper developer documents
 unique needs.
 """
 
-from django.core.cache import cache
 from django.template import Context, loader
 from django.utils.translation import ugettext as _
 from livesettings import config_get_group, config_value
 from shipping import signals
-from shipping.modules.base import BaseShipper
+from shipping.modules.base import BaseShipper, RateCache, RateUnavailable, shipment_packages, shipment_signature
+from satchmo_utils.httpclient import urlopen
 import logging
 import urllib2
 
@@ -34,7 +34,8 @@ except ImportError:
 
 log = logging.getLogger('ups.shipper')
 class Shipper(BaseShipper):
-    
+    remote_quote = True
+
     def __init__(self, cart=None, contact=None, service_type=None):
         self._calculated = False
         self.cart = cart
@@ -97,7 +98,7 @@ class Shipper(BaseShipper):
         Post the data and return the XML response
         """
         conn = urllib2.Request(url=connection, data=request.encode("utf-8"))
-        f = urllib2.urlopen(conn)
+        f = urlopen(conn)
         all_results = f.read()
         self.raw = all_results
         return(fromstring(all_results))
@@ -133,56 +134,67 @@ class Shipper(BaseShipper):
                 'shipping_country_code' : shop_details.country.iso2_code
         }
         signals.shipping_data_query.send(Shipper, shipper=self, cart=cart, shippingdata=shippingdata)
-        c = Context(shippingdata)
-        t = loader.get_template('shipping/ups/request.xml')
-        request = t.render(c)
         self.is_valid = False
+        self._calculated = False
         if settings.LIVE.value:
             connection = settings.CONNECTION.value
         else:
             connection = settings.CONNECTION_TEST.value
-        cache_key_response = "ups-cart-%s-response" % int(cart.id)
-        cache_key_request = "ups-cart-%s-request" % int(cart.id)
-        last_request = cache.get(cache_key_request)
-        tree = cache.get(cache_key_response)
 
-        if (last_request != request) or tree is None:
-            self.verbose_log("Requesting from UPS [%s]\n%s", cache_key_request, request)
-            cache.set(cache_key_request, request, 60)
-            tree = self._process_request(connection, request)
-            self.verbose_log("Got from UPS [%s]:\n%s", cache_key_response, self.raw)
-            needs_cache = True
+        # UPS bills by the pound, and returns the rates of every service
+        signature = shipment_signature(shippingdata['shipping_address'],
+            contact.shipping_address,
+            shipment_packages(cart.get_shipment_list(), weight_step='1'),
+            service=(connection, configuration['account'],
+                configuration['pickup'], configuration['container']),
+            origin_country=shippingdata['shipping_country_code'])
+        rates = RateCache('UPS', signature)
+        try:
+            response = rates.get()
+        except RateUnavailable:
+            self.verbose_log("UPS recently failed to quote this shipment")
+            return
+
+        if response is None:
+            c = Context(shippingdata)
+            t = loader.get_template('shipping/ups/request.xml')
+            request = t.render(c)
+            self.verbose_log("Requesting from UPS for cart #%s\n%s", int(cart.id), request)
+            try:
+                tree = self._process_request(connection, request)
+            except urllib2.URLError, e:
+                log.warn("Error opening url: %s - %s", connection, e)
+                rates.set_error(str(e))
+                return
+            self.verbose_log("Got from UPS for cart #%s:\n%s", int(cart.id), self.raw)
         else:
-            needs_cache = False
+            self.raw = response
+            tree = fromstring(response)
 
         try:
             status_code = tree.getiterator('ResponseStatusCode')
             status_val = status_code[0].text
             self.verbose_log("UPS Status Code for cart #%s = %s", int(cart.id), status_val)
-        except AttributeError:
+        except (AttributeError, IndexError):
             status_val = "-1"
         
         if status_val == '1':
-            self.is_valid = False
-            self._calculated = False
+            if response is None:
+                rates.set(self.raw)
             all_rates = tree.getiterator('RatedShipment')
-            for response in all_rates:
-                if self.service_type_code == response.find('.//Service/Code/').text:
-                    self.charges = response.find('.//TotalCharges/MonetaryValue').text
-                    if response.find('.//GuaranteedDaysToDelivery').text:
-                        self.delivery_days = response.find('.//GuaranteedDaysToDelivery').text
+            for rated in all_rates:
+                if self.service_type_code == rated.find('.//Service/Code/').text:
+                    self.charges = rated.find('.//TotalCharges/MonetaryValue').text
+                    if rated.find('.//GuaranteedDaysToDelivery').text:
+                        self.delivery_days = rated.find('.//GuaranteedDaysToDelivery').text
                     self.is_valid = True
                     self._calculated = True
-                    if needs_cache:
-                        cache.set(cache_key_response, tree, 60)
                         
             if not self.is_valid:
                 self.verbose_log("UPS Cannot find rate for code: %s [%s]", self.service_type_code, self.service_type_text)
         
         else:
-            self.is_valid = False
-            self._calculated = False
-
+            rates.set_error(self.raw)
             try:
                 errors = tree.find('.//Error')
                 log.info("UPS %s Error: Code %s - %s" % (errors[0].text, errors[1].text, errors[2].text))
@@ -19,12 +19,12 @@ except:
     from django.utils._decimal import Decimal
 
 from django.utils.translation import ugettext as _
-from shipping.modules.base import BaseShipper
+from shipping.modules.base import BaseShipper, RateCache, RateUnavailable, round_up, shipment_signature
+from satchmo_utils.httpclient import urlopen
 from django.template import Context, loader
 from l10n.models import Country
 from livesettings import config_get_group, config_value
 import urllib2
-from django.core.cache import cache
 import logging
 try:
     from xml.etree.ElementTree import fromstring, tostring
@@ -103,6 +103,7 @@ APIS = {'PRIORITY': 'PriorityMail',
 
 log = logging.getLogger('usps.shipper')
 class Shipper(BaseShipper):
+    remote_quote = True
 
     def __init__(self, cart=None, contact=None, service_type=None):
         self._calculated = False
@@ -183,22 +184,48 @@ class Shipper(BaseShipper):
         data = 'API=%s&XML=%s' % (api, request.encode('utf-8'))
 
         conn = urllib2.Request(url=connection, data=data)
-        f = urllib2.urlopen(conn)
+        f = urlopen(conn)
         all_results = f.read()
-
-        log.error(all_results)
+        self.raw = all_results
 
         return (fromstring(all_results))
 
-    def render_template(self, template, cart=None, contact=None):
-        from satchmo_store.shop.models import Config
-        shop_details = Config.objects.get_current()
-        settings =  config_get_group('shipping.modules.usps')
+    def _fetch(self, connection, signature, template, cart, contact, api=None):
+        """
+        Return the parsed response to the request rendered from `template`, from
+        the shared rate cache if possible, or None if USPS recently failed to answer it.
+        """
+        rates = RateCache('USPS', signature)
+        try:
+            response = rates.get()
+        except RateUnavailable:
+            self.verbose_log("USPS recently failed to quote this shipment")
+            return None
 
+        if response is not None:
+            self.raw = response
+            return fromstring(response)
+
+        request = self.render_template(template, cart, contact)
+        self.verbose_log("Requesting from USPS for cart #%s\n%s", int(cart.id), request)
+        try:
+            tree = self._process_request(connection, request, api)
+        except urllib2.URLError, e:
+            log.warn("Error opening url: %s - %s", connection, e)
+            rates.set_error(str(e))
+            return None
+        self.verbose_log("Got from USPS for cart #%s:\n%s", int(cart.id), self.raw)
+
+        if len(tree.getiterator('Error')):
+            rates.set_error(self.raw)
+        else:
+            rates.set(self.raw)
+        return tree
+
+    def _mail_type(self):
+        """Set the API used for delivery estimates, and return the mail type."""
         if not self.is_intl:
             mail_type = CODES[self.service_type_code]
-            if mail_type == 'INTL': return ''
-        
             if mail_type == 'FIRST CLASS':
                 self.api = None
             else:
@@ -206,12 +233,25 @@ class Shipper(BaseShipper):
         else:
             mail_type = None
             self.api = None
-        
-        # calculate the weight of the entire order
+        return mail_type
+
+    def _weight(self, cart):
+        """Calculate the weight of the entire order"""
         weight = Decimal('0.0')
-        for item in cart.cartitem_set.all():
+        for item in cart:
             if item.product.smart_attr('weight'):
                 weight += item.product.smart_attr('weight') * item.quantity
+        return weight
+
+    def render_template(self, template, cart=None, contact=None):
+        from satchmo_store.shop.models import Config
+        shop_details = Config.objects.get_current()
+        settings =  config_get_group('shipping.modules.usps')
+
+        mail_type = self._mail_type()
+        if mail_type == 'INTL': return ''
+        
+        weight = self._weight(cart)
         self.verbose_log('WEIGHT: %s' % weight)
 
         # I don't know why USPS made this one API different this way...
@@ -260,28 +300,26 @@ class Shipper(BaseShipper):
             template = 'shipping/usps/request.xml'
         else:
             template = 'shipping/usps/request_intl.xml'
-        request = self.render_template(template, cart, contact)
         self.is_valid = False
+        self._calculated = False
 
         if settings.LIVE.value:
             connection = settings.CONNECTION.value
         else:
             connection = settings.CONNECTION_TEST.value
 
-        cache_key_response = "usps-cart-%s-response" % int(cart.id)
-        cache_key_request = "usps-cart-%s-request" % int(cart.id)
-        last_request = cache.get(cache_key_request)
-
-        tree = cache.get(cache_key_response)
-
-        if (last_request != request) or tree is None:
-            self.verbose_log("Requesting from USPS [%s]\n%s", cache_key_request, request)
-            cache.set(cache_key_request, request, 60)
-            tree = self._process_request(connection, request)
-            self.verbose_log("Got from USPS [%s]:\n%s", cache_key_response, self.raw)
-            needs_cache = True
+        # USPS rates by the ounce, and answers for the whole mail type at once
+        mail_type = self._mail_type()
+        if self.is_intl:
+            service = (connection, settings.USER_ID.value, self.is_intl, str(cart.total))
         else:
-            needs_cache = False
+            service = (connection, settings.USER_ID.value, mail_type, settings.SHIPPING_CONTAINER.value)
+        packages = ((round_up(self._weight(cart), '0.0625'),),)
+        signature = shipment_signature(shop_details, contact.shipping_address, packages, service=service)
+
+        tree = self._fetch(connection, signature, template, cart, contact)
+        if tree is None:
+            return
 
         errors = tree.getiterator('Error')
 
@@ -306,8 +344,6 @@ class Shipper(BaseShipper):
                             self._calculated = True
                             self.exact_date = True
 
-                            #if needs_cache:
-                            #    cache.set(cache_key_response, tree, 60)
             else:
                 for package in all_packages:
                     for postage in package.getiterator('Postage'):
@@ -317,10 +353,15 @@ class Shipper(BaseShipper):
 
                             # Now try to figure out how long it would take for this delivery
                             if self.api:
-                                delivery = self.render_template('shipping/usps/delivery.xml', cart, contact)
-                                del_tree = self._process_request(connection, delivery, self.api)
+                                del_signature = shipment_signature(shop_details,
+                                    contact.shipping_address, (), service=(connection, settings.USER_ID.value, self.api))
+                                del_tree = self._fetch(connection, del_signature,
+                                    'shipping/usps/delivery.xml', cart, contact, self.api)
                                 parent = '%sResponse' % self.api
-                                del_iter = del_tree.getiterator(parent)
+                                if del_tree is None:
+                                    del_iter = []
+                                else:
+                                    del_iter = del_tree.getiterator(parent)
 
                                 if len(del_iter):
                                     i = del_iter[0]
@@ -337,8 +378,6 @@ class Shipper(BaseShipper):
                             self.is_valid = True
                             self._calculated = True
 
-                            #if needs_cache:
-                            #    cache.set(cache_key_response, tree, 60)
         else:
             error = errors[0]
             err_num = error.find('.//Number').text
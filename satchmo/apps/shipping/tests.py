@@ -3,16 +3,57 @@ from django.test import TestCase
 import keyedcache
 from livesettings import config_value
 from product.models import *
+from shipping.modules.base import BaseShipper, RateCache, RateUnavailable, shipment_packages, shipment_signature
 from shipping.modules.flat.shipper import Shipper as flat
 from shipping.modules.per.shipper import Shipper as per
+from shipping.utils import calculate_quotes
 from satchmo_store.shop.models import *
 from django.contrib.sites.models import Site
+import BaseHTTPServer
+import threading
+import time
+import urllib2
 
 try:
     from decimal import Decimal
 except ImportError:
     from django.utils._decimal import Decimal
 
+class StubCarrierHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers /<seconds> with a quote after sleeping that many seconds,
+    and /error with a server error."""
+
+    def do_GET(self):
+        if self.path == '/error':
+            self.send_error(500)
+            return
+        time.sleep(float(self.path.strip('/')))
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write('5.00')
+
+    def log_message(self, *args):
+        pass
+
+class StubCarrierShipper(BaseShipper):
+    remote_quote = True
+
+    def __init__(self, id, url):
+        super(StubCarrierShipper, self).__init__()
+        self.id = id
+        self.url = url
+        self.amount = None
+
+    def calculate(self, cart, contact):
+        super(StubCarrierShipper, self).calculate(cart, contact)
+        self.amount = Decimal(urllib2.urlopen(self.url).read())
+
+    def cost(self):
+        return self.amount
+
+    def valid(self, order=None):
+        return self.amount is not None
+
 class ShippingBaseTest(TestCase):
 
     fixtures = ['l10n-data.yaml','test_shop.yaml']
@@ -49,3 +90,61 @@ class ShippingBaseTest(TestCase):
         self.assert_(self.cart1.is_shippable)
         self.assertEqual(flat(self.cart1, None).cost(), Decimal("4.00"))
         self.assertEqual(per(self.cart1, None).cost(), Decimal("12.00"))
+
+    def test_concurrent_quotes(self):
+        server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), StubCarrierHandler)
+        t = threading.Thread(target=server.serve_forever)
+        t.setDaemon(True)
+        t.start()
+        url = 'http://127.0.0.1:%i/' % server.server_port
+
+        fast = StubCarrierShipper('fast', url + '0.1')
+        fast2 = StubCarrierShipper('fast2', url + '0.1')
+        slow = StubCarrierShipper('slow', url + '3')
+        broken = StubCarrierShipper('broken', url + 'error')
+        local = flat()
+
+        start = time.time()
+        methods = calculate_quotes([slow, fast, local, broken, fast2],
+            self.cart1, None, timeout=1, threads=4)
+        elapsed = time.time() - start
+
+        self.assertEqual([m.id for m in methods], ['fast', local.id, 'fast2'])
+        self.assertEqual(fast.cost(), Decimal('5.00'))
+        self.assert_(elapsed < 2, "waited %.1f seconds for the slow carrier" % elapsed)
+
+        # a carrier may ask for more time
+        slow = StubCarrierShipper('slow', url + '0.5')
+        slow.quote_timeout = 2
+        methods = calculate_quotes([slow], self.cart1, None, timeout=0.2, threads=1)
+        self.assertEqual(methods, [slow])
+
+    def test_rate_cache(self):
+        shop = Config.objects.get_current()
+        self.product1.weight = Decimal('2.3')
+        self.product1.weight_units = 'lb'
+        self.product1.save()
+        cart2 = Cart.objects.create(site=self.site)
+        cart2.add_item(self.product1, 3)
+
+        # weights are rounded up to the carrier's granularity
+        packages = shipment_packages(self.cart1.get_shipment_list(), weight_step='1')
+        self.assertEqual(packages[0][:2], ('3', 'LB'))
+        self.assertEqual(len(packages), 3)
+
+        sig1 = shipment_signature(shop, shop, packages, service='ground')
+        sig2 = shipment_signature(shop, shop,
+            shipment_packages(cart2.get_shipment_list(), weight_step='1'), service='ground')
+        self.assertEqual(sig1, sig2)
+
+        rates = RateCache('Test', sig1)
+        self.assertEqual(rates.get(), None)
+        rates.set('<rates/>')
+        self.assertEqual(RateCache('Test', sig2).get(), '<rates/>')
+        self.assertEqual(RateCache('Test', shipment_signature(shop, shop, packages, service='air')).get(), None)
+
+        rates.set_error('down')
+        self.assertRaises(RateUnavailable, RateCache('Test', sig2).get)
+
+        RateCache.flush('Test')
+        self.assertEqual(rates.get(), None)
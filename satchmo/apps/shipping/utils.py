@@ -3,7 +3,16 @@ try:
 except:
     from django.utils._decimal import Decimal
 
+from django.db import connection
+from livesettings import config_value
 from shipping.config import shipping_method_by_key
+from threaded_multihost.threadlocals import get_current_request, set_thread_variable
+import logging
+import Queue
+import threading
+import time
+
+log = logging.getLogger('shipping.utils')
 
 def update_shipping(order, shipping, contact, cart):
     """Set the shipping for this order"""
@@ -17,3 +26,90 @@ def update_shipping(order, shipping, contact, cart):
     order.shipping_method = shipper.method()
     order.shipping_cost = shipper.cost()
     order.shipping_model = shipping
+
+def _quote_worker(work, results, cart, contact, request):
+    if request is not None:
+        set_thread_variable('request', request)
+    try:
+        while True:
+            try:
+                method = work.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                method.calculate(cart, contact)
+                results.put((method, None))
+            except Exception, e:
+                results.put((method, e))
+    finally:
+        # each thread has its own connection, don't leave it open
+        connection.close()
+
+def calculate_quotes(methods, cart, contact, request=None, timeout=None, threads=None):
+    """Calculate every shipping method for the cart, returning the methods
+    which finished in time, in their original order.
+
+    Methods which ask a carrier for a quote (those with `remote_quote` set)
+    are run on a bounded pool of threads, each one given `quote_timeout`
+    seconds, or the SHIPPING.QUOTE_TIMEOUT setting, from the start of the
+    call.  Carriers which are too slow, or which fail, are left out.
+    """
+    if timeout is None:
+        timeout = config_value('SHIPPING', 'QUOTE_TIMEOUT')
+    if threads is None:
+        threads = config_value('SHIPPING', 'QUOTE_THREADS')
+
+    remote = [m for m in methods if getattr(m, 'remote_quote', False)]
+    pending = dict([(id(m), m) for m in remote])
+    done = {}
+
+    if threads < 1:
+        pending = {}
+    elif pending:
+        if request is None:
+            request = get_current_request()
+        # load the cart contents once, before the threads share it
+        len(cart)
+
+        start = time.time()
+        work = Queue.Queue()
+        results = Queue.Queue()
+        deadlines = {}
+        for method in remote:
+            work.put(method)
+            deadlines[id(method)] = start + getattr(method, 'quote_timeout', timeout)
+
+        for i in range(min(threads, len(remote))):
+            t = threading.Thread(target=_quote_worker,
+                args=(work, results, cart, contact, request))
+            t.setDaemon(True)
+            t.start()
+
+    for method in methods:
+        if id(method) not in pending:
+            method.calculate(cart, contact)
+            done[id(method)] = True
+
+    while pending:
+        wait = max([deadlines[key] for key in pending]) - time.time()
+        try:
+            if wait <= 0:
+                raise Queue.Empty
+            method, error = results.get(True, wait)
+        except Queue.Empty:
+            for method in pending.values():
+                log.warn('Shipping quote from %s timed out', method.id)
+            break
+
+        key = id(method)
+        if key not in pending:
+            continue
+        del pending[key]
+        if error is not None:
+            log.error('Shipping quote from %s failed: %s', method.id, error)
+        elif time.time() > deadlines[key]:
+            log.warn('Shipping quote from %s timed out', method.id)
+        else:
+            done[key] = True
+
+    return [m for m in methods if id(m) in done]
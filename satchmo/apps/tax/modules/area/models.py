@@ -1,5 +1,6 @@
 from django.db import models
 from django.utils.translation import ugettext, ugettext_lazy as _
+from keyedcache.models import VersionedSnapshot
 from product.models import TaxClass
 from l10n.models import AdminArea, Country
 
@@ -35,6 +36,49 @@ class TaxRate(models.Model):
     class Meta:
         verbose_name = _("Tax Rate")
         verbose_name_plural = _("Tax Rates")
-        
+
+class TaxRateTable(VersionedSnapshot):
+    """Every tax rate and tax class, loaded with two queries.
+
+    Kept in process and reloaded when its version stamp is changed by a tax
+    rate or tax class being saved or deleted.
+    """
+
+    cache_name = 'TaxRateTable'
+
+    def __init__(self):
+        self.classes = {}
+        for taxclass in TaxClass.objects.all():
+            self.classes.setdefault(taxclass.title.lower(), taxclass)
+
+        self.zones = {}
+        self.countries = {}
+        for rate in TaxRate.objects.all():
+            if rate.taxZone_id:
+                self.zones.setdefault((rate.taxClass_id, rate.taxZone_id), rate)
+            if rate.taxCountry_id:
+                self.countries.setdefault((rate.taxClass_id, rate.taxCountry_id), rate)
+
+    def get_class(self, title):
+        """The tax class with this title, ignoring case, or None."""
+        return self.classes.get(title.lower(), None)
+
+    def get_rate(self, taxclass, area=None, country=None):
+        """The TaxRate of the tax class for the area, else for the country, or None."""
+        rate = None
+        if area:
+            rate = self.zones.get((taxclass.id, area.id), None)
+        if rate is None and country:
+            rate = self.countries.get((taxclass.id, country.id), None)
+        return rate
+
+def _tax_changed(sender, **kwargs):
+    TaxRateTable.invalidate()
+
+models.signals.post_save.connect(_tax_changed, sender=TaxRate)
+models.signals.post_delete.connect(_tax_changed, sender=TaxRate)
+models.signals.post_save.connect(_tax_changed, sender=TaxClass)
+models.signals.post_delete.connect(_tax_changed, sender=TaxClass)
+
 import config
 
@@ -9,8 +9,8 @@ from livesettings import config_value
 from satchmo_store.contact.models import Contact
 from l10n.models import AdminArea, Country
 from satchmo_utils import is_string_like
-from product.models import TaxClass
-from models import TaxRate
+from models import TaxRateTable
+from threaded_multihost.threadlocals import get_current_request
 import logging
 
 log = logging.getLogger('tax.area')
@@ -26,8 +26,25 @@ class Processor(object):
         """
         self.order = order
         self.user = user
+        self._location = None
         
+    def _location_key(self):
+        """What the location depends on, so that it is looked up once per
+        order, or once per request for a user."""
+        if self.order:
+            return (self.order.ship_country, self.order.ship_state)
+        elif self.user and self.user.is_authenticated():
+            return (self.user.id, get_current_request())
+        else:
+            return None
+
     def _get_location(self):
+        key = self._location_key()
+        if self._location is None or self._location[0] != key:
+            self._location = (key, self._find_location())
+        return self._location[1]
+
+    def _find_location(self):
         area=country=None
         
         if self.order:
@@ -85,26 +102,14 @@ class Processor(object):
         if not (area or country):
             area, country = self._get_location()
             
+        table = TaxRateTable.get()
         if is_string_like(taxclass):
-            try:
-                taxclass = TaxClass.objects.get(title__iexact=taxclass)
-            
-            except TaxClass.DoesNotExist:
-                raise ImproperlyConfigured("Can't find a '%s' Tax Class", taxclass)            
+            title = taxclass
+            taxclass = table.get_class(title)
+            if taxclass is None:
+                raise ImproperlyConfigured("Can't find a '%s' Tax Class", title)
             
-        if area:
-            try:
-                rate = TaxRate.objects.get(taxClass=taxclass, taxZone=area)
-                
-            except TaxRate.DoesNotExist:
-                rate = None
-                
-        if not rate:
-            try:
-                rate = TaxRate.objects.get(taxClass=taxclass, taxCountry=country)
-                
-            except TaxRate.DoesNotExist:
-                rate = None
+        rate = table.get_rate(taxclass, area=area, country=country)
         
         log.debug("Got rate [%s] = %s", taxclass, rate)
         if get_object:
@@ -147,8 +152,7 @@ class Processor(object):
             rate = None
             if config_value('TAX','TAX_SHIPPING'):
                 try:
-                    tc = TaxClass.objects.get(title=config_value('TAX', 'TAX_CLASS'))
-                    rate = self.get_rate(taxclass=tc)
+                    rate = self.get_rate(taxclass=config_value('TAX', 'TAX_CLASS'))
                 except:
                     log.error("'Shipping' TaxClass doesn't exist.")
 
@@ -177,7 +181,7 @@ class Processor(object):
         taxes = {}
         
         rates = {}
-        for item in order.orderitem_set.filter(product__taxable=True):
+        for item in order.taxable_items():
             tc = item.product.taxClass
             if tc:
                 tc_key = tc.title
@@ -68,7 +68,7 @@ class Processor(object):
         percent = config_value('TAX','PERCENT')    
 
         sub_total = Decimal("0.00")
-        for item in order.orderitem_set.filter(product__taxable=True):
+        for item in order.taxable_items():
             sub_total += item.sub_total
         
         itemtax = sub_total * (percent/100)
@@ -79,6 +79,30 @@ class TaxTest(TestCase):
         self.assertEqual(tmain.tax, Decimal('16.00'))
         self.assertEqual(tship.tax, Decimal('0.00'))
         
+    def testAreaRateTable(self):
+        """Test that area tax rates are looked up in memory, and reloaded on changes"""
+        from tax.modules.area.models import TaxRateTable
+        from tax.modules.area.processor import Processor
+        cache_delete()
+
+        order = make_test_order('DE', '')
+        processor = Processor(order=order)
+        table = TaxRateTable.get()
+        self.assert_(TaxRateTable.get() is table)
+
+        rate = processor.get_rate('default', get_object=True)
+        self.assertEqual(rate.percentage, Decimal('0.2'))
+        self.assertEqual(processor.get_rate('Default'), Decimal('0.2'))
+
+        rate.percentage = Decimal('0.25')
+        rate.save()
+        self.assert_(TaxRateTable.get() is not table)
+        self.assertEqual(processor.get_rate('Default'), Decimal('0.25'))
+
+        # the location follows the order
+        order.ship_country = 'CH'
+        self.assertEqual(processor.get_rate('Default'), Decimal('0.16'))
+
     def testDuplicateAdminAreas(self):
         """Test the situation where we have multiple adminareas with the same name"""
         cache_delete()